@@ -0,0 +1,90 @@
+""" Benchmark MF4 compressions on real logs: write time, file size and read back time of the raw and decoded MF4
+
+    python benchmark_compression.py in_logs/*.log --dbc dbc/*.dbc [--compressions none deflate transposed_deflate] [--json]
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from asammdf import MDF
+
+from dbc_cache import DbcCache
+from helpers import read_log_to_frames, frames_to_mf4, mf4_compression
+
+DEFAULT_COMPRESSIONS = ["none", "deflate", "transposed_deflate"]
+
+
+def read_back(path: Path) -> None:
+    """ Open an MF4 and load the samples of every channel """
+    with MDF(path) as mf4:
+        for index, group in enumerate(mf4.groups):
+            mf4.select([(None, index, channel) for channel in range(len(group.channels))], raw=True)
+
+
+def benchmark_mf4(mf4: MDF, name: str, output: str, compressions: list[str], folder: Path, repeat: int = 1) -> list[dict]:
+    """ Save mf4 with every compression and read it back, the best of repeat runs is reported """
+    results = []
+    for compression in compressions:
+        path = folder / f"{output}-{compression}.mf4"
+        write_seconds = read_seconds = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            mf4.save(path, overwrite=True, compression=mf4_compression(compression))
+            write_seconds = min(write_seconds, time.perf_counter() - start)
+            start = time.perf_counter()
+            read_back(path)
+            read_seconds = min(read_seconds, time.perf_counter() - start)
+        results.append({
+            "log": name,
+            "output": output,
+            "compression": compression,
+            "write_seconds": write_seconds,
+            "size_bytes": path.stat().st_size,
+            "read_seconds": read_seconds,
+        })
+        path.unlink()
+    uncompressed = next((r["size_bytes"] for r in results if r["compression"] == "none"), None)
+    for result in results:
+        result["size_ratio"] = result["size_bytes"] / uncompressed if uncompressed else None
+    return results
+
+
+def benchmark_log(log: Path, dbc_files: list[Path], compressions: list[str], repeat: int = 1) -> list[dict]:
+    """ Results for the raw MF4 of a log and, with DBC files, for its decoded MF4 """
+    timestamps, frames, meta, _ = read_log_to_frames(log)
+    raw_mf4 = frames_to_mf4(timestamps, frames)
+    with tempfile.TemporaryDirectory() as folder:
+        results = benchmark_mf4(raw_mf4, log.name, "raw", compressions, Path(folder), repeat)
+        if dbc_files:
+            cache = DbcCache()
+            decoded_mf4 = raw_mf4.extract_bus_logging({"CAN": cache.get_databases([(f, 0) for f in dbc_files])})
+            results += benchmark_mf4(decoded_mf4, log.name, "decoded", compressions, Path(folder), repeat)
+            decoded_mf4.close()
+    raw_mf4.close()
+    return results
+
+
+def format_results(results: list[dict]) -> str:
+    lines = [f"{'log':30} {'output':8} {'compression':20} {'write s':>9} {'size MiB':>10} {'ratio':>6} {'read s':>9}"]
+    for r in results:
+        ratio = f"{r['size_ratio']:.3f}" if r["size_ratio"] is not None else "-"
+        lines.append(f"{r['log'][:30]:30} {r['output']:8} {r['compression']:20} {r['write_seconds']:9.3f} "
+                     f"{r['size_bytes'] / 2**20:10.2f} {ratio:>6} {r['read_seconds']:9.3f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark MF4 compressions for the raw and decoded output")
+    arg_parser.add_argument("logs", nargs="+", type=Path, help="input log files")
+    arg_parser.add_argument("--dbc", nargs="*", type=Path, default=[], help="DBC files to benchmark the decoded MF4 with")
+    arg_parser.add_argument("--compressions", nargs="+", default=DEFAULT_COMPRESSIONS)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per compression, the fastest is reported")
+    arg_parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = arg_parser.parse_args()
+
+    for compression in args.compressions:
+        mf4_compression(compression) # fail before running anything
+    results = [r for log in args.logs for r in benchmark_log(log, args.dbc, args.compressions, args.repeat)]
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
@@ -0,0 +1,294 @@
+""" End to end benchmark of the log conversion on synthetic logs: time and peak memory of every processing stage
+
+    DATA_FOLDER=/tmp/benchmark DB_BACKEND=sqlite python benchmark_pipeline.py --frames 1M 10M 50M --output results.json [--compare old.json]
+
+    Runs against the SQLite database of DATA_FOLDER, use a scratch folder. Peak memory is the peak of the memory
+    allocated while a stage runs as traced by tracemalloc, numpy and pandas buffers included.
+"""
+import argparse
+import json
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable
+
+import asammdf
+import numpy as np
+import pandas as pd
+from dateutil import parser
+
+from config import DATABASE_CONFIG
+from database.crud import get_all_logs_for_unit, delete_log_file, replace_can_id_stats, replace_log_signals
+from helpers import read_log_to_df, read_log_to_frames, df_to_mf4, frames_to_mf4, EOF_MARKER, FRAME_COLUMNS
+import log_converter
+from log_converter import save_mf4_files, merge_continued_logs, process_new_files, setup_environment
+
+UNIT_TYPE = "benchmark"
+UNIT_NUMBER = "BENCHMARK"
+LOG_FORMATS = ["csv", "dat"]
+STAGES = ["read_log_to_df", "df_to_mf4", "save_mf4_files", "merge_continued_logs", "process_new_files"]
+# frames generated and written at once
+CHUNK_FRAMES = 500_000
+
+# (bus, CAN ID, extended, DLC, period in seconds) of a mixed J1939 and 11 bit bus
+MESSAGES = [
+    (1, 0x0CF00400, 1, 8, 0.01),
+    (1, 0x0CF00300, 1, 8, 0.05),
+    (1, 0x18FEF100, 1, 8, 0.1),
+    (1, 0x18FEF200, 1, 8, 0.1),
+    (1, 0x18FEEE00, 1, 8, 1.0),
+    (1, 0x18FEE500, 1, 8, 1.0),
+    (2, 0x100, 0, 8, 0.01),
+    (2, 0x200, 0, 8, 0.02),
+    (2, 0x391, 0, 8, 0.05),
+    (2, 0x03A, 0, 5, 0.1),
+]
+
+# lines like the ones loggers write when power is lost or a line is cut
+MALFORMED_LINES = {
+    "csv": ["0.108,1,0,3A1,8,00,04,04,22,00,69,32,C5,C6,C5,F3,454,3324", "EE,00,00,00,00,00", "0.1x7,1,0,381,6,00,00,08,FC,0E,0C"],
+    "dat": ["8.5x4-1-10B5B63F#548BA715D334", "8.544-1-187B8E", "8.544-12-3A#00", "-1-3A#FF00"],
+}
+
+HEX_BYTES = np.array([f"{i:02X}" for i in range(256)], dtype=object)
+
+
+def parse_count(value: str) -> int:
+    """ Frame counts like 1M, 500k or 2000 """
+    factors = {"k": 1_000, "m": 1_000_000}
+    if value[-1].lower() in factors:
+        return int(float(value[:-1]) * factors[value[-1].lower()])
+    return int(value)
+
+
+def synthetic_dbc() -> str:
+    """ A DBC that decodes every message of MESSAGES into a counter, a 16 bit value and an 8 bit value """
+    lines = ['VERSION ""', "", "NS_ :", "", "BS_:", "", "BU_: ECU", ""]
+    for bus, can_id, ext, dlc, period in MESSAGES:
+        name = f"MSG_{can_id:X}"
+        lines.append(f"BO_ {can_id | (0x80000000 if ext else 0)} {name}: {dlc} ECU")
+        lines.append(f' SG_ {name}_Counter : 0|16@1+ (1,0) [0|65535] "" Vector__XXX')
+        lines.append(f' SG_ {name}_Value : 16|16@1+ (0.125,0) [0|8191.875] "rpm" Vector__XXX')
+        lines.append(f' SG_ {name}_Temp : 32|8@1- (1,0) [-128|127] "degC" Vector__XXX')
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_frames(frames: int, seed: int = 0):
+    """ (timestamps, bus, ID, extended, DLC, data) chunks of at most about CHUNK_FRAMES of frames frames of MESSAGES
+        sent at their periods, in time order """
+    rng = np.random.default_rng(seed)
+    table = np.array([m[:4] for m in MESSAGES], dtype=np.int64)
+    periods = np.array([m[4] for m in MESSAGES])
+    offsets = rng.uniform(0, periods)
+    window = CHUNK_FRAMES / np.sum(1 / periods)
+    written = 0
+    start = 0.0
+    while written < frames:
+        # the k-th frame of a message is sent at offset + k * period
+        first = np.ceil((start - offsets) / periods).astype(np.int64)
+        last = np.ceil((start + window - offsets) / periods).astype(np.int64)
+        message = np.repeat(np.arange(len(MESSAGES)), last - first)
+        counter = np.concatenate([np.arange(f, l) for f, l in zip(first, last)])
+        timestamps = offsets[message] + counter * periods[message]
+        order = np.argsort(timestamps, kind='stable')[:frames - written]
+        message, counter, timestamps = message[order], counter[order], timestamps[order]
+
+        data = np.zeros((len(order), 8), dtype=np.uint8)
+        data[:, 0:2] = (counter & 0xFFFF).astype("<u2").view(np.uint8).reshape(-1, 2)
+        value = (4000 + 2000 * np.sin(timestamps / 30 + message)) / 0.125
+        data[:, 2:4] = value.astype("<u2").view(np.uint8).reshape(-1, 2)
+        data[:, 4] = rng.integers(0, 256, len(order))
+        data[:, 5:] = rng.integers(0, 256, (len(order), 3))
+        yield timestamps, table[message, 0], table[message, 1], table[message, 2], table[message, 3], data
+        written += len(order)
+        start += window
+
+
+def format_lines(log_format: str, timestamps, bus, can_id, ext, dlc, data) -> list[str]:
+    """ Log lines of frames, CSV lines have one column per data byte, DAT IDs have 3 hex digits or 8 when extended """
+    hex_data = HEX_BYTES[data]
+    if log_format == "csv":
+        return [f"{t:.3f},{b},{e},{i:X},{d}," + ",".join(h[:d]) for t, b, e, i, d, h in
+                zip(timestamps.tolist(), bus.tolist(), ext.tolist(), can_id.tolist(), dlc.tolist(), hex_data.tolist())]
+    return [f"{t:.3f}-{b}-{i:08X}#" + "".join(h[:d]) if e else f"{t:.3f}-{b}-{i:03X}#" + "".join(h[:d]) for t, b, e, i, d, h in
+            zip(timestamps.tolist(), bus.tolist(), ext.tolist(), can_id.tolist(), dlc.tolist(), hex_data.tolist())]
+
+
+def write_synthetic_logs(folder: Path, frames: int, log_format: str = "csv", files: int = 1, malformed_every: int = 0,
+                         start_time: datetime = datetime(2024, 3, 1, 8, tzinfo=timezone.utc), name: str = "synthetic",
+                         seed: int = 0) -> list[Path]:
+    """ Write frames synthetic frames as a chain of files logs that continue into each other: every file but the last
+        ends with the EOF continuation marker and the timestamps of every file start at 0. Every malformed_every-th
+        line is followed by a malformed line, 0 writes none. Returns the files in chain order. """
+    folder.mkdir(parents=True, exist_ok=True)
+    bounds = np.linspace(0, frames, files + 1).astype(np.int64)
+    paths = [folder / f"{name}_{i:03d}.log" for i in range(files)]
+    handles = [open(path, "w", newline="\n") for path in paths]
+    try:
+        file_index = -1
+        file_start = 0.0
+        written = 0
+        for timestamps, bus, can_id, ext, dlc, data in synthetic_frames(frames, seed):
+            position = 0
+            while position < len(timestamps):
+                if file_index < 0 or written == bounds[file_index + 1]:
+                    file_index += 1
+                    file_start = timestamps[position]
+                    meta = {"unit_type": UNIT_TYPE, "unit_number": UNIT_NUMBER}
+                    meta.update({f"can_{b}": {"bus_number": b, "bus_name": f"CAN{b}", "baudrate": rate, "log_std": 1, "log_ext": 1,
+                                              "id_filter_mask": 0, "id_filter_value": 0, "log_enabled": 1}
+                                 for b, rate in [(1, 250), (2, 500), (3, 250)]})
+                    meta["log_start_time"] = (start_time + timedelta(seconds=float(file_start))).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+                    meta["log_type"] = "DAT0.1" if log_format == "dat" else "CSV0.1"
+                    handles[file_index].write(json.dumps(meta) + "\n" + ",".join(FRAME_COLUMNS) + "\n")
+                end = position + min(len(timestamps) - position, bounds[file_index + 1] - written)
+                lines = format_lines(log_format, timestamps[position:end] - file_start, bus[position:end], can_id[position:end],
+                                     ext[position:end], dlc[position:end], data[position:end])
+                if malformed_every:
+                    bad = MALFORMED_LINES[log_format]
+                    for i in range(malformed_every - 1 - written % malformed_every, len(lines), malformed_every):
+                        lines[i] += "\n" + bad[(written + i) // malformed_every % len(bad)]
+                handles[file_index].write("\n".join(lines) + "\n")
+                written += end - position
+                position = end
+        for handle in handles[:-1]:
+            handle.write(EOF_MARKER.decode() + "\n")
+    finally:
+        for handle in handles:
+            handle.close()
+    return paths
+
+
+def measure(run: Callable, setup: Callable[[], tuple] = None, repeat: int = 1) -> tuple[float, int]:
+    """ Fastest of repeat timed runs and the peak memory allocated by one more run traced by tracemalloc, which
+        slows it down too much to time it. setup gives the arguments of a run and is neither timed nor traced. """
+    seconds = []
+    for _ in range(max(repeat, 1)):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        run(*args)
+        seconds.append(time.perf_counter() - start)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak
+
+
+def clean_benchmark_unit() -> None:
+    """ Remove the benchmark unit's logs from the database and its output files """
+    for log in get_all_logs_for_unit(UNIT_NUMBER):
+        replace_can_id_stats(log.id, [])
+        replace_log_signals(log.id, [])
+        delete_log_file(log.id)
+    shutil.rmtree(log_converter.OUTPUT_FILES / UNIT_TYPE, ignore_errors=True)
+    for path in log_converter.INPUT_FILES.glob(f"{UNIT_NUMBER}_*.log"):
+        path.unlink()
+
+
+def benchmark_size(frames: int, log_format: str, folder: Path, files: int = 2, malformed_every: int = 10000,
+                   repeat: int = 1, stages: list[str] = STAGES) -> list[dict]:
+    """ Results of every stage for synthetic logs of frames frames. merge_continued_logs and process_new_files
+        convert a chain of files logs with the same frames in total. """
+    setup_environment()
+    dbc_folder = log_converter.DBC_FOLDER / UNIT_TYPE
+    dbc_folder.mkdir(parents=True, exist_ok=True)
+    (dbc_folder / "synthetic.dbc").write_text(synthetic_dbc())
+    single = write_synthetic_logs(folder / "single", frames, log_format, malformed_every=malformed_every)[0]
+    chain = write_synthetic_logs(folder / "chain", frames, log_format, files=files, malformed_every=malformed_every, name=UNIT_NUMBER)
+    output_folder = folder / "out"
+
+    results = []
+    def add(stage: str, seconds: float, peak: int):
+        results.append({"stage": stage, "log_format": log_format, "frames": frames, "seconds": seconds, "peak_bytes": peak,
+                        "frames_per_second": frames / seconds if seconds else None})
+
+    df, meta, _ = read_log_to_df(single)
+    if "read_log_to_df" in stages:
+        add("read_log_to_df", *measure(lambda: read_log_to_df(single), repeat=repeat))
+    if "df_to_mf4" in stages:
+        add("df_to_mf4", *measure(lambda: df_to_mf4(df).close(), repeat=repeat))
+    del df
+
+    if "save_mf4_files" in stages:
+        timestamps, frame_table, meta, _ = read_log_to_frames(single)
+        meta.update({"unit_output_folder": output_folder, "file_stem": "benchmark_00001"})
+        (output_folder / "raw_logs").mkdir(parents=True, exist_ok=True)
+        add("save_mf4_files", *measure(lambda mf4: save_mf4_files(mf4, meta, []), lambda: (frames_to_mf4(timestamps, frame_table),), repeat))
+        del timestamps, frame_table
+
+    if "merge_continued_logs" in stages:
+        def first_file():
+            # the merge archives the continuation files, they are put back for every run
+            for path in chain[1:]:
+                shutil.copy(path, log_converter.INPUT_FILES / path.name)
+            timestamps, frame_table, meta, continues = read_log_to_frames(chain[0])
+            meta.update({"uuid": None, "log_num": 1, "unit_output_folder": output_folder, "log_len_seconds": timestamps[-1], "len": len(frame_table),
+                         "log_end_time": parser.parse(meta['log_start_time']) + timedelta(seconds=timestamps[-1])})
+            return timestamps, frame_table, meta, continues
+        add("merge_continued_logs", *measure(lambda t, f, m, c: merge_continued_logs(t, f, m, c, chain[0].name, [], [p.name for p in chain[1:]]),
+                                             first_file, repeat))
+        clean_benchmark_unit()
+
+    if "process_new_files" in stages:
+        def input_files():
+            clean_benchmark_unit()
+            for path in chain:
+                shutil.copy(path, log_converter.INPUT_FILES / path.name)
+            return ()
+        add("process_new_files", *measure(lambda: process_new_files(workers=1), input_files, repeat))
+        clean_benchmark_unit()
+    return results
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__, "asammdf": asammdf.__version__,
+            "machine": platform.machine(), "system": platform.system(), "time": datetime.now(timezone.utc).isoformat()}
+
+
+def format_results(results: list[dict], baseline: list[dict] = None) -> str:
+    """ A results table, with a baseline the time and memory of every stage relative to the same stage there """
+    old = {(r["stage"], r["log_format"], r["frames"]): r for r in baseline or []}
+    lines = [f"{'stage':22} {'format':6} {'frames':>11} {'seconds':>9} {'frames/s':>12} {'peak MiB':>9}" + (f" {'time':>6} {'memory':>6}" if baseline else "")]
+    for r in results:
+        line = f"{r['stage']:22} {r['log_format']:6} {r['frames']:11,} {r['seconds']:9.3f} {r['frames_per_second'] or 0:12,.0f} {r['peak_bytes'] / 2**20:9.1f}"
+        before = old.get((r["stage"], r["log_format"], r["frames"]))
+        if baseline:
+            line += f" {r['seconds'] / before['seconds']:6.2f} {r['peak_bytes'] / max(before['peak_bytes'], 1):6.2f}" if before else f" {'-':>6} {'-':>6}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the log conversion stages on synthetic logs")
+    arg_parser.add_argument("--frames", nargs="+", default=["1M"], help="frames per log, like 1M 10M 50M")
+    arg_parser.add_argument("--formats", nargs="+", default=LOG_FORMATS, choices=LOG_FORMATS)
+    arg_parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    arg_parser.add_argument("--files", type=int, default=2, help="files of the continuation chain")
+    arg_parser.add_argument("--malformed-every", type=int, default=10000, help="add a malformed line after every this many lines, 0 for none")
+    arg_parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage, the fastest is reported")
+    arg_parser.add_argument("--label", default="", help="name of the version being benchmarked")
+    arg_parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    arg_parser.add_argument("--compare", type=Path, help="JSON results of an earlier run to compare with")
+    args = arg_parser.parse_args()
+
+    if not DATABASE_CONFIG['sqlalchemy.url'].startswith("sqlite:///"):
+        arg_parser.error("the benchmark writes to the database, run it with DB_BACKEND=sqlite and a scratch DATA_FOLDER")
+    results = []
+    for frames in [parse_count(value) for value in args.frames]:
+        for log_format in args.formats:
+            with tempfile.TemporaryDirectory(dir=log_converter.DATA_FOLDER) as folder:
+                results += benchmark_size(frames, log_format, Path(folder), args.files, args.malformed_every, args.repeat, args.stages)
+    report = {"label": args.label, "environment": environment(), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+    print(format_results(results, baseline))
@@ -0,0 +1,119 @@
+import numpy as np
+
+# bits of a data frame without stuffing: SOF, ID, control, CRC, ACK, EOF and interframe space, plus 8 per data byte
+STD_FRAME_BITS = 47
+EXT_FRAME_BITS = 67
+
+
+def bus_baudrates(meta: dict) -> dict[int, float]:
+    """ The bit rate in bit/s of every bus in the can_<n> entries of a log header """
+    return {int(value['bus_number']): float(value['baudrate']) * 1000 for key, value in meta.items()
+            if key.startswith("can_") and isinstance(value, dict) and 'bus_number' in value and 'baudrate' in value}
+
+
+def frame_fields(timestamps: np.ndarray, frames: np.ndarray) -> tuple[np.ndarray, ...]:
+    """ (timestamps, bus, ID, IDE, DLC, data length) of CAN_SIGNAL_DTYPE frames """
+    return (timestamps, *[frames[f"CAN_DataFrame.{field}"] for field in ("BusChannel", "ID", "IDE", "DLC", "DataLength")])
+
+
+class CanIdStatsAccumulator:
+    """ Statistics of every (bus, CAN ID, IDE) of a log added chunk by chunk in log order, so a streamed log never needs
+        all of its frames at once. Per key it keeps the frame count, first and last timestamp, the sum and sum of
+        squares of the periods, the frames per DLC and the bits on the bus. """
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.first = np.empty(0)
+        self.last = np.empty(0)
+        self.period_sums = np.empty(0)
+        self.period_squares = np.empty(0)
+        self.dlc_counts = np.empty((0, 16), dtype=np.int64)
+        self.bit_sums = np.empty(0)
+
+    def add(self, timestamps: np.ndarray, bus: np.ndarray, can_id: np.ndarray, ide: np.ndarray, dlc: np.ndarray, data_length: np.ndarray) -> None:
+        """ Add the frames of the next chunk of the log, one sort of the chunk's frame table """
+        if len(timestamps) == 0:
+            return
+        can_id = can_id.astype(np.uint64) & 0x1FFFFFFF
+        keys = (bus.astype(np.uint64) << 34) | (can_id << 1) | ide.astype(np.uint64)
+        order = np.argsort(keys, kind='stable')
+        keys, timestamps = keys[order], timestamps[order]
+        starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+        ends = np.concatenate([starts[1:], [len(keys)]])
+        counts = ends - starts
+        group = np.repeat(np.arange(len(starts)), counts)
+
+        # periods between frames of the same ID, the first frame of each ID in the chunk has none
+        periods = np.diff(timestamps, prepend=timestamps[0])
+        periods[starts] = 0
+        ide_sorted = ide[order]
+        bits = np.where(ide_sorted, EXT_FRAME_BITS, STD_FRAME_BITS) + 8 * data_length[order].astype(np.int64)
+        self._merge(keys[starts], counts, timestamps[starts], timestamps[ends - 1],
+                    np.bincount(group, weights=periods), np.bincount(group, weights=periods ** 2),
+                    np.bincount(group * 16 + (dlc[order] & 0xF), minlength=len(starts) * 16).reshape(-1, 16),
+                    np.bincount(group, weights=bits))
+
+    def _merge(self, keys, counts, first, last, period_sums, period_squares, dlc_counts, bit_sums) -> None:
+        """ Merge the sums of the unique sorted keys of a chunk, the period from the last frame of a key before the
+            chunk to its first frame in the chunk joins the two """
+        all_keys = np.union1d(self.keys, keys)
+        old, new = np.searchsorted(all_keys, self.keys), np.searchsorted(all_keys, keys)
+
+        def expand(values: np.ndarray, fill) -> np.ndarray:
+            expanded = np.full((len(all_keys), *values.shape[1:]), fill, dtype=values.dtype)
+            expanded[old] = values
+            return expanded
+
+        previous_last = expand(self.last, np.nan)[new]
+        boundary = np.where(np.isnan(previous_last), 0, first - previous_last)
+        self.keys = all_keys
+        self.counts = expand(self.counts, 0)
+        self.counts[new] += counts
+        self.first = expand(self.first, np.nan)
+        self.first[new] = np.where(np.isnan(self.first[new]), first, self.first[new])
+        self.last = expand(self.last, np.nan)
+        self.last[new] = last
+        self.period_sums = expand(self.period_sums, 0)
+        self.period_sums[new] += period_sums + boundary
+        self.period_squares = expand(self.period_squares, 0)
+        self.period_squares[new] += period_squares + boundary ** 2
+        self.dlc_counts = expand(self.dlc_counts, 0)
+        self.dlc_counts[new] += dlc_counts
+        self.bit_sums = expand(self.bit_sums, 0)
+        self.bit_sums[new] += bit_sums
+
+    def results(self, log_len_seconds: float, baudrates: dict[int, float]) -> list[dict]:
+        """ Frame count, first and last timestamp, mean and standard deviation (jitter) of the period, frames per DLC
+            and the share of the bus bit rate the ID used over the log for every key. Times are seconds from the log
+            start, the bus load is None for buses without a bit rate in the header. """
+        period_counts = self.counts - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            period_mean = self.period_sums / period_counts
+            period_jitter = np.sqrt(np.maximum(self.period_squares / period_counts - period_mean ** 2, 0))
+
+        stats = []
+        for i, key in enumerate(self.keys.tolist()):
+            bus_number = key >> 34
+            baudrate = baudrates.get(bus_number)
+            stats.append({
+                "bus": bus_number,
+                "can_id": (key >> 1) & 0x1FFFFFFF,
+                "is_extended": bool(key & 1),
+                "frame_count": int(self.counts[i]),
+                "first_time": float(self.first[i]),
+                "last_time": float(self.last[i]),
+                "period_mean": float(period_mean[i]) if period_counts[i] else None,
+                "period_jitter": float(period_jitter[i]) if period_counts[i] else None,
+                "dlc_counts": {str(d): int(c) for d, c in enumerate(self.dlc_counts[i].tolist()) if c},
+                "bus_load": float(self.bit_sums[i] / (baudrate * log_len_seconds)) if baudrate and log_len_seconds > 0 else None,
+            })
+        return stats
+
+
+def can_id_stats(timestamps: np.ndarray, bus: np.ndarray, can_id: np.ndarray, ide: np.ndarray, dlc: np.ndarray, data_length: np.ndarray,
+                 log_len_seconds: float, baudrates: dict[int, float]) -> list[dict]:
+    """ Statistics of every (bus, CAN ID, IDE) in the frames of a whole log, see CanIdStatsAccumulator """
+    stats = CanIdStatsAccumulator()
+    stats.add(timestamps, bus, can_id, ide, dlc, data_length)
+    return stats.results(log_len_seconds, baudrates)
@@ -4,6 +4,22 @@ from pathlib import Path
 
 SLEEP_TIME_BETWEEN_PROCESSINGS = 120 # seconds to wait between processing input files
 
+# Wake up as soon as an upload lands in the input folder (inotify), SLEEP_TIME_BETWEEN_PROCESSINGS is the polling fallback
+WATCH_INPUT_FOLDER = os.getenv("WATCH_INPUT_FOLDER", "1").lower() not in ("0", "false", "no")
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", 1.0)) # quiet time that ends a burst of uploads
+
+# Logs of at least this many bytes are parsed and written to MF4 in chunks so memory use stays bounded, 0 disables streaming
+STREAMING_FILE_SIZE = int(os.getenv("STREAMING_FILE_SIZE", 256 * 1024 * 1024))
+STREAMING_CHUNK_BYTES = int(os.getenv("STREAMING_CHUNK_BYTES", 16 * 1024 * 1024)) # bytes of input log parsed per chunk
+
+# Worker processes for converting input files, files of different units are converted in parallel, 1 keeps everything in this process
+PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", 1))
+
+# Logs of at least this many bytes are parsed on PARALLEL_PARSE_WORKERS processes, streamed logs chunk by chunk,
+# 0 disables parallel parsing. The default shares the CPUs between the PROCESSING_WORKERS so they are not oversubscribed.
+PARALLEL_PARSE_FILE_SIZE = int(os.getenv("PARALLEL_PARSE_FILE_SIZE", 64 * 1024 * 1024))
+PARALLEL_PARSE_WORKERS = int(os.getenv("PARALLEL_PARSE_WORKERS", max((os.cpu_count() or 1) // max(PROCESSING_WORKERS, 1), 1)))
+
 DATA_FOLDER = Path("./can_data/")
 try:
     DATA_FOLDER = Path(os.environ[f"DATA_FOLDER"])
@@ -12,6 +28,39 @@ except KeyError:
     pass
 DATA_FOLDER.mkdir(parents=True, exist_ok=True)
 
+# Parsed DBC files are pickled to this folder for fast cold starts, an empty value keeps the DBC cache in memory only
+DBC_CACHE_FOLDER = os.getenv("DBC_CACHE_FOLDER", str(DATA_FOLDER / "dbc_cache"))
+DBC_CACHE_FOLDER = Path(DBC_CACHE_FOLDER) if DBC_CACHE_FOLDER else None
+
+# Decoder for the decoded MF4: "asammdf" (extract_bus_logging) or "numpy" (compiled vectorized signal extraction,
+# databases with J1939 or ISO-TP messages are always decoded by asammdf)
+DECODE_ENGINES = ("asammdf", "numpy")
+DECODE_ENGINE = os.getenv("DECODE_ENGINE", "asammdf").lower()
+if DECODE_ENGINE not in DECODE_ENGINES:
+    raise ValueError(f"Unknown DECODE_ENGINE {DECODE_ENGINE}, expected {' or '.join(DECODE_ENGINES)}")
+# Worker processes decoding one log, every (DBC file, bus) pair is decoded separately, 1 decodes all in one call
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", 1))
+
+# Only write the raw MF4 when processing, the decoded MF4 is generated the first time it is downloaded and kept in
+# DECODED_CACHE_FOLDER, the least recently downloaded files are removed when it grows over DECODED_CACHE_MAX_BYTES
+DECODE_ON_DEMAND = os.getenv("DECODE_ON_DEMAND", "0").lower() not in ("0", "false", "no")
+DECODED_CACHE_FOLDER = Path(os.getenv("DECODED_CACHE_FOLDER", str(DATA_FOLDER / "decoded_cache")))
+DECODED_CACHE_MAX_BYTES = int(os.getenv("DECODED_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+# Also write the decoded signals as "parquet" or "arrow" (IPC) files to SIGNAL_EXPORT_FOLDER, partitioned by
+# unit_type, unit_number and date, empty disables the export
+SIGNAL_EXPORT_FORMAT = os.getenv("SIGNAL_EXPORT_FORMAT", "").lower()
+SIGNAL_EXPORT_FOLDER = Path(os.getenv("SIGNAL_EXPORT_FOLDER", str(DATA_FOLDER / "signals")))
+
+# Bucket sizes in seconds of the min/max/mean signal previews written next to the decoded MF4 for plotting on the
+# log page, empty disables the previews
+PREVIEW_BUCKET_SECONDS = sorted(float(s) for s in os.getenv("PREVIEW_BUCKET_SECONDS", "1,10,60").split(",") if s.strip())
+
+# Compression of the saved MF4 files: none, deflate or transposed_deflate (zstd, lz4 and their transposed variants
+# where asammdf supports them), set separately for the raw and the decoded output
+RAW_MF4_COMPRESSION = os.getenv("RAW_MF4_COMPRESSION", "none").lower()
+DECODED_MF4_COMPRESSION = os.getenv("DECODED_MF4_COMPRESSION", "none").lower()
+
 DB_BACKEND = os.getenv("DB_BACKEND", "sqlite").lower()
 
 if DB_BACKEND == "postgres":
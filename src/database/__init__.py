@@ -32,11 +32,19 @@ if DATABASE_CONFIG['sqlalchemy.url'].startswith("sqlite:///"):
         cursor.execute("PRAGMA foreign_keys=ON")
         cursor.close()
 
-# @contextmanager
-# def db_session():
-#     """ Create a scoped database session. """
-#     session = scoped_session(sessionmaker(bind=ENGINE, autocommit=False, autoflush=True))
-#     try:
-#         yield session
-#     finally:
-#         session.remove()
\ No newline at end of file
+# objects loaded in a unit of work stay readable after it is committed and closed
+UnitOfWorkSession = sessionmaker(bind=ENGINE, expire_on_commit=False)
+
+@contextmanager
+def db_session():
+    """ A unit of work: one session and transaction for several CRUD calls that take a session, committed when
+        the block ends and rolled back if it raises. """
+    session = UnitOfWorkSession()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
\ No newline at end of file
@@ -1,10 +1,11 @@
 # crud.py
 from re import L
+from contextlib import contextmanager
 from typing import Optional
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, func, or_, null, case
 
 
-from database import Session, ENGINE
+from database import Session, ENGINE, db_session
 from database.models import *
 
 from file_helpers import move_vehicle_files
@@ -12,13 +13,20 @@ from file_helpers import move_vehicle_files
 from webserver_logger import logger
 
 
+@contextmanager
+def _session(session=None):
+    """ The session of the caller's db_session unit of work, or a unit of work of its own for one CRUD call """
+    if session is not None:
+        yield session
+    else:
+        with db_session() as s:
+            yield s
 
-def new_vehicle(unit_number, vehicle_type="unknown", serial_number=None, status=None):
-    s = Session(bind=ENGINE)
-    b = Vehicle(unit_number=unit_number, vehicle_type=vehicle_type, serial_number=serial_number, status=status)
-    s.add(b)
-    s.commit()
-    s.close()
+
+def new_vehicle(unit_number, vehicle_type="unknown", serial_number=None, status=None, session=None):
+    with _session(session) as s:
+        s.add(Vehicle(unit_number=unit_number, vehicle_type=vehicle_type, serial_number=serial_number, status=status))
+        s.flush()
 
 def get_vehicles():
     s = Session(bind=ENGINE)
@@ -26,30 +34,26 @@ def get_vehicles():
     s.close()
     return q
 
-def update_vehicle(unit_number, vehicle_type=None, serial_number=None, status=None):
-    s = Session(bind=ENGINE)
-    q = s.query(Vehicle).filter(Vehicle.unit_number == unit_number)
-    update_fields = {}
-    old_vehicle_type = q.first().vehicle_type
-    if vehicle_type is not None and vehicle_type != old_vehicle_type:
-        logger.debug("Moving log files to new unit type")
-        update_fields["vehicle_type"] = vehicle_type
-        move_vehicle_files(old_vehicle_type, vehicle_type, unit_number)
-
-    if serial_number is not None:
-        update_fields["serial_number"] = serial_number
-    if status is not None:
-        update_fields["status"] = status
-    if update_fields:
-        q.update(update_fields)
-    s.commit()
-    s.close()
-
-def get_vehicle_by_unit_number(unit_number) -> Vehicle:
-    s = Session(bind=ENGINE)
-    q = s.query(Vehicle).filter(Vehicle.unit_number==unit_number).first()
-    s.close()
-    return q
+def update_vehicle(unit_number, vehicle_type=None, serial_number=None, status=None, session=None):
+    with _session(session) as s:
+        q = s.query(Vehicle).filter(Vehicle.unit_number == unit_number)
+        update_fields = {}
+        old_vehicle_type = q.first().vehicle_type
+        if vehicle_type is not None and vehicle_type != old_vehicle_type:
+            logger.debug("Moving log files to new unit type")
+            update_fields["vehicle_type"] = vehicle_type
+            move_vehicle_files(old_vehicle_type, vehicle_type, unit_number)
+
+        if serial_number is not None:
+            update_fields["serial_number"] = serial_number
+        if status is not None:
+            update_fields["status"] = status
+        if update_fields:
+            q.update(update_fields)
+
+def get_vehicle_by_unit_number(unit_number, session=None) -> Vehicle:
+    with _session(session) as s:
+        return s.query(Vehicle).filter(Vehicle.unit_number==unit_number).first()
 
 def get_logs_for_unit(unit_number, page=None, per_page=None, hidden=False) -> tuple[list[LogFile], bool]:
     s = Session(bind=ENGINE)
@@ -79,69 +83,66 @@ def new_log_file(
     length_sec: float = None,
     samples: int = None,
     original_file_name: str = "",
-    uuid_input: str = None  # Add uuid as an optional argument
+    uuid_input: str = None,  # Add uuid as an optional argument
+    session=None
 ) -> LogFile:
-    s = Session(bind=ENGINE)
-
     if upload_time is None:
         upload_time = datetime.now()
 
-    # Get next available log_number for this unit
-    last_log = (
-        s.query(LogFile)
-        .filter_by(unit_number=unit_number)
-        .order_by(LogFile.log_number.desc())
-        .first()
-    )
-    next_log_number = (last_log.log_number + 1) if last_log else 1
-
-    # Use provided uuid if present, otherwise generate a new one
-    log_id = uuid_input if uuid_input is not None else str(uuid.uuid4())
-
-    # Create new log
-    log = LogFile(
-        id=log_id,
-        log_start_time=log_start_time,
-        upload_time=upload_time,
-        unit_number=unit_number,
-        log_number=next_log_number,
-        length_sec=length_sec,
-        samples=samples,
-        processing_status=status,
-        hash=hash,
-        original_file_name=original_file_name,
-        file_stem=f"{unit_number}_{next_log_number:05d}"
-    )
-
-    s.add(log)
-    s.commit()
-    log_num = log.log_number
-    s.close()
-    return log
-
-
-def update_log_file_status(id,processing_status):
-    s = Session(bind=ENGINE)
-    s.query(LogFile).filter(LogFile.id==id).update({"processing_status": processing_status})
-    s.commit()
-    s.close()
-
-def update_log_end_time(id, end_time: datetime):
-    s = Session(bind=ENGINE)
-    s.query(LogFile).filter(LogFile.id==id).update({"log_end_time": end_time})
-    s.commit()
-    s.close()
-
-def update_log_file_len(id, duration, samples):
+    with _session(session) as s:
+        # Get next available log_number for this unit
+        last_log = (
+            s.query(LogFile)
+            .filter_by(unit_number=unit_number)
+            .order_by(LogFile.log_number.desc())
+            .first()
+        )
+        next_log_number = (last_log.log_number + 1) if last_log else 1
+
+        # Use provided uuid if present, otherwise generate a new one
+        log_id = uuid_input if uuid_input is not None else str(uuid.uuid4())
+
+        # Create new log
+        log = LogFile(
+            id=log_id,
+            log_start_time=log_start_time,
+            upload_time=upload_time,
+            unit_number=unit_number,
+            log_number=next_log_number,
+            length_sec=length_sec,
+            samples=samples,
+            processing_status=status,
+            hash=hash,
+            original_file_name=original_file_name,
+            file_stem=f"{unit_number}_{next_log_number:05d}"
+        )
+
+        s.add(log)
+        # flushed so the next log number of the unit sees it inside the same unit of work
+        s.flush()
+        return log
+
+
+def update_log_file_status(id, processing_status, session=None):
+    with _session(session) as s:
+        s.query(LogFile).filter(LogFile.id==id).update({"processing_status": processing_status})
+
+def update_log_file_hash(id, hash: bytes, session=None):
+    with _session(session) as s:
+        s.query(LogFile).filter(LogFile.id==id).update({"hash": hash})
+
+def update_log_end_time(id, end_time: datetime, session=None):
+    with _session(session) as s:
+        s.query(LogFile).filter(LogFile.id==id).update({"log_end_time": end_time})
+
+def update_log_file_len(id, duration, samples, session=None):
     # Convert numpy types to native Python types
     if hasattr(duration, "item"):
         duration = duration.item()
     if hasattr(samples, "item"):
         samples = samples.item()
-    s = Session(bind=ENGINE)
-    s.query(LogFile).filter(LogFile.id==id).update({"length_sec": duration, "samples": samples})
-    s.commit()
-    s.close()
+    with _session(session) as s:
+        s.query(LogFile).filter(LogFile.id==id).update({"length_sec": duration, "samples": samples})
 
 def get_log_file_by_start_time(start_time: datetime, unit_number: str) -> Optional[LogFile]:
     s = Session(bind=ENGINE)
@@ -149,11 +150,9 @@ def get_log_file_by_start_time(start_time: datetime, unit_number: str) -> Option
     s.close()
     return q
 
-def get_log_file(uuid:str) -> Optional[LogFile]:
-    s = Session(bind=ENGINE)
-    q = s.query(LogFile).filter(LogFile.id==uuid).first()
-    s.close()
-    return q
+def get_log_file(uuid:str, session=None) -> Optional[LogFile]:
+    with _session(session) as s:
+        return s.query(LogFile).filter(LogFile.id==uuid).first()
 
 def hide_show_log_file(id, hidden=True):
     s = Session(bind=ENGINE)
@@ -194,27 +193,24 @@ def delete_log_file(id):
     s.commit()
     s.close()
 
-def does_log_exist(hash: bytes, unit_number: str) -> bool:
-    s = Session(bind=ENGINE)
-    q = s.query(LogFile).filter(LogFile.unit_number==unit_number, LogFile.hash==hash).first()
-    s.close()
-    if q is None:
-        return False
-    else:
-        return True
+def does_log_exist(hash: bytes, unit_number: str, session=None) -> bool:
+    return get_log_with_hash(hash, unit_number, session=session) is not None
     
-def get_log_with_hash(hash: bytes, unit_number: str) -> LogFile:
-    s = Session(bind=ENGINE)
-    q = s.query(LogFile).filter(LogFile.unit_number==unit_number, LogFile.hash==hash).first()
-    s.close()
-    return q
+def get_log_with_hash(hash: bytes, unit_number: str, session=None) -> LogFile:
+    with _session(session) as s:
+        return s.query(LogFile).filter(LogFile.unit_number==unit_number, LogFile.hash==hash).first()
 
 
-def create_log_in_database(log_start_time: datetime, unit_number: str, hash: bytes, unit_type:str="", original_file_name:str="", provided_uuid=None) -> LogFile:
-    if get_vehicle_by_unit_number(unit_number) is None:
-        # If the vehicle does not exist, create it
-        new_vehicle(unit_number, unit_type)
-    return new_log_file(log_start_time, unit_number, status="Uploaded",original_file_name=original_file_name, upload_time=datetime.now(), hash=hash, uuid_input=provided_uuid)
+def get_logs_with_start_time(unit_number: str, log_start_time: datetime, session=None) -> list[LogFile]:
+    with _session(session) as s:
+        return s.query(LogFile).filter(LogFile.unit_number==unit_number, LogFile.log_start_time==log_start_time, LogFile.hash.isnot(None)).all()
+
+def create_log_in_database(log_start_time: datetime, unit_number: str, hash: bytes, unit_type:str="", original_file_name:str="", provided_uuid=None, session=None) -> LogFile:
+    with _session(session) as s:
+        if get_vehicle_by_unit_number(unit_number, session=s) is None:
+            # If the vehicle does not exist, create it
+            new_vehicle(unit_number, unit_type, session=s)
+        return new_log_file(log_start_time, unit_number, status="Uploaded",original_file_name=original_file_name, upload_time=datetime.now(), hash=hash, uuid_input=provided_uuid, session=s)
 
 def get_log_status(id) -> Optional[str]:
     s = Session(bind=ENGINE)
@@ -240,4 +236,90 @@ def delete_log_comment(comment_id):
     s = Session(bind=ENGINE)
     s.query(LogComment).filter(LogComment.id == comment_id).delete()
     s.commit()
-    s.close()
\ No newline at end of file
+    s.close()
+
+
+def replace_can_id_stats(log_id, stats: list[dict], session=None):
+    """ Store the CAN ID statistics of a log, replacing the ones of an earlier processing """
+    with _session(session) as s:
+        s.query(CanIdStats).filter(CanIdStats.log_id == log_id).delete()
+        s.add_all([CanIdStats(log_id=log_id, **row) for row in stats])
+
+def get_can_id_stats_for_log(log_id) -> list[CanIdStats]:
+    s = Session(bind=ENGINE)
+    q = s.query(CanIdStats).filter(CanIdStats.log_id == log_id).order_by(CanIdStats.bus, CanIdStats.can_id).all()
+    s.close()
+    return q
+
+
+def replace_log_signals(log_id, spans: list[dict], session=None):
+    """ Store the decoded signals of a log in the signal index, replacing the ones of an earlier processing """
+    with _session(session) as s:
+        s.query(LogSignal).filter(LogSignal.log_id == log_id).delete()
+        s.add_all([LogSignal(log_id=log_id, **span) for span in spans])
+
+def search_logs(unit_number=None, unit_type=None, signal=None, can_id=None, start=None, end=None, limit=1000) -> list[tuple]:
+    """ Logs matching all given filters from the signal and CAN ID indexes, without opening any log file. signal
+        matches the DBC signal name or the full CAN1.Message.Signal name, start and end select logs overlapping the
+        time range. Returns (log, vehicle type, first time, last time) rows, the times are seconds from the log start
+        of the signal or else the CAN ID, or None without either filter. """
+    s = Session(bind=ENGINE)
+    q = s.query(LogFile, Vehicle.vehicle_type).join(Vehicle, LogFile.unit_number == Vehicle.unit_number)
+    span = None
+    if can_id is not None:
+        ids = s.query(CanIdStats.log_id, func.min(CanIdStats.first_time).label("first_time"), func.max(CanIdStats.last_time).label("last_time"))\
+            .filter(CanIdStats.can_id == can_id).group_by(CanIdStats.log_id).subquery()
+        q = q.join(ids, ids.c.log_id == LogFile.id)
+        span = ids
+    if signal is not None:
+        signals = s.query(LogSignal.log_id, func.min(LogSignal.first_time).label("first_time"), func.max(LogSignal.last_time).label("last_time"))\
+            .filter(or_(LogSignal.signal == signal, LogSignal.name == signal)).group_by(LogSignal.log_id).subquery()
+        q = q.join(signals, signals.c.log_id == LogFile.id)
+        span = signals
+    q = q.add_columns(span.c.first_time, span.c.last_time) if span is not None else q.add_columns(null(), null())
+    if unit_number is not None:
+        q = q.filter(LogFile.unit_number == unit_number)
+    if unit_type is not None:
+        q = q.filter(Vehicle.vehicle_type == unit_type)
+    if start is not None:
+        q = q.filter(func.coalesce(LogFile.log_end_time, LogFile.log_start_time) >= start)
+    if end is not None:
+        q = q.filter(LogFile.log_start_time < end)
+    result = q.order_by(asc(LogFile.log_start_time)).limit(limit).all()
+    s.close()
+    return [tuple(row) for row in result]
+
+
+def replace_log_stage_timings(log_id, timings: list[dict], session=None):
+    """ Store the stage timings of processing a log, replacing the ones of an earlier processing """
+    with _session(session) as s:
+        s.query(LogStageTiming).filter(LogStageTiming.log_id == log_id).delete()
+        s.add_all([LogStageTiming(log_id=log_id, **row) for row in timings])
+
+def get_log_stage_timings(log_id) -> list[LogStageTiming]:
+    s = Session(bind=ENGINE)
+    q = s.query(LogStageTiming).filter(LogStageTiming.log_id == log_id).order_by(LogStageTiming.id).all()
+    s.close()
+    return q
+
+def get_stage_timing_summary(seconds_buckets: list[float], frames_per_second_buckets: list[float]) -> list[dict]:
+    """ Totals of the stored stage timings per stage with the cumulative histogram counts of the seconds and the
+        frames per second for the given bucket bounds, aggregated by the database in one query """
+    s = Session(bind=ENGINE)
+    t = LogStageTiming
+    seconds = [func.count(case((t.seconds <= bound, 1))) for bound in seconds_buckets]
+    frames_per_second = [func.count(case((t.frames_per_second <= bound, 1))) for bound in frames_per_second_buckets]
+    rows = s.query(t.stage, func.count(t.id), func.sum(t.seconds), func.sum(t.frames), func.sum(t.bytes_in), func.sum(t.bytes_out),
+                   func.count(t.frames_per_second), func.sum(t.frames_per_second), *seconds, *frames_per_second)\
+        .group_by(t.stage).order_by(t.stage).all()
+    s.close()
+    n = len(seconds_buckets)
+    return [{"stage": row[0], "count": row[1], "seconds": row[2], "frames": row[3], "bytes_in": row[4], "bytes_out": row[5],
+             "frames_per_second_count": row[6], "frames_per_second_sum": row[7],
+             "seconds_buckets": list(row[8:8 + n]), "frames_per_second_buckets": list(row[8 + n:])} for row in rows]
+
+def count_logs_by_status() -> dict[str, int]:
+    s = Session(bind=ENGINE)
+    q = s.query(LogFile.processing_status, func.count(LogFile.id)).group_by(LogFile.processing_status).all()
+    s.close()
+    return {status: count for status, count in q}
@@ -4,7 +4,7 @@ from datetime import datetime, timezone
 from dateutil import parser
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String, Date, Float, Integer, DateTime, Boolean, ForeignKey, UniqueConstraint, LargeBinary
+from sqlalchemy import Column, String, Date, Float, Integer, BigInteger, DateTime, Boolean, ForeignKey, UniqueConstraint, LargeBinary, JSON
 
 import uuid
 
@@ -88,3 +88,69 @@ class LogComment(Base):
     def __repr__(self):
         return "<LogComment(log_id='{}', timestamp='{}', comment={})>"\
             .format(self.log_id, self.timestamp, self.comment)
+
+class CanIdStats(Base):
+    __tablename__ = "can_id_stats"
+    __table_args__ = (
+        UniqueConstraint('log_id', 'bus', 'can_id', 'is_extended', name='uq_can_id_stats_log_bus_id'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    log_id = Column(String(36), ForeignKey("log_file.id",
+                                        name="can_id_stats_log_id_fkey",
+                                        onupdate='CASCADE',
+                                        ondelete='CASCADE'), nullable=False, index=True)
+    bus = Column(Integer, nullable=False)
+    can_id = Column(Integer, nullable=False, index=True)
+    is_extended = Column(Boolean, nullable=False)
+    frame_count = Column(Integer, nullable=False)
+    first_time = Column(Float) # seconds from the log start
+    last_time = Column(Float)
+    period_mean = Column(Float) # seconds, empty for IDs with one frame
+    period_jitter = Column(Float) # standard deviation of the period in seconds
+    dlc_counts = Column(JSON) # frames per DLC, {"8": 100}
+    bus_load = Column(Float) # share of the bus bit rate used by this ID, empty if the bit rate is unknown
+
+    def __repr__(self):
+        return "<CanIdStats(log_id='{}', bus={}, can_id={:X}, frame_count={})>"\
+            .format(self.log_id, self.bus, self.can_id, self.frame_count)
+
+class LogSignal(Base):
+    __tablename__ = "log_signal"
+    __table_args__ = (
+        UniqueConstraint('log_id', 'name', name='uq_log_signal_log_name'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    log_id = Column(String(36), ForeignKey("log_file.id",
+                                        name="log_signal_log_id_fkey",
+                                        onupdate='CASCADE',
+                                        ondelete='CASCADE'), nullable=False, index=True)
+    name = Column(String, nullable=False, index=True) # CAN1.Message.Signal
+    signal = Column(String, nullable=False, index=True) # signal name from the DBC
+    sample_count = Column(Integer)
+    first_time = Column(Float) # seconds from the log start
+    last_time = Column(Float)
+
+    def __repr__(self):
+        return "<LogSignal(log_id='{}', name='{}', sample_count={})>"\
+            .format(self.log_id, self.name, self.sample_count)
+
+class LogStageTiming(Base):
+    __tablename__ = "log_stage_timing"
+    __table_args__ = (
+        UniqueConstraint('log_id', 'stage', name='uq_log_stage_timing_log_stage'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    log_id = Column(String(36), ForeignKey("log_file.id",
+                                        name="log_stage_timing_log_id_fkey",
+                                        onupdate='CASCADE',
+                                        ondelete='CASCADE'), nullable=False, index=True)
+    stage = Column(String, nullable=False, index=True) # processing stage, "total" for the whole log
+    seconds = Column(Float, nullable=False)
+    frames = Column(Integer) # CAN frames handled by the stage, empty if it does not handle frames
+    frames_per_second = Column(Float)
+    bytes_in = Column(BigInteger) # bytes of input logs read
+    bytes_out = Column(BigInteger) # bytes of MF4 files written
+
+    def __repr__(self):
+        return "<LogStageTiming(log_id='{}', stage='{}', seconds={})>"\
+            .format(self.log_id, self.stage, self.seconds)
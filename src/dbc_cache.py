@@ -0,0 +1,70 @@
+import os
+import hashlib
+import pickle
+from pathlib import Path
+
+import canmatrix
+from asammdf.blocks.utils import load_can_database
+
+from log_converter_logger import logger
+
+
+class DbcCache:
+    """ Parsed DBC databases kept in memory across processing runs, keyed by path and validated by mtime, size and
+        content hash so editing a DBC only reloads that file. With a compiled_folder the parsed databases are also
+        pickled to disk by content hash for fast cold starts. """
+
+    def __init__(self, compiled_folder: Path = None):
+        self.compiled_folder = compiled_folder
+        self._entries = {} # path -> (mtime_ns, size, sha256, database)
+
+    def get(self, path: Path) -> canmatrix.CanMatrix:
+        """ The parsed database of a DBC file, parsed again only if the file content changed """
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return entry[3]
+
+        content = Path(path).read_bytes()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if entry is not None and entry[2] == content_hash:
+            # touched but not changed
+            database = entry[3]
+        else:
+            database = self._load(path, content, content_hash)
+        self._entries[path] = (stat.st_mtime_ns, stat.st_size, content_hash, database)
+        return database
+
+    def get_databases(self, dbc_files: list[tuple[Path, int]]) -> list[tuple[canmatrix.CanMatrix, int]]:
+        """ Replace the paths in (dbc file, bus) pairs for extract_bus_logging with their parsed databases """
+        return [(self.get(path), bus) for path, bus in dbc_files]
+
+    def _compiled_path(self, content_hash: str) -> Path:
+        # pickles are only valid for the canmatrix version that wrote them
+        return self.compiled_folder / f"{content_hash}-canmatrix{canmatrix.__version__}.pickle"
+
+    def _load(self, path: Path, content: bytes, content_hash: str) -> canmatrix.CanMatrix:
+        if self.compiled_folder is not None:
+            compiled_path = self._compiled_path(content_hash)
+            try:
+                with open(compiled_path, 'rb') as f:
+                    logger.debug(f"\tLoaded compiled DBC {path} from {compiled_path}")
+                    return pickle.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"\tCould not load compiled DBC {compiled_path}, parsing {path} again: {e}")
+
+        logger.debug(f"\tParsing DBC {path}")
+        database = load_can_database(Path(path), content)
+        if database is None:
+            raise ValueError(f"Could not parse DBC file {path}")
+
+        if self.compiled_folder is not None:
+            # write to a temporary name first so concurrent workers never read a partial file
+            self.compiled_folder.mkdir(parents=True, exist_ok=True)
+            tmp_path = compiled_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(database, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, compiled_path)
+        return database
@@ -0,0 +1,269 @@
+import numpy as np
+import canmatrix
+from asammdf import MDF, Signal
+from asammdf.blocks import v4_constants as v4c
+from asammdf.blocks.bus_logging_utils import extract_signal, get_conversion
+from asammdf.blocks.source_utils import Source
+from asammdf.blocks.utils import as_non_byte_sized_signed_int
+
+from log_converter_logger import logger
+
+PAYLOAD_BYTES = 8 # classic CAN payload, signals are extracted from it as one 64 bit word
+# raw frames decoded at once, asammdf's default read_fragment_size so new messages add their channel groups in the
+# order extract_bus_logging adds them
+READ_FRAGMENT_BYTES = 256 * 1024 * 1024
+
+
+class CompiledMessage:
+    """ A DBC message compiled to shift and mask operations on the payload read as one 64 bit word per frame.
+        Float signals and signals that do not fit in the word are extracted with asammdf. """
+
+    def __init__(self, message: canmatrix.Frame):
+        self.message = message
+        if message.is_multiplexed:
+            _prepare_multiplexing(message)
+        self.plans = {signal.name: _compile_signal(signal) for signal in message}
+        self.needs_le_word = any(plan is not None and plan[0] for plan in self.plans.values())
+        self.needs_be_word = any(plan is not None and not plan[0] for plan in self.plans.values())
+
+    def extract(self, payload: np.ndarray, t: np.ndarray, bus: int, msg_id: int, is_extended: bool) -> dict:
+        """ Extract all signals of the message, grouped like asammdf's extract_mux by
+            (bus, msg_id, is_extended, None, muxer, mux min, mux max) """
+        extracted = {}
+        if self.message.size == 0 or payload.shape[1] == 0:
+            return extracted
+        if self.message.size > payload.shape[1]:
+            # asammdf pads short payloads with 0xFF
+            extra_bytes = self.message.size - payload.shape[1]
+            payload = np.column_stack([payload, np.full((len(payload), extra_bytes), 0xFF, dtype=np.uint8)])
+        self._extract(payload, t, (bus, msg_id, is_extended, None), None, None, extracted)
+        return extracted
+
+    def _words(self, payload: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if payload.shape[1] < PAYLOAD_BYTES:
+            payload = np.column_stack([payload, np.zeros((len(payload), PAYLOAD_BYTES - payload.shape[1]), dtype=np.uint8)])
+        block = np.ascontiguousarray(payload[:, :PAYLOAD_BYTES])
+        le_word = block.view('<u8').ravel() if self.needs_le_word else None
+        be_word = block.view('>u8').ravel().astype(np.uint64) if self.needs_be_word else None
+        return le_word, be_word
+
+    def _extract(self, payload, t, key, muxer, muxer_values, extracted) -> None:
+        pairs = {}
+        for signal in self.message:
+            if signal.muxer_for_signal == muxer:
+                try:
+                    pair = signal.mux_val_min, signal.mux_val_max
+                except AttributeError:
+                    pair = tuple(signal.mux_val_grp[0]) if signal.mux_val_grp else (0, 0)
+                pairs.setdefault(pair, []).append(signal)
+
+        for pair, pair_signals in pairs.items():
+            signals = extracted.setdefault((*key, muxer, *pair), {})
+            if muxer_values is not None:
+                idx = np.flatnonzero((pair[0] <= muxer_values) & (muxer_values <= pair[1]))
+                payload_, t_ = payload[idx], t[idx]
+            else:
+                payload_, t_ = payload, t
+
+            le_word, be_word = self._words(payload_)
+            for signal in pair_signals:
+                plan = self.plans[signal.name]
+                if plan is None:
+                    samples = extract_signal(signal, payload_, raw=True)
+                else:
+                    samples = _apply_plan(plan, le_word if plan[0] else be_word)
+                if len(samples) == 0 and len(t_):
+                    continue
+                scale_ranges = getattr(signal, "scale_ranges", None)
+                signals[signal.name] = {
+                    "samples": samples,
+                    "t": t_,
+                    "comment": signal.comment or "",
+                    "unit": (scale_ranges[0]["unit"] if scale_ranges else signal.unit) or "",
+                    "conversion": get_conversion(signal),
+                }
+                if signal.multiplex == "Multiplexor":
+                    self._extract(payload_, t_, key, signal.name, samples, extracted)
+
+
+def _prepare_multiplexing(message: canmatrix.Frame) -> None:
+    # same normalisation asammdf applies before extracting, it is idempotent on the shared cached databases
+    multiplexor_name = next((s.name for s in message if s.multiplex == "Multiplexor" and s.muxer_for_signal is None), None)
+    for signal in message:
+        if signal.multiplex not in (None, "Multiplexor"):
+            if signal.muxer_for_signal is None:
+                signal.muxer_for_signal = multiplexor_name
+            if not hasattr(signal, "mux_val_min"):
+                signal.mux_val_min = signal.mux_val_max = int(signal.multiplex)
+                signal.mux_val_grp.insert(0, (int(signal.multiplex), int(signal.multiplex)))
+
+
+def _compile_signal(signal: canmatrix.Signal):
+    """ (little endian, shift, mask, byte_size, std_size, signed) to extract the raw value of a signal from the payload
+        word, None if the signal has to be extracted by asammdf. byte_size is the number of payload bytes the signal
+        touches and std_size the byte size asammdf stores the raw value in. """
+    if signal.is_float:
+        return None
+    bit_count = int(signal.size)
+    start_bit = signal.get_startbit(bit_numbering=1)
+    if signal.is_little_endian:
+        bit_offset = start_bit % 8
+        shift = start_bit
+    else:
+        pos = start_bit % 8 + 1
+        over = bit_count % 8
+        bit_offset = (pos - over) % 8 if pos >= over else pos + 8 - over
+        # start_bit is the most significant bit, count from the least significant bit of the big endian word
+        shift = (PAYLOAD_BYTES - 1 - start_bit // 8) * 8 + start_bit % 8 - bit_count + 1
+    byte_size = -(-(bit_offset + bit_count) // 8)
+    std_size = byte_size if byte_size in (1, 2, 4, 8) else byte_size + 4 - byte_size % 4
+    if bit_count == 0 or std_size > 8 or shift < 0 or shift + bit_count > PAYLOAD_BYTES * 8:
+        return None
+    return signal.is_little_endian, shift, (1 << bit_count) - 1, byte_size, std_size, signal.is_signed
+
+
+def _apply_plan(plan, word: np.ndarray) -> np.ndarray:
+    _, shift, mask, byte_size, std_size, signed = plan
+    bit_count = mask.bit_length()
+    samples = ((word >> np.uint64(shift)) & np.uint64(mask)).astype(f"<u{std_size}")
+    if signed:
+        # same sign handling as asammdf's extract_signal so the decoded values match exactly
+        if byte_size != std_size or bit_count not in (8, 16, 32, 64):
+            samples = as_non_byte_sized_signed_int(samples, bit_count)
+        else:
+            samples = samples.view(f"<i{std_size}")
+    return samples
+
+
+def can_database_supported(database: canmatrix.CanMatrix) -> bool:
+    """ J1939 and ISO-TP databases need asammdf's PGN matching and frame merging, they are not compiled """
+    if database.attributes.get("ProtocolType", "").lower() == "j1939":
+        return False
+    return not any(message.is_j1939 or "CanTpFcFrameId" in message.attributes for message in database)
+
+
+def read_can_frames(mf4: MDF, record_offset: int = 0, record_count: int = None) -> tuple[np.ndarray, ...]:
+    """ (timestamps, bus, id, ide, data bytes) of the frames in the CAN_DataFrame group of a raw MF4, all of them or
+        record_count from record_offset """
+    # the whole record in one read, getting the fields one by one reads the group once per field
+    data_frame = mf4.get("CAN_DataFrame", record_offset=record_offset, record_count=record_count)
+    frames = data_frame.samples
+    msg_ids = frames["CAN_DataFrame.ID"].astype("<u4") & 0x1FFFFFFF
+    return (data_frame.timestamps, frames["CAN_DataFrame.BusChannel"].astype("<u1"), msg_ids,
+            frames["CAN_DataFrame.IDE"].astype("<u1"), frames["CAN_DataFrame.DataBytes"])
+
+
+def can_frame_fragments(mf4: MDF) -> list[tuple[int, int]]:
+    """ (record offset, record count) of the fragments of READ_FRAGMENT_BYTES the CAN_DataFrame group is decoded in,
+        the fragments extract_bus_logging reads with asammdf's default read_fragment_size """
+    channel_group = mf4.groups[mf4.channels_db["CAN_DataFrame"][0][0]].channel_group
+    records = max(READ_FRAGMENT_BYTES // (channel_group.samples_byte_nr + channel_group.invalidation_bytes_nr), 1)
+    return [(offset, min(records, channel_group.cycles_nr - offset)) for offset in range(0, channel_group.cycles_nr, records)]
+
+
+def _sorted_frames(frames: tuple[np.ndarray, ...]) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[tuple]]:
+    """ (timestamps, data bytes, order, slices) of a fragment of frames sorted once by bus, ID and IDE, stable so each
+        message stays in time order. slices are (bus, id, ide, start, end) of the contiguous frames of every message. """
+    timestamps, bus_ids, msg_ids, msg_ide, data_bytes = frames
+    keys = (bus_ids.astype(np.uint64) << 34) | (msg_ids.astype(np.uint64) << 1) | msg_ide.astype(np.uint64)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    bounds = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [len(keys)]]) if len(keys) else [0]
+    slices = [(int(keys[s] >> 34), int((keys[s] >> 1) & 0x1FFFFFFF), int(keys[s] & 1), s, e)
+              for s, e in zip(bounds[:-1], bounds[1:])]
+    return timestamps, data_bytes, order, slices
+
+
+def decode_can_frames(mf4: MDF, databases: list[tuple[canmatrix.CanMatrix, int]]) -> MDF:
+    """ Decode the raw CAN frames of mf4 with the (database, bus) pairs into a new MF4 with the same channel
+        groups, channel names and conversions extract_bus_logging writes. Like extract_bus_logging every pair
+        reads the frames fragment by fragment, a message seen first adds a channel group and is extended in later
+        fragments, so memory is bounded by the fragment size. The frames of a fragment are sorted by bus and ID
+        once and every message is decoded from its contiguous slice with the compiled signal extractors. """
+    out = MDF(version=mf4.version, use_display_names=True)
+    out.header.start_time = mf4.header.start_time
+    if not databases or "CAN_DataFrame" not in mf4.channels_db:
+        return out
+
+    fragments = can_frame_fragments(mf4)
+    # a log of one fragment is read and sorted once for all pairs
+    single = [_sorted_frames(read_can_frames(mf4))] if len(fragments) == 1 else None
+    for database, bus_channel in databases:
+        # channel group of every extracted entry of this pair, a message in two databases gets a group from each
+        groups = {}
+        compiled = {} # (msg_id, is_extended) -> CompiledMessage
+        messages = {(m.arbitration_id.id, m.arbitration_id.extended): m for m in database}
+        for timestamps, data_bytes, order, slices in single or (_sorted_frames(read_can_frames(mf4, *fragment)) for fragment in fragments):
+            for bus, msg_id, is_extended, start, end in slices:
+                if bus_channel and bus != bus_channel:
+                    continue
+                message = messages.get((msg_id, bool(is_extended)))
+                if message is None:
+                    continue
+                if (msg_id, is_extended) not in compiled:
+                    compiled[(msg_id, is_extended)] = CompiledMessage(message)
+                idx = order[start:end]
+                extracted = compiled[(msg_id, is_extended)].extract(data_bytes[idx], timestamps[idx], bus, msg_id, is_extended)
+                for entry, signals in extracted.items():
+                    if not signals or len(next(iter(signals.values()))["samples"]) == 0:
+                        continue
+                    if entry in groups:
+                        out.extend(groups[entry], [(next(iter(signals.values()))["t"], None),
+                                                   *[(signal["samples"], None) for signal in signals.values()]])
+                    else:
+                        groups[entry] = _append_message_group(out, message, bus, msg_id, is_extended, signals)
+    logger.debug(f"\tDecoded {sum(count for _, count in fragments)} frames into {len(out.groups)} channel groups")
+    return out
+
+
+def _append_message_group(out: MDF, message: canmatrix.Frame, bus: int, msg_id: int, is_extended: bool, signals: dict) -> int:
+    acq_name = f"CAN{bus} message ID=0x{msg_id:X} EXT={bool(is_extended)}"
+    acq_source = Source(
+        name=acq_name,
+        path=f"CAN{bus}.CAN_DataFrame.ID=0x{message.arbitration_id.id:X} EXT={bool(is_extended)}",
+        comment=f"""\
+<SIcomment>
+    <TX>CAN{bus} data frame 0x{message.arbitration_id.id:X} EXT={bool(is_extended)} - {message.name}</TX>
+    <bus name="CAN{bus}"/>
+    <common_properties>
+        <e name="ChannelNo" type="integer">{bus}</e>
+    </common_properties>
+</SIcomment>""",
+        source_type=v4c.SOURCE_BUS,
+        bus_type=v4c.BUS_TYPE_CAN,
+    )
+    sigs = [
+        Signal(
+            samples=signal["samples"],
+            timestamps=signal["t"],
+            name=name,
+            comment=signal["comment"],
+            unit=signal["unit"],
+            conversion=signal["conversion"],
+            source=acq_source,
+            display_names={f"CAN{bus}.{message.name}.{name}": "bus", f"{message.name}.{name}": "message"},
+        )
+        for name, signal in signals.items()
+    ]
+    cg_nr = out.append(sigs, acq_name=acq_name, acq_source=acq_source,
+                       comment=f"CAN{bus} - message {message} 0x{msg_id:X} EXT={bool(is_extended)}", common_timebase=True)
+    out.groups[cg_nr].channel_group.flags = v4c.FLAG_CG_BUS_EVENT
+    return cg_nr
+
+
+def stack_decoded_mf4(parts: list[MDF], start_time) -> MDF:
+    """ Combine decoded MF4s into one, keeping the order of parts and of their channel groups together with the
+        group names, sources and bus event flags so the result looks like one extract_bus_logging call """
+    out = MDF(version=parts[0].version if parts else '4.11', use_display_names=True)
+    out.header.start_time = start_time
+    for part in parts:
+        for index, group in enumerate(part.groups):
+            signals = part.select([(None, index, channel) for channel in range(1, len(group.channels))], raw=True)
+            for signal in signals:
+                # the source path name is added again from the source when the group is written
+                signal.display_names = {name: kind for name, kind in signal.display_names.items() if kind != "source_path"}
+            channel_group = group.channel_group
+            cg_nr = out.append(signals, acq_name=channel_group.acq_name, acq_source=channel_group.acq_source,
+                               comment=channel_group.comment, common_timebase=True)
+            out.groups[cg_nr].channel_group.flags = channel_group.flags
+    return out
@@ -0,0 +1,89 @@
+import os
+import fcntl
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+from log_converter_logger import logger
+
+# suffix of files being decoded, it ends in .mf4 because asammdf saves MF4 files with that suffix only
+TMP_SUFFIX = ".tmp.mf4"
+
+
+class DecodedCache:
+    """ Decoded MF4 files generated on first request and kept in a folder of at most max_bytes. The least recently
+        used files are evicted first, a file's mtime is its last use. Requests for the same key wait for one decode
+        instead of decoding again, also across processes, by holding a file lock per key while decoding. """
+
+    def __init__(self, folder: Path, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> Path:
+        return self.folder / f"{key}.mf4"
+
+    def index_path(self, key: str) -> Path:
+        """ The time index of the decoded file of key, it is removed with the decoded file """
+        return self.folder / f"{key}.npz"
+
+    @contextmanager
+    def _lock(self, name: str):
+        # flock locks belong to the open file, so threads of one process exclude each other as well
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with open(self.folder / f".{name}.lock", 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def open(self, key: str, decode: Callable[[Path], None]) -> BinaryIO:
+        """ Open the decoded file of key for reading, decode(path) writes it to path if it is not cached. The file
+            is opened before it can be evicted, so it stays readable until closed. """
+        path = self.path(key)
+        with self._lock(key):
+            try:
+                # touched before it is opened, an eviction in between leaves no open file behind
+                os.utime(path)
+                f = open(path, 'rb')
+                logger.debug(f"\tDecoded cache hit for {key}")
+                return f
+            except FileNotFoundError:
+                pass
+
+            logger.info(f"Decoding {key} on demand")
+            tmp_path = self.folder / f"{key}.{os.getpid()}{TMP_SUFFIX}"
+            try:
+                # left over by a crashed decode, asammdf would save next to it instead of replacing it
+                tmp_path.unlink(missing_ok=True)
+                self.index_path(key).unlink(missing_ok=True)
+                decode(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            f = open(path, 'rb')
+        self.evict(keep=path)
+        return f
+
+    def evict(self, keep: Path = None) -> None:
+        """ Remove least recently used files until the cache fits in max_bytes, keep is never removed """
+        with self._lock("evict"):
+            entries = []
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".mf4") and not entry.name.endswith(TMP_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, Path(entry.path)))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                # the empty lock file stays, removing it could let two requests lock different files for one key
+                path.unlink(missing_ok=True)
+                path.with_suffix(".npz").unlink(missing_ok=True)
+                total -= size
+                logger.debug(f"\tEvicted {path.name} from the decoded cache")
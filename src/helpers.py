@@ -5,10 +5,22 @@ import asammdf.blocks.v4_constants as v4c
 import pandas as pd
 import os
 import json
+import mmap
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterator
 
 from pathlib import Path
 
+try:
+    import pyarrow as pa
+except ImportError: # only needed to read arrow backed string columns without converting them to python objects
+    pa = None
+
 from log_converter_logger import logger
+from config import PARALLEL_PARSE_FILE_SIZE, PARALLEL_PARSE_WORKERS
 
 
 # Constants for CAN signal conversion
@@ -32,11 +44,56 @@ CAN_SIGNAL_SOURCE = Source(
     bus_type=v4c.BUS_TYPE_CAN,
 )
 
+DATA_COLUMNS = [f"Data{i}" for i in range(8)]
+FRAME_COLUMNS = ['timestamp', 'CAN_BUS', 'CAN_EXT', 'CAN_ID', 'CAN_LEN'] + DATA_COLUMNS
+# compact dtypes of the frame table, a frame takes 23 bytes instead of 104 with int64 columns
+FRAME_DTYPES = {'timestamp': np.float64, 'CAN_BUS': np.uint8, 'CAN_EXT': np.uint8, 'CAN_ID': np.uint32, 'CAN_LEN': np.uint8,
+                **{column: np.uint8 for column in DATA_COLUMNS}}
+EOF_MARKER = b"---- EOF NEXT FILE TO FOLLOW ----"
+# bytes bytes.strip() removes from both ends of a line
+BLANK_BYTES = np.isin(np.arange(256), list(b" \t\r\x0b\x0c"))
+MAX_TIMESTAMP_CHARS = 32
+CSV_READ_DTYPES = {col: str for col in ['CAN_ID'] + DATA_COLUMNS}
+POWERS_OF_TEN = np.array([float(10 ** i) for i in range(MAX_TIMESTAMP_CHARS + 1)])
+
+# Lookup tables for vectorized hex decoding of ASCII bytes
+HEX_LUT = np.full(256, 0xFF, dtype=np.uint8)
+HEX_LUT[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEX_LUT[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+HEX_LUT[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+HEX_BLANK = np.zeros(256, dtype=bool)
+HEX_BLANK[np.frombuffer(b"\x00\t\n\x0b\x0c\r ", dtype=np.uint8)] = True
+# characters int(x, 16) accepts beyond hex digits and whitespace: a sign, a 0x prefix and digit separators
+HEX_SPECIAL = np.zeros(256, dtype=bool)
+HEX_SPECIAL[np.frombuffer(b"+-xX_", dtype=np.uint8)] = True
+# value of every two character field read as a little endian uint16, HEX_INVALID if int(x, 16) needs more than
+# hex digits and blanks for it, which makes data bytes a single table lookup
+HEX_INVALID = 0xFFFF
+_first, _second = np.divmod(np.arange(1 << 16), 256)[::-1]
+_first_nibble, _second_nibble = HEX_LUT[_first].astype(np.uint16), HEX_LUT[_second].astype(np.uint16)
+HEX_PAIR_LUT = np.select(
+    [(_first_nibble != 0xFF) & (_second_nibble != 0xFF), (_first_nibble != 0xFF) & HEX_BLANK[_second],
+     HEX_BLANK[_first] & (_second_nibble != 0xFF)],
+    [_first_nibble << 4 | _second_nibble, _first_nibble, _second_nibble], HEX_INVALID).astype(np.uint16)
+
 def get_dbc_file_list(folder: Path):
     if not folder.exists():
         raise FileNotFoundError("DBC Folder not found.")
     return map(lambda x: folder / x, filter(lambda x: x.endswith(".dbc"), os.listdir(folder)))
 
+def mf4_compression(name: str) -> v4c.CompressionAlgorithm:
+    """ asammdf compression for a name like none, deflate or transposed_deflate """
+    if name in ("", "none", "no_compression"):
+        return v4c.CompressionAlgorithm.NO_COMPRESSION
+    try:
+        compression = v4c.CompressionAlgorithm[name.upper()]
+    except KeyError:
+        compression = None
+    if compression is None or compression < 0:
+        names = ", ".join(c.name.lower() for c in v4c.CompressionAlgorithm if c > 0)
+        raise ValueError(f"Unknown MF4 compression {name}, expected none, {names}")
+    return compression
+
 def hex_to_int(x):
     return int(str(x), 16)
 
@@ -54,7 +111,100 @@ def is_val_float(val):
     except ValueError:
         return False
 
+def str_array_to_chars(values) -> np.ndarray:
+    """ Convert an array of strings to a fixed width ASCII byte matrix with shape values.shape + (width,).
+        Short strings are padded with NUL bytes, non ASCII characters are replaced with '?' """
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.zeros(values.shape + (1,), dtype=np.uint8)
+    try:
+        fixed = np.ascontiguousarray(values, dtype=np.bytes_)
+        return fixed.view(np.uint8).reshape(fixed.shape + (fixed.dtype.itemsize,))
+    except UnicodeEncodeError:
+        fixed = np.ascontiguousarray(values, dtype=np.str_)
+        codes = fixed.view(np.uint32).reshape(fixed.shape + (fixed.dtype.itemsize // 4,))
+        return np.where(codes < 128, codes, ord("?")).astype(np.uint8)
+
+def str_column_to_chars(column: pd.Series) -> np.ndarray:
+    """ str_array_to_chars for a dataframe column, arrow backed string columns are gathered straight from their
+        offsets and data buffers. Non ASCII characters stay UTF-8 bytes there, they are no hex digits either way. """
+    if pa is None or not isinstance(column.dtype, pd.StringDtype) or column.dtype.storage != "pyarrow":
+        return str_array_to_chars(column.to_numpy())
+    array = pa.array(column)
+    array = (array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array).cast(pa.large_string())
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    lengths = np.diff(offsets)
+    if data is None or data.size == 0:
+        return np.zeros((len(array), 1), dtype=np.uint8)
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(array) and (lengths == lengths[0]).all() and lengths[0] > 0:
+        # values of one width, like the two digit data bytes, are back to back in the data buffer
+        return data[offsets[0]:offsets[-1]].reshape(len(array), int(lengths[0]))
+    return gather_fields(data, offsets[:-1], lengths, max(int(lengths.max(initial=1)), 1))
+
+def hex_chars_to_int(chars: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Decode a matrix of ASCII hex characters (last axis is the characters of one value) into integers.
+        Follows int(x, 16): whitespace or NUL padding around the digits is allowed, values with a sign, 0x prefix or
+        digit separators fall back to int() one by one. Negative values and values over 64 bits are invalid, they fit
+        no column of the frame table.
+        Returns (uint64 values, bool valid mask), values of invalid entries are undefined. """
+    if chars.shape[-1] <= 2:
+        pairs = np.zeros(chars.shape[:-1] + (2,), dtype=np.uint8)
+        pairs[..., :chars.shape[-1]] = chars
+        values = HEX_PAIR_LUT[pairs.view("<u2")[..., 0]]
+        valid = values != HEX_INVALID
+        special = ~valid & HEX_SPECIAL[pairs].any(axis=-1)
+        values = values.astype(np.uint64)
+        if special.any():
+            values[special], valid[special] = _hex_chars_to_int_fallback(pairs[special], values[special], valid[special])
+        return values, valid
+
+    nibbles = HEX_LUT[chars]
+    is_digit = nibbles != 0xFF
+    valid = (is_digit | HEX_BLANK[chars]).all(axis=-1)
+
+    # the digits have to be one contiguous run, "99  8" is not a hex number
+    width = chars.shape[-1]
+    n_digits = is_digit.sum(axis=-1)
+    first = is_digit.argmax(axis=-1)
+    last = width - 1 - is_digit[..., ::-1].argmax(axis=-1)
+    valid &= (n_digits > 0) & (n_digits <= 16) & (last - first + 1 == n_digits)
+
+    values = np.zeros(chars.shape[:-1], dtype=np.uint64)
+    for i in range(width):
+        values = np.where(is_digit[..., i], (values << np.uint64(4)) | nibbles[..., i], values)
+    return _hex_chars_to_int_fallback(chars, values, valid)
+
+def _hex_chars_to_int_fallback(chars: np.ndarray, values: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Decode the invalid values holding a sign, 0x prefix or digit separator with int(x, 16) one by one """
+    for i in zip(*np.nonzero(~valid & HEX_SPECIAL[chars].any(axis=-1))):
+        try:
+            value = int(chars[i].tobytes().strip(b"\0"), 16)
+        except ValueError:
+            continue
+        if 0 <= value < 2 ** 64:
+            values[i] = value
+            valid[i] = True
+    return values, valid
+
+def decode_hex_strings(values) -> tuple[np.ndarray, np.ndarray]:
+    """ Vectorized is_val_hex + hex_to_int for an array of strings """
+    return hex_chars_to_int(str_array_to_chars(values))
+
+def decode_hex_column(column: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """ decode_hex_strings for a dataframe column, each column is decoded at the width of its own longest value """
+    return hex_chars_to_int(str_column_to_chars(column))
+
+def fits_frame_dtypes(bus, ext, dlc, can_id, data) -> np.ndarray:
+    """ Rows that fit the compact FRAME_DTYPES: 29 bit IDs and 8 bit bus, flags, DLC and data bytes """
+    fits_byte = lambda values: (values >= 0) & (values <= 0xFF)
+    return fits_byte(bus) & fits_byte(ext) & fits_byte(dlc) & (can_id <= 0x1FFFFFFF) & (data <= 0xFF).all(axis=1)
+
 def read_csv_data(df: pd.DataFrame) -> [pd.DataFrame, bool]:
+    """ Validate and convert the columns of a CSV log read with CSV_READ_DTYPES, rows with a malformed value are dropped.
+        Unlike the old per value int(x, 16) conversion, negative hex values and values that do not fit the compact
+        FRAME_DTYPES (IDs over 29 bits, bus, flags, DLC or data bytes over 0xFF) are malformed as well. """
     continues = False
     df = df.fillna('00')
     logger.debug("\tRead CSV data to dataframe")
@@ -68,19 +218,23 @@ def read_csv_data(df: pd.DataFrame) -> [pd.DataFrame, bool]:
         else:
             logger.warning("\t\t\tTimestamps are not floats and last row is not EOF string! This file contains invalid timestamps.")
 
-    df = df[df['timestamp'].apply(is_val_float)]
-    df['timestamp'] = df['timestamp'].astype(np.float64)
+    logger.debug('\tvalidating and converting all columns into numeric values')
+    decoded = {column: pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+               for column in ['timestamp', 'CAN_BUS', 'CAN_EXT', 'CAN_LEN']}
+    valid = ~np.isnan(decoded['timestamp']) & ~np.isnan(decoded['CAN_BUS']) & ~np.isnan(decoded['CAN_EXT']) & ~np.isnan(decoded['CAN_LEN'])
+    can_id, id_valid = decode_hex_column(df['CAN_ID'])
+    data, data_valid = (np.stack(decoded, axis=1) for decoded in zip(*(decode_hex_column(df[column]) for column in DATA_COLUMNS)))
+    valid &= id_valid & data_valid.all(axis=1)
+    valid &= fits_frame_dtypes(decoded['CAN_BUS'], decoded['CAN_EXT'], decoded['CAN_LEN'], can_id, data)
+    for column in ['CAN_BUS', 'CAN_EXT', 'CAN_LEN']:
+        decoded[column] = np.where(valid, decoded[column], 0).astype(FRAME_DTYPES[column])
+    decoded['CAN_ID'] = can_id.astype(FRAME_DTYPES['CAN_ID'])
+    for i, column in enumerate(DATA_COLUMNS):
+        decoded[column] = data[:, i].astype(FRAME_DTYPES[column])
 
-    for column in ['CAN_ID', 'Data0', 'Data1', 'Data2', 'Data3', 'Data4', 'Data5', 'Data6', 'Data7']:
-        df = df[df[column].apply(is_val_hex)]
-
-    logger.debug('\tconverting all hex columns into integer values')
-    for column in ['CAN_ID', 'Data0', 'Data1', 'Data2', 'Data3', 'Data4', 'Data5', 'Data6', 'Data7']:
-        df[column] = df[column].apply(hex_to_int)
-
-    logger.debug('\tconverting CAN_BUS and CAN_EXT to integer values')
-    for column in ['CAN_BUS', 'CAN_EXT']:
-        df[column] = df[column].apply(int)
+    # drop all bad rows in a single filter pass
+    df = pd.DataFrame({column: decoded[column][valid] if column in decoded else df[column].to_numpy()[valid]
+                       for column in df.columns}, index=df.index[valid])
 
     logger.debug('\tconversion complete')
     return df, continues
@@ -110,84 +264,406 @@ def dat_line_to_data(line):
         logger.info("\t\t\tIncorrect data line format: {}".format(line))
         raise Exception("Malformed DAT Packet")
 
-def data_to_csv_line(data):
-    return ",".join(str(data[k]) for k in [
-        'timestamp', 'CAN_BUS', 'CAN_EXT', 'CAN_ID', 'CAN_LEN',
-        'Data0','Data1','Data2','Data3','Data4','Data5','Data6','Data7']) + "\n"
+def split_lines(buf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Start and end offsets of all non empty lines in a uint8 buffer, blanks at both ends like \\r are not part
+        of the line, as line.strip() of the line by line readers """
+    if len(buf) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    newlines = np.flatnonzero(buf == ord("\n"))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buf)]))
+    # one step per blank, only over the lines that still end or start with one
+    trailing = np.flatnonzero((ends > starts) & BLANK_BYTES[buf[np.maximum(ends - 1, 0)]])
+    while len(trailing):
+        ends[trailing] -= 1
+        trailing = trailing[(ends[trailing] > starts[trailing]) & BLANK_BYTES[buf[np.maximum(ends[trailing] - 1, 0)]]]
+    leading = np.flatnonzero((ends > starts) & BLANK_BYTES[buf[np.minimum(starts, len(buf) - 1)]])
+    while len(leading):
+        starts[leading] += 1
+        leading = leading[(ends[leading] > starts[leading]) & BLANK_BYTES[buf[np.minimum(starts[leading], len(buf) - 1)]]]
+    keep = ends > starts
+    return starts[keep], ends[keep]
 
-def read_dat_file(f):
-    continues = False
-    tmp_file_path = "/tmp/test_file.csv"
-    with open(tmp_file_path, "w") as csv_file:
-        csv_file.write("timestamp,CAN_BUS,CAN_EXT,CAN_ID,CAN_LEN,Data0,Data1,Data2,Data3,Data4,Data5,Data6,Data7\n")
-        for i, line in enumerate(f):
-            line = line.strip()
-            if line == "---- EOF NEXT FILE TO FOLLOW ----":
-                continues = True
-                break
-            try:
-                csv_file.write(data_to_csv_line(dat_line_to_data(line)))
-            except Exception as e:
-                logger.info(f"\t\tException processing line: {line}. Skipping line")
-                logger.info(e)
-            if (i % 1000000) == 1:
-                logger.debug(f"\t\t\tDone {i} lines")
+def find_eof_line(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> int:
+    """ Index of the EOF continuation marker line, -1 if there is none """
+    candidates = np.flatnonzero((ends - starts == len(EOF_MARKER)) & (buf[np.minimum(starts, max(len(buf) - 1, 0))] == EOF_MARKER[0]))
+    for i in candidates:
+        if buf[starts[i]:ends[i]].tobytes() == EOF_MARKER:
+            return int(i)
+    return -1
 
-    df = pd.read_csv(tmp_file_path,
-                     dtype={col: str for col in ['CAN_ID', 'Data0','Data1','Data2','Data3','Data4','Data5','Data6','Data7']},
-                     on_bad_lines='skip')
+def split_log_lines(buf: np.ndarray) -> tuple[np.ndarray, np.ndarray, bool]:
+    """ split_lines that stops at the EOF continuation marker, continues is True if the marker was found """
+    starts, ends = split_lines(buf)
+    eof = find_eof_line(buf, starts, ends)
+    if eof == -1:
+        return starts, ends, False
+    logger.debug("\t\tthis file has eof, marking for combining with next file")
+    return starts[:eof], ends[:eof], True
 
-    for column in ['CAN_ID', 'Data0', 'Data1', 'Data2', 'Data3', 'Data4', 'Data5', 'Data6', 'Data7']:
-        df[column] = df[column].apply(hex_to_int)
+def next_line_start(buf: np.ndarray, pos: int) -> int:
+    """ Offset just after the first newline at or after pos, len(buf) if there is none """
+    while pos < len(buf):
+        newlines = np.flatnonzero(buf[pos:pos + 4096] == ord("\n"))
+        if len(newlines):
+            return pos + int(newlines[0]) + 1
+        pos += 4096
+    return len(buf)
 
-    return df, continues
+def find_in_lines(buf: np.ndarray, char: bytes, starts: np.ndarray, ends: np.ndarray, positions: np.ndarray = None) -> np.ndarray:
+    """ Offset of the first char at or after each start, or the line end if the line does not contain it.
+        positions can hold the precomputed offsets of char in buf when searching for it repeatedly. """
+    if positions is None:
+        positions = np.flatnonzero(buf == ord(char))
+    found = np.append(positions, len(buf))[np.searchsorted(positions, starts)]
+    return np.minimum(found, ends)
+
+def gather_fields(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray, width: int) -> np.ndarray:
+    """ starts.shape + (width,) matrix holding buf[start:start + length] for every field, padded with NUL bytes """
+    cols = np.arange(width)
+    index = np.minimum(starts[..., None] + cols, max(len(buf) - 1, 0))
+    return np.where(cols < lengths[..., None], buf[index], 0).astype(np.uint8)
+
+def decimal_chars_to_float(chars: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Parse a (n, width) matrix of NUL padded ASCII numbers into float64 values and a valid mask.
+        Plain decimals like "8.543" are parsed in bulk, anything else falls back to float() per value. """
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    is_point = chars == ord(".")
+    n_digits = is_digit.sum(axis=1)
+    simple = (is_digit | is_point | (chars == 0)).all(axis=1) & (is_point.sum(axis=1) <= 1) & (n_digits > 0) & (n_digits <= 15)
+
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    for i in range(chars.shape[1]):
+        mantissa = np.where(is_digit[:, i], mantissa * 10 + (chars[:, i].astype(np.int64) - ord("0")), mantissa)
+    point = np.where(is_point.any(axis=1), is_point.argmax(axis=1), chars.shape[1])
+    n_fraction = (is_digit & (np.arange(chars.shape[1]) > point[:, None])).sum(axis=1)
+    # integer / exact power of ten is correctly rounded, the same result as float(text)
+    values = mantissa / POWERS_OF_TEN[n_fraction]
+    valid = simple.copy()
+
+    for i in np.flatnonzero(~simple & chars.any(axis=1)):
+        text = chars[i].tobytes().rstrip(b"\0")
+        if is_val_float(text):
+            values[i] = float(text)
+            valid[i] = True
+    return values, valid
+
+def parse_dat_lines(buf: np.ndarray, lines: tuple[np.ndarray, np.ndarray] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Parse DAT lines (timestamp-bus-ID#HEXDATA) from a uint8 buffer straight into CAN_SIGNAL_DTYPE frames.
+        lines are the (starts, ends) of the lines to parse, all lines of buf by default.
+        Returns (timestamps, frames, valid), valid marks the lines that were parsed, malformed lines are dropped. """
+    starts, ends = split_lines(buf) if lines is None else lines
+    dash_positions = np.flatnonzero(buf == ord("-"))
+    dash1 = find_in_lines(buf, b"-", starts, ends, dash_positions)
+    dash2 = find_in_lines(buf, b"-", dash1 + 1, ends, dash_positions)
+    hash_mark = find_in_lines(buf, b"#", dash2, ends)
+    valid = (dash1 < ends) & (dash2 == dash1 + 2) & (hash_mark < ends)
+
+    timestamps, timestamp_valid = decimal_chars_to_float(gather_fields(buf, starts, dash1 - starts, MAX_TIMESTAMP_CHARS))
+    valid &= timestamp_valid & (dash1 - starts <= MAX_TIMESTAMP_CHARS)
+
+    bus = buf[np.minimum(dash1 + 1, max(len(buf) - 1, 0))].astype(np.int64) - ord("0")
+    valid &= (bus >= 0) & (bus <= 9)
+
+    id_len = hash_mark - dash2 - 1
+    can_id, id_valid = hex_chars_to_int(gather_fields(buf, dash2 + 1, id_len, 8))
+    valid &= id_valid & (id_len <= 8)
+
+    # odd length data ends in a single nibble ("ABC" is AB 0C), missing bytes are zero
+    data_len = ends - hash_mark - 1
+    valid &= data_len <= 16
+    data_chars = gather_fields(buf, hash_mark + 1, data_len, 16)
+    padding = np.arange(16) >= 2 * ((data_len[:, None] + 1) // 2)
+    data_chars[padding] = ord("0")
+    data, data_valid = hex_chars_to_int(data_chars.reshape(-1, 8, 2))
+    valid &= data_valid.all(axis=1) & fits_frame_dtypes(bus, 0, 0, can_id, data)
+
+    n_valid = int(valid.sum())
+    if n_valid < len(valid):
+        logger.info(f"\t\tSkipped {len(valid) - n_valid} malformed DAT lines")
+
+    frames = build_frames(bus[valid], can_id[valid], id_len[valid] > 3, (data_len[valid] + 1) // 2, data[valid])
+    return timestamps[valid], frames, valid
+
+def parse_csv_lines(buf: np.ndarray, lines: tuple[np.ndarray, np.ndarray] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Parse CSV lines in the FRAME_COLUMNS layout from a uint8 buffer, with the same result as read_csv + read_csv_data:
+        lines with too many fields are skipped, missing or empty fields are 0 and rows with malformed values are dropped.
+        Returns (timestamps, frames, valid) like parse_dat_lines, valid covers the rows that were not skipped. """
+    starts, ends = split_lines(buf) if lines is None else lines
+    # the n-th comma after the line start is the n-th separator as long as it is still before the line end
+    commas = np.append(np.flatnonzero(buf == ord(",")), len(buf))
+    first_comma = np.searchsorted(commas, starts)
+    separators = [starts - 1]
+    for i in range(len(FRAME_COLUMNS)):
+        separators.append(np.minimum(commas[np.minimum(first_comma + i, len(commas) - 1)], ends))
+    # a separator after the last field means the line has too many fields
+    keep = separators[-1] == ends
+    if not keep.all():
+        logger.info(f"\t\tSkipped {int((~keep).sum())} CSV lines with too many fields")
+    field_starts = np.stack([separator[keep] + 1 for separator in separators[:-1]], axis=1)
+    field_lengths = np.maximum(np.stack([separator[keep] for separator in separators[1:]], axis=1) - field_starts, 0)
+
+    def decode_fields(columns, decode, max_width, common_width=None):
+        """ decode the given fields of every row, empty fields are NaN for read_csv and filled with "00".
+            Fields are decoded common_width characters wide, only the rows with longer fields again at the full width. """
+        index = [FRAME_COLUMNS.index(column) for column in columns]
+        starts, lengths = field_starts[:, index], field_lengths[:, index]
+        width = int(np.clip(lengths.max(initial=1), 1, max_width))
+        narrow = min(width, common_width or width)
+        values, valid = decode(gather_fields(buf, starts, lengths, narrow))
+        wide = (lengths > narrow).any(axis=1)
+        if wide.any():
+            values[wide], valid[wide] = decode(gather_fields(buf, starts[wide], lengths[wide], width))
+        values = np.where(lengths == 0, 0, values)
+        valid = (valid | (lengths == 0)) & (lengths <= width)
+        return values, valid
+
+    def decode_decimal(chars):
+        values, valid = decimal_chars_to_float(chars.reshape(-1, chars.shape[-1]))
+        return values.reshape(chars.shape[:-1]), valid.reshape(chars.shape[:-1])
+
+    # the single digit bus, flags and DLC and the two digit data bytes are decoded apart from the wider timestamp and ID
+    timestamps, timestamps_valid = decode_fields(['timestamp'], decode_decimal, MAX_TIMESTAMP_CHARS)
+    numbers, numbers_valid = decode_fields(['CAN_BUS', 'CAN_EXT', 'CAN_LEN'], decode_decimal, MAX_TIMESTAMP_CHARS, common_width=1)
+    can_id, id_valid = decode_fields(['CAN_ID'], hex_chars_to_int, 16)
+    data, data_valid = decode_fields(DATA_COLUMNS, hex_chars_to_int, 16, common_width=2)
+    valid = timestamps_valid[:, 0] & numbers_valid.all(axis=1) & id_valid[:, 0] & data_valid.all(axis=1)
+    valid &= fits_frame_dtypes(numbers[:, 0], numbers[:, 1], numbers[:, 2], can_id[:, 0], data)
+
+    if not valid.all():
+        logger.info(f"\t\tDropped {int((~valid).sum())} CSV rows with invalid values")
+
+    frames = build_frames(numbers[valid, 0], can_id[valid, 0], numbers[valid, 1], numbers[valid, 2], data[valid])
+    return timestamps[valid, 0], frames, valid
+
+def map_log_file(file: Path) -> np.ndarray:
+    """ Memory map a file read only as a uint8 array, the mapping is released together with the last view of the array """
+    with open(file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+
+def open_log(file: Path) -> tuple[dict, str, np.ndarray]:
+    """ Memory map a log file and split it into the metadata, the line format ("CSV", "DAT" or None for CSV files
+        with a non standard header that have to go through pandas) and a zero copy view of the frame lines """
+    buf = map_log_file(file)
+    meta_end = next_line_start(buf, 0)
+    meta = json.loads(buf[:meta_end].tobytes())
+    header_end = next_line_start(buf, meta_end)
+    if "log_type" in meta and meta["log_type"].startswith("DAT"):
+        log_format = "DAT"
+    elif buf[meta_end:header_end].tobytes().strip().split(b",") == [column.encode() for column in FRAME_COLUMNS]:
+        log_format = "CSV"
+    else:
+        log_format = None
+    return meta, log_format, buf[header_end:]
+
+def log_content_hash(file: Path) -> bytes:
+    """ sha256 fingerprint of the frame lines of a log, everything after the metadata and the CSV header line.
+        Hashed straight from the memory map so a duplicate is found without parsing the log. """
+    _, _, buf = open_log(file)
+    return hashlib.sha256(buf).digest()
+
+def legacy_log_hash(file: Path) -> bytes:
+    """ Fingerprint the hash column held before log_content_hash: sha256 of pd.util.hash_pandas_object of the parsed
+        log, in the column dtypes the old readers produced (int64 columns, float64 bus and flags for DAT logs and
+        float CAN_LEN objects for CSV logs with the EOF marker). Parses the whole log. """
+    df, _, continues = read_log_to_df(file)
+    _, log_format, _ = open_log(file)
+    df = df.astype({column: np.int64 for column in FRAME_COLUMNS[1:]})
+    if log_format == "DAT":
+        df = df.astype({'CAN_BUS': np.float64, 'CAN_EXT': np.float64})
+    elif continues:
+        df['CAN_LEN'] = df['CAN_LEN'].astype(np.float64).astype(object)
+    return hashlib.sha256(pd.util.hash_pandas_object(df).values).digest()
+
+def read_log_meta(file: Path) -> dict:
+    """ Read only the JSON metadata header line of a log file """
+    with open(file, 'rb') as f:
+        return json.loads(f.readline())
+
+def log_continues(file: Path) -> bool:
+    """ Check if a log ends with the EOF continuation marker by reading only the tail of the file """
+    return any(line.strip() == EOF_MARKER for line in tail(file, lines=3).splitlines())
+
+def read_log_to_frames(file: Path) -> tuple[np.ndarray, np.ndarray, dict, bool]:
+    """ Read a log straight into float64 timestamps and CAN_SIGNAL_DTYPE frames without building a dataframe.
+        Returns (timestamps, frames, meta, continues). """
+    logger.debug(f"Reading file {file} to frames")
+    meta, log_format, buf = open_log(file)
+    if log_format is None:
+        df, meta, continues = read_log_to_df(file)
+        return (*df_to_frames(df), meta, continues)
+
+    logger.debug(f"\tProcessing file as {log_format}")
+    timestamps, frames, _, continues = parse_log_lines(file, log_format, buf)
+    return timestamps, frames, meta, continues
 
 def read_log_to_df(file:Path) -> [pd.DataFrame, dict, bool]:
     logger.debug(f"Reading file {file} to dataframe")
-    with open(file, 'r') as f:
-        meta = json.loads(f.readline())
-        logger.debug("\tloaded metadata from file")
-        if "log_type" in meta and meta["log_type"].startswith("CSV"):
-            logger.debug("\tProcessing file as CSV")
-            df = pd.read_csv(f, dtype={col: str for col in ['CAN_ID','Data0','Data1','Data2','Data3','Data4','Data5','Data6','Data7']}, on_bad_lines='skip')
-            df, continues = read_csv_data(df)
-        elif "log_type" in meta and meta["log_type"].startswith("DAT"):
-            logger.debug("\tProcessing file as DAT")
-            f.readline()  # Skip header line
-            df, continues = read_dat_file(f)
-        else:
-            logger.debug("\tNo log_type, processing file as CSV")
-            df = pd.read_csv(f, dtype={col: str for col in ['CAN_ID','Data0','Data1','Data2','Data3','Data4','Data5','Data6','Data7']}, on_bad_lines='skip')
-            df, continues = read_csv_data(df)
+    meta, log_format, buf = open_log(file)
+    logger.debug("\tloaded metadata from file")
+    if log_format is None:
+        logger.debug("\tNon standard CSV header, processing file with pandas")
+        with open(file, 'rb') as f:
+            f.readline()
+            df = pd.read_csv(f, dtype=CSV_READ_DTYPES, on_bad_lines='skip')
+        df, continues = read_csv_data(df)
+        return df, meta, continues
+
+    logger.debug(f"\tProcessing file as {log_format}")
+    timestamps, frames, valid, continues = parse_log_lines(file, log_format, buf)
+    # CSV rows keep their row number as index like read_csv does
+    index = np.flatnonzero(valid) if log_format == "CSV" else None
+    return frames_to_df(timestamps, frames, index), meta, continues
 
-    return df, meta, continues
+def parse_log_lines(file: Path, log_format: str, buf: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    """ Parse the frame lines of an opened log, logs of at least PARALLEL_PARSE_FILE_SIZE bytes are parsed on
+        PARALLEL_PARSE_WORKERS processes. Returns (timestamps, frames, valid, continues). """
+    if PARALLEL_PARSE_FILE_SIZE > 0 and PARALLEL_PARSE_WORKERS > 1 and len(buf) >= PARALLEL_PARSE_FILE_SIZE:
+        return parse_log_lines_parallel(file, buf, PARALLEL_PARSE_WORKERS)
+    starts, ends, continues = split_log_lines(buf)
+    return (*LINE_PARSERS[log_format](buf, (starts, ends)), continues)
+
+def split_byte_ranges(buf: np.ndarray, n_ranges: int) -> list[tuple[int, int]]:
+    """ Split buf into at most n_ranges (start, end) byte ranges of about the same size that end at line boundaries """
+    bounds = [0] + [next_line_start(buf, max(len(buf) * i // n_ranges - 1, 0)) for i in range(1, n_ranges)] + [len(buf)]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def parse_log_lines_parallel(file: Path, buf: np.ndarray, workers: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    """ parse_log_lines on byte ranges of the log in worker processes, the results are concatenated in file order
+        and are the same as parsing the whole file at once """
+    ranges = split_byte_ranges(buf, workers)
+    logger.debug(f"\tParsing {len(buf)} bytes in {len(ranges)} ranges on {workers} processes")
+    parsed = []
+    # every worker maps the file itself, only the parsed arrays are sent back
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for timestamps, frames, valid, continues in pool.map(_parse_log_range, repeat(file), *zip(*ranges)):
+            parsed.append((timestamps, frames, valid))
+            # lines after the EOF marker are not part of the log
+            if continues:
+                break
+    timestamps, frames, valid = (np.concatenate(arrays) for arrays in zip(*parsed))
+    return timestamps, frames, valid, continues
+
+def _parse_log_range(file: Path, start: int, end: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    _, log_format, buf = open_log(file)
+    chunk = buf[start:end]
+    starts, ends, continues = split_log_lines(chunk)
+    return (*LINE_PARSERS[log_format](chunk, (starts, ends)), continues)
+
+def read_log_chunks(file: Path, chunk_bytes: int) -> tuple[dict, Iterator[tuple[np.ndarray, np.ndarray, bool]]]:
+    """ Streaming version of read_log_to_frames that parses about chunk_bytes of the memory mapped input at a time.
+        Logs of at least PARALLEL_PARSE_FILE_SIZE bytes are parsed on PARALLEL_PARSE_WORKERS processes, one chunk each.
+        Returns the metadata and a generator of (timestamps, frames, continues) chunks, continues can only be set on the last chunk. """
+    logger.debug(f"Streaming file {file} in chunks of {chunk_bytes} bytes")
+    meta, log_format, buf = open_log(file)
+    if log_format is None:
+        timestamps, frames, meta, continues = read_log_to_frames(file)
+        return meta, iter([(timestamps, frames, continues)])
+    if PARALLEL_PARSE_FILE_SIZE > 0 and PARALLEL_PARSE_WORKERS > 1 and len(buf) >= PARALLEL_PARSE_FILE_SIZE:
+        return meta, _read_chunks_parallel(file, buf, chunk_bytes, PARALLEL_PARSE_WORKERS)
+    return meta, _read_chunks(buf, LINE_PARSERS[log_format], chunk_bytes)
+
+def chunk_byte_ranges(buf: np.ndarray, chunk_bytes: int) -> Iterator[tuple[int, int]]:
+    """ (start, end) byte ranges of about chunk_bytes that end at line boundaries """
+    pos = 0
+    while pos < len(buf):
+        end = next_line_start(buf, pos + chunk_bytes - 1)
+        yield pos, end
+        pos = end
+
+def _read_chunks(buf: np.ndarray, parse_lines, chunk_bytes: int) -> Iterator[tuple[np.ndarray, np.ndarray, bool]]:
+    for start, end in chunk_byte_ranges(buf, chunk_bytes):
+        chunk = buf[start:end]
+        starts, ends, continues = split_log_lines(chunk)
+        timestamps, frames, _ = parse_lines(chunk, (starts, ends))
+        yield timestamps, frames, continues
+        if continues:
+            return
+
+def _read_chunks_parallel(file: Path, buf: np.ndarray, chunk_bytes: int, workers: int) -> Iterator[tuple[np.ndarray, np.ndarray, bool]]:
+    """ _read_chunks with the chunks parsed in worker processes, at most one chunk per worker is parsed ahead of the
+        consumer so memory stays bounded by workers + 1 parsed chunks """
+    logger.debug(f"\tParsing chunks on {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for start, end in chunk_byte_ranges(buf, chunk_bytes):
+                pending.append(pool.submit(_parse_log_range, file, start, end))
+                if len(pending) < workers:
+                    continue
+                timestamps, frames, _, continues = pending.popleft().result()
+                yield timestamps, frames, continues
+                if continues:
+                    return
+            while pending:
+                timestamps, frames, _, continues = pending.popleft().result()
+                yield timestamps, frames, continues
+                if continues:
+                    return
+        finally:
+            # lines after the EOF marker are not part of the log
+            for future in pending:
+                future.cancel()
+
+LINE_PARSERS = {"CSV": parse_csv_lines, "DAT": parse_dat_lines}
+
+def build_frames(bus, can_id, ext, dlc, data) -> np.ndarray:
+    """ Fill a preallocated CAN_SIGNAL_DTYPE record array, data is the (n, 8) matrix of data bytes. Dir, EDL and BRS are 0. """
+    frames = np.zeros(len(can_id), dtype=CAN_SIGNAL_DTYPE)
+    frames['CAN_DataFrame.BusChannel'] = bus
+    frames['CAN_DataFrame.ID'] = can_id
+    frames['CAN_DataFrame.IDE'] = ext
+    frames['CAN_DataFrame.DLC'] = dlc
+    frames['CAN_DataFrame.DataLength'] = dlc
+    frames['CAN_DataFrame.DataBytes'] = data
+    return frames
+
+def df_to_frames(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """ Convert a frame table to (timestamps, CAN_SIGNAL_DTYPE frames) """
+    frames = build_frames(df['CAN_BUS'].to_numpy(), df['CAN_ID'].to_numpy(), df['CAN_EXT'].to_numpy(),
+                          df['CAN_LEN'].to_numpy(), df[DATA_COLUMNS].to_numpy())
+    return df['timestamp'].to_numpy(dtype=np.float64), frames
+
+def frames_to_df(timestamps: np.ndarray, frames: np.ndarray, index=None) -> pd.DataFrame:
+    """ Convert (timestamps, frames) to a frame table with the FRAME_COLUMNS layout """
+    columns = {
+        'timestamp': timestamps.astype(FRAME_DTYPES['timestamp'], copy=False),
+        'CAN_BUS': frames['CAN_DataFrame.BusChannel'],
+        'CAN_EXT': frames['CAN_DataFrame.IDE'],
+        'CAN_ID': frames['CAN_DataFrame.ID'],
+        'CAN_LEN': frames['CAN_DataFrame.DLC'],
+    }
+    data = frames['CAN_DataFrame.DataBytes']
+    columns.update({column: data[:, i] for i, column in enumerate(DATA_COLUMNS)})
+    return pd.DataFrame(columns, index=index)
 
 def df_to_mf4(df: pd.DataFrame) -> MDF:
-    row_count = df.shape[0]
-    Bytes = df[[f'Data{i}' for i in range(8)]].values.astype('u1')
-    arrays = [
-        df['CAN_BUS'].to_numpy(dtype='u1'),
-        df['CAN_ID'].to_numpy(dtype='u4'),
-        df['CAN_EXT'].to_numpy(dtype='u1'),
-        df['CAN_LEN'].to_numpy(dtype='u1'),
-        df['CAN_LEN'].to_numpy(dtype='u1'),
-        Bytes,
-        np.zeros(row_count, dtype='u1'),
-        np.zeros(row_count, dtype='u1'),
-        np.zeros(row_count, dtype='u1'),
-    ]
-    sig = Signal(
-        samples=np.rec.fromarrays(arrays, dtype=CAN_SIGNAL_DTYPE),
-        timestamps=df['timestamp'].to_numpy(),
-        name="CAN_DataFrame",
-        source=CAN_SIGNAL_SOURCE,
-        master_metadata=['Timestamp', 0]
-    )
+    return frames_to_mf4(*df_to_frames(df))
+
+def frames_to_mf4(timestamps: np.ndarray, frames: np.ndarray) -> MDF:
     mdf = MDF(version='4.11')
-    if row_count > 0:
-        mdf.append(sig, acq_source=CAN_SIGNAL_SOURCE)
+    append_frames_to_mf4(mdf, timestamps, frames)
     return mdf
 
+def append_frames_to_mf4(mdf: MDF, timestamps: np.ndarray, frames: np.ndarray) -> None:
+    """ Append frames to the CAN_DataFrame group of a raw MF4, the group is created by the first non empty call """
+    if len(frames) == 0:
+        return
+    if not mdf.groups:
+        sig = Signal(
+            samples=frames.view(np.recarray),
+            timestamps=timestamps,
+            name="CAN_DataFrame",
+            source=CAN_SIGNAL_SOURCE,
+            master_metadata=['Timestamp', 0]
+        )
+        mdf.append(sig, acq_source=CAN_SIGNAL_SOURCE)
+    else:
+        # asammdf writes appended samples to its temporary file, so memory does not grow with the log
+        mdf.extend(0, [(timestamps, None), (frames, None)])
+
 def tail(path, lines=20):
     with open(path, 'rb') as f:
         f.seek(0, 2)
@@ -0,0 +1,84 @@
+import os
+import ctypes
+import ctypes.util
+import select
+import struct
+import time
+from pathlib import Path
+
+from log_converter_logger import logger
+
+# inotify event masks from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, len followed by len bytes of name
+
+
+class InputWatcher:
+    """ Wait for finished log files in a folder. Uses inotify to wake up as soon as a log is renamed into or written
+        to the folder and falls back to polling every poll_interval seconds when inotify is not available. """
+
+    def __init__(self, folder: Path, poll_interval: float, debounce: float, use_inotify: bool = True):
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.fd = self._init_inotify(folder) if use_inotify else None
+        if self.fd is None:
+            logger.info("Polling %s every %s seconds for new files", folder, poll_interval)
+
+    @staticmethod
+    def _init_inotify(folder: Path):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if libc.inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+        except (OSError, AttributeError) as e:
+            logger.warning("inotify not available (%s), falling back to polling", e)
+            return None
+        logger.info("Watching %s for new files with inotify", folder)
+        return fd
+
+    def _read_events(self, timeout: float) -> bool:
+        """ Wait up to timeout seconds for events and drain them, True if a log file arrived """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        new_log = False
+        offset = 0
+        while offset < len(data):
+            _, mask, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_len].rstrip(b"\0")
+            offset += INOTIFY_EVENT.size + name_len
+            # on a queue overflow events were lost, a scan finds whatever arrived
+            new_log |= bool(mask & IN_Q_OVERFLOW) or name.lower().endswith(b".log")
+        return new_log
+
+    def wait(self) -> bool:
+        """ Block until a new log file arrives or poll_interval passes, True if woken up by a new file.
+            After the first file more files are collected until none arrived for debounce seconds so a burst of
+            uploads is processed in one go, the wait never takes longer than poll_interval in total. """
+        if self.fd is None:
+            time.sleep(self.poll_interval)
+            return False
+
+        deadline = time.monotonic() + self.poll_interval
+        while not self._read_events(max(deadline - time.monotonic(), 0)):
+            if time.monotonic() >= deadline:
+                return False
+        while time.monotonic() < deadline and self._read_events(min(self.debounce, max(deadline - time.monotonic(), 0))):
+            pass
+        return True
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
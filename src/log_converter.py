@@ -1,19 +1,30 @@
 import os
-import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import timedelta
+from itertools import repeat
 from dateutil import parser
 from pathlib import Path
-import hashlib
-import pandas as pd
+import numpy as np
+from asammdf import MDF
 
 from log_converter_logger import logger
 
 from database import *
 from database.upgrade import init_and_upgrade_db
 
-from helpers import read_log_to_df, get_dbc_file_list, df_to_mf4
-
-from config import DATA_FOLDER, SLEEP_TIME_BETWEEN_PROCESSINGS
+from input_watcher import InputWatcher
+from dbc_cache import DbcCache
+from dbc_decoder import decode_can_frames, can_database_supported, stack_decoded_mf4
+from signal_export import export_decoded_signals, EXPORT_SUFFIXES
+from signal_preview import save_signal_preview, preview_path
+from signal_query import save_time_index, time_index_path, signal_spans
+from can_id_stats import CanIdStatsAccumulator, can_id_stats, bus_baudrates, frame_fields
+from processing_metrics import StageTimer
+import helpers
+from helpers import read_log_to_frames, read_log_meta, log_continues, read_log_chunks, get_dbc_file_list, frames_to_mf4, append_frames_to_mf4, log_content_hash, legacy_log_hash, mf4_compression
+
+from config import DATA_FOLDER, SLEEP_TIME_BETWEEN_PROCESSINGS, STREAMING_FILE_SIZE, STREAMING_CHUNK_BYTES, PROCESSING_WORKERS, WATCH_INPUT_FOLDER, WATCH_DEBOUNCE_SECONDS, DBC_CACHE_FOLDER, DECODE_ENGINE, DECODE_WORKERS, RAW_MF4_COMPRESSION, DECODED_MF4_COMPRESSION, DECODE_ON_DEMAND, SIGNAL_EXPORT_FORMAT, SIGNAL_EXPORT_FOLDER, PREVIEW_BUCKET_SECONDS
 from database.crud import *
 
 INPUT_FILES = DATA_FOLDER / "in_logs/"
@@ -21,6 +32,15 @@ INPUT_FILES_UPLOAD = DATA_FOLDER / "in_logs/uploading"
 OUTPUT_FILES = DATA_FOLDER / "out/"
 DBC_FOLDER = DATA_FOLDER / "dbc/"
 
+# checked at startup so a misspelled compression fails before any log is processed
+RAW_COMPRESSION = mf4_compression(RAW_MF4_COMPRESSION)
+DECODED_COMPRESSION = mf4_compression(DECODED_MF4_COMPRESSION)
+if SIGNAL_EXPORT_FORMAT and SIGNAL_EXPORT_FORMAT not in EXPORT_SUFFIXES:
+    raise ValueError(f"Unknown signal export format {SIGNAL_EXPORT_FORMAT}, expected one of {', '.join(EXPORT_SUFFIXES)}")
+
+# parsed DBC files, kept across processing runs of this process
+DBC_CACHE = DbcCache(DBC_CACHE_FOLDER)
+
 SUBFOLDERS = [INPUT_FILES, INPUT_FILES_UPLOAD, OUTPUT_FILES, DBC_FOLDER]
 
 def setup_environment(subfolders: list[Path] = SUBFOLDERS):
@@ -38,176 +58,492 @@ def get_files_to_process(folder: Path) -> list[str]:
     return sorted([f for f in os.listdir(folder) if f.lower().endswith('.log')])
 
 
+def plan_chains(files: list[str]) -> dict[str, list[list[str]]]:
+    """ Pre-scan the JSON header and the tail of every input file and plan the continuation chains grouped by unit.
+        A file that ends with the EOF marker continues into the next file of the same unit number and unit type,
+        chains keep the sorted file order. Files without a readable header get a chain of their own so the error
+        shows up when they are processed. """
+    units = {}
+    continuing = {} # unit number -> (unit type, chain) of chains that wait for their next file
+    for file_name in files:
+        try:
+            meta = read_log_meta(INPUT_FILES / file_name)
+        except Exception:
+            logger.warning("Could not read header of %s, processing it on its own", file_name)
+            units[f"unreadable:{file_name}"] = [[file_name]]
+            continue
+
+        unit_type, chain = continuing.pop(meta['unit_number'], (None, None))
+        if chain is None or unit_type != meta['unit_type']:
+            if chain is not None:
+                logger.warning("Continuation Error: Unit type mismatch for next log after %s", chain[-1])
+            chain = []
+            units.setdefault(meta['unit_number'], []).append(chain)
+        chain.append(file_name)
+
+        if log_continues(INPUT_FILES / file_name):
+            continuing[meta['unit_number']] = (meta['unit_type'], chain)
+    return units
+
+
+def planned_continuations(file_name: str, files: list[str] = None) -> list[str]:
+    """ The files continuing file_name the way plan_chains chains them, for a log processed on its own.
+        Only the files after file_name are read and only until its chain ends, process_new_files passes the chains
+        it planned once instead. files are the waiting input files in processing order. """
+    files = get_files_to_process(INPUT_FILES) if files is None else files
+    meta = read_log_meta(INPUT_FILES / file_name)
+    remaining = iter(files[files.index(file_name) + 1:] if file_name in files else [])
+    chain = []
+    last = file_name
+    while log_continues(INPUT_FILES / last):
+        for next_name in remaining:
+            try:
+                next_meta = read_log_meta(INPUT_FILES / next_name)
+            except Exception:
+                continue
+            if next_meta['unit_number'] == meta['unit_number']:
+                break
+        else:
+            break
+        if next_meta['unit_type'] != meta['unit_type']:
+            break
+        chain.append(next_name)
+        last = next_name
+    return chain
+
+
+def find_legacy_duplicate(log_path: Path, candidates: list[LogFile], log_hash: bytes) -> LogFile:
+    """ Logs processed before log_content_hash have the legacy_log_hash of their parsed frames stored. A re-upload can
+        only match one of the candidates, the logs of the same unit and start time, so the log is only parsed for the
+        legacy hash when there are any. The match gets its content hash stored in its own unit of work, so it is
+        found by get_log_with_hash from then on. No transaction is open while the log is parsed. """
+    legacy_hash = legacy_log_hash(log_path)
+    for log in candidates:
+        if log.hash == legacy_hash:
+            logger.info("Log %s was stored with a legacy hash, updating it to the content hash", log.file_stem)
+            with db_session() as session:
+                update_log_file_hash(log.id, log_hash, session=session)
+            return log
+    return None
+
+
 def archive_log(original_path: Path, target_path: Path):
     target_path.parent.mkdir(parents=True, exist_ok=True)
     original_path.rename(target_path)
 
 
-def merge_continued_logs(initial_df: pd.DataFrame, initial_meta: dict, initial_continues: bool, file_name: str, global_dbc_files: list[tuple[Path, int]]) -> tuple:
-    df = initial_df
-    meta = initial_meta
-    continues = initial_continues
-    n_continuation = 0
+def add_continuation_to_meta(meta: dict, next_meta: dict, next_file_name: str, n_continuation: int) -> None:
+    """ Extend the metadata of a log with the continuation file described by next_meta and archive that file.
+        next_meta needs log_len_seconds and len of the continuation. """
+    logger.info("Extending original log length seconds from %d by %d", meta['log_len_seconds'], next_meta['log_len_seconds'])
+    start_time = parser.parse(next_meta['log_start_time'])
+    next_meta['log_end_time'] = start_time + timedelta(seconds=next_meta['log_len_seconds'] )
 
-    while continues:
-        n_continuation += 1
-        # get all files that are left to process, file that we want is alwasys the first one
-        files_remaining = get_files_to_process(INPUT_FILES)
-        logger.info("Merging continued log %s into %s", files_remaining[0], file_name)
+    next_start_time = parser.parse(next_meta['log_start_time'])
+
+    if meta['log_end_time'] + timedelta(seconds=10) < next_start_time:
+        logger.warning("Gap between logs is large for unit %s", meta['unit_number'])
+    if meta['log_end_time'] > next_start_time:
+        logger.warning("Overlap between logs for unit %s", meta['unit_number'])
 
-        next_df, next_meta, continues = read_log_to_df(INPUT_FILES / files_remaining[0])
+    meta['log_len_seconds'] += next_meta['log_len_seconds']
+    meta['len'] += next_meta['len']
+    meta['log_end_time'] = next_meta['log_end_time']
 
-        # compare unit types and unit numbers, if they are different do not process the next file
-        if (meta['unit_number'] != next_meta['unit_number']) or (meta['unit_type'] != next_meta['unit_type']):
-            logger.warning("Continuation Error: Unit number or type mismatch for next log after %s", meta['uuid'])
-            continues = False
-            return df, meta
+    update_log_file_status(meta['uuid'], "Combined With Later LOG")
 
-        next_meta['log_len_seconds'] = next_df.iloc[-1, 0]
-        logger.info("Extending original log length seconds from %d by %d", meta['log_len_seconds'], next_meta['log_len_seconds'])
-        start_time = parser.parse(next_meta['log_start_time'])
-        next_meta['log_end_time'] = start_time + timedelta(seconds=next_meta['log_len_seconds'] )
-        next_meta['len'] = len(next_df)
+    meta.setdefault('file_continuations', []).append({
+        "file_name": next_file_name,
+        "log_start_time": next_meta['log_start_time'],
+        "log_end_time": next_meta['log_end_time'],
+        "log_len_seconds": next_meta['log_len_seconds'],
+        "len": next_meta['len']
+    })
+    new_continued_name = f"{meta['unit_number']}_{meta['log_num']:05d}_cont{n_continuation:02d}"
+    archive_log(INPUT_FILES / next_file_name, meta['unit_output_folder'] / "in_logs_processed" / f"{new_continued_name}.log")
 
-        next_start_time = parser.parse(next_meta['log_start_time'])
 
-        if meta['log_end_time'] + timedelta(seconds=10) < next_start_time:
-            logger.warning("Gap between logs is large for unit %s", meta['unit_number'])
-        if meta['log_end_time'] > next_start_time:
-            logger.warning("Overlap between logs for unit %s", meta['unit_number'])
+def merge_continued_logs(initial_timestamps: np.ndarray, initial_frames: np.ndarray, initial_meta: dict, initial_continues: bool, file_name: str, global_dbc_files: list[tuple[Path, int]], continuation_files: list[str]) -> tuple:
+    """ Merge the continuation files into the log, the parts are collected and concatenated once at the end """
+    timestamp_parts = [initial_timestamps]
+    frame_parts = [initial_frames]
+    meta = initial_meta
+    continues = initial_continues
+    n_continuation = 0
+    # the chain plan only contains files of the same unit number and unit type
+    files_remaining = iter(continuation_files)
 
-        next_df['timestamp'] += meta['log_len_seconds']
-        df = pd.concat([df, next_df], ignore_index=True)
+    while continues:
+        n_continuation += 1
+        next_file = next(files_remaining, None)
+        if next_file is None:
+            logger.warning("Continuation Error: No file of the same unit to continue log %s", meta['uuid'])
+            break
+        logger.info("Merging continued log %s into %s", next_file, file_name)
 
-        meta['log_len_seconds'] += next_meta['log_len_seconds']
-        meta['len'] += next_meta['len']
-        meta['log_end_time'] = next_meta['log_end_time']
+        next_timestamps, next_frames, next_meta, continues = read_log_to_frames(INPUT_FILES / next_file)
 
-        update_log_file_status(meta['uuid'], "Combined With Later LOG")
+        next_meta['log_len_seconds'] = next_timestamps[-1] if len(next_frames) else 0.0
+        next_meta['len'] = len(next_frames)
 
-        meta.setdefault('file_continuations', []).append({
-            "file_name": files_remaining[0],
-            "log_start_time": next_meta['log_start_time'],
-            "log_end_time": next_meta['log_end_time'],
-            "log_len_seconds": next_meta['log_len_seconds'],
-            "len": next_meta['len']
-        })
-        new_continued_name = f"{meta['unit_number']}_{meta['log_num']:05d}_cont{n_continuation:02d}"
-        archive_log(INPUT_FILES / files_remaining[0], meta['unit_output_folder'] / "in_logs_processed" / f"{new_continued_name}.log")
+        timestamp_parts.append(next_timestamps + meta['log_len_seconds'])
+        frame_parts.append(next_frames)
 
-    return df, meta
+        add_continuation_to_meta(meta, next_meta, next_file, n_continuation)
 
+    if len(frame_parts) == 1:
+        return initial_timestamps, initial_frames, meta
+    return np.concatenate(timestamp_parts), np.concatenate(frame_parts), meta
 
-def save_mf4_files(df:pd.DataFrame, meta:dict, global_dbc_files: list[Path]) -> None:
-    mf4 = df_to_mf4(df)
-    raw_path = meta['unit_output_folder'] / f"raw_logs/raw-{meta['file_stem']}.mf4"
-    mf4.save(raw_path)
 
+def merge_continued_logs_streaming(raw_mf4: MDF, meta: dict, file_name: str, continuation_files: list[str], id_stats: CanIdStatsAccumulator = None) -> tuple[MDF, dict]:
+    """ Streaming version of merge_continued_logs, continuation files are appended chunk by chunk to raw_mf4 and added to id_stats """
+    continues = True
+    n_continuation = 0
+    files_remaining = iter(continuation_files)
+
+    while continues:
+        n_continuation += 1
+        next_file = next(files_remaining, None)
+        if next_file is None:
+            logger.warning("Continuation Error: No file of the same unit to continue log %s", meta['uuid'])
+            return raw_mf4, meta
+        logger.info("Merging continued log %s into %s", next_file, file_name)
+
+        raw_mf4, next_meta, continues, summary = stream_log_to_mf4(INPUT_FILES / next_file, raw_mf4, time_offset=meta['log_len_seconds'], id_stats=id_stats)
+        next_meta['log_len_seconds'] = summary['log_len_seconds']
+        next_meta['len'] = summary['len']
+
+        add_continuation_to_meta(meta, next_meta, next_file, n_continuation)
+
+    return raw_mf4, meta
+
+
+def stream_log_to_mf4(log_path: Path, raw_mf4: MDF = None, time_offset: float = 0.0, id_stats: CanIdStatsAccumulator = None) -> tuple[MDF, dict, bool, dict]:
+    """ Parse a log in chunks of STREAMING_CHUNK_BYTES and append each chunk to a raw MF4, timestamps are shifted by time_offset.
+        Each chunk is added to id_stats when given, so the CAN ID statistics never read the raw MF4 back.
+        Returns (raw_mf4, meta, continues, summary), summary holds the len and log_len_seconds of the log
+        exactly as the in memory path computes them. """
+    if raw_mf4 is None:
+        raw_mf4 = MDF(version='4.11')
+    meta, chunks = read_log_chunks(log_path, STREAMING_CHUNK_BYTES)
+    summary = {"len": 0, "log_len_seconds": 0.0}
+    continues = False
+
+    for timestamps, frames, continues in chunks:
+        if len(frames) == 0:
+            continue
+        summary['len'] += len(frames)
+        summary['log_len_seconds'] = timestamps[-1]
+        timestamps = timestamps + time_offset
+        if id_stats is not None:
+            id_stats.add(*frame_fields(timestamps, frames))
+        append_frames_to_mf4(raw_mf4, timestamps, frames)
+
+    return raw_mf4, meta, continues, summary
+
+
+def get_all_dbc_files(meta: dict, global_dbc_files: list[tuple[Path, int]]) -> list[tuple[Path, int]]:
+    """ The unit type's DBC files followed by the global DBC files, as (dbc file, bus) pairs for any bus """
     try:
         unit_dbc_files = list(get_dbc_file_list(DBC_FOLDER / meta['unit_type']))
     except FileNotFoundError:
         logger.warning("No DBC files found for unit type: %s", meta['unit_type'])
         unit_dbc_files = []
-
-    all_dbc_files = [(f, 0) for f in unit_dbc_files + [f for f, _ in global_dbc_files]]
-    mf4_extract = mf4.extract_bus_logging({"CAN": all_dbc_files})
-    mf4_extract.save(meta['unit_output_folder'] / f"{meta['file_stem']}.mf4")
-
-
-def process_log_file(file_name: str, global_dbc_files: list[tuple[Path, int]]) -> None:
+    return [(f, 0) for f in unit_dbc_files + [f for f, _ in global_dbc_files]]
+
+
+def decode_mf4(mf4: MDF, databases: list[tuple]) -> MDF:
+    if DECODE_ENGINE == "numpy" and all(can_database_supported(database) for database, _ in databases):
+        return decode_can_frames(mf4, databases)
+    if DECODE_ENGINE == "numpy":
+        logger.debug("\tJ1939 or ISO-TP messages in the DBC files, decoding with asammdf")
+    return mf4.extract_bus_logging({"CAN": databases})
+
+
+def save_decoded_mf4(mf4: MDF, meta: dict, global_dbc_files: list[Path], timer: StageTimer = None) -> list[dict]:
+    timer = timer or StageTimer()
+    with timer.stage("decode", frames=meta.get('len', 0)):
+        databases = DBC_CACHE.get_databases(get_all_dbc_files(meta, global_dbc_files))
+        mf4_extract = decode_mf4(mf4, databases)
+    return save_decoded_outputs(mf4_extract, meta, timer)
+
+
+def save_decoded_outputs(mf4_extract: MDF, meta: dict, timer: StageTimer = None) -> list[dict]:
+    """ Save the decoded MF4 with its time index and the exports and previews built from it, returns the signal spans """
+    timer = timer or StageTimer()
+    decoded_path = meta['unit_output_folder'] / f"{meta['file_stem']}.mf4"
+    with timer.stage("decoded_write"):
+        # a reprocessed log replaces its files, asammdf would otherwise save next to them
+        mf4_extract.save(decoded_path, compression=DECODED_COMPRESSION, overwrite=True)
+    timer.add("decoded_write", bytes_out=decoded_path.stat().st_size)
+    with timer.stage("decoded_outputs"):
+        save_time_index(mf4_extract, time_index_path(meta['unit_output_folder'], meta['file_stem']))
+        # exported from the decoded signals in memory, the saved MF4 is not read again
+        if SIGNAL_EXPORT_FORMAT:
+            export_decoded_signals(mf4_extract, meta, SIGNAL_EXPORT_FOLDER, SIGNAL_EXPORT_FORMAT)
+        if PREVIEW_BUCKET_SECONDS:
+            save_signal_preview(mf4_extract, preview_path(meta['unit_output_folder'], meta['file_stem']), PREVIEW_BUCKET_SECONDS)
+        return signal_spans(mf4_extract)
+
+
+def decode_raw_mf4(raw_path: Path, output_path: Path, unit_type: str) -> None:
+    """ Decode a saved raw MF4 with the current unit type and global DBC files, for decoding logs on demand """
+    global_dbc_files = [(f, 0) for f in get_dbc_file_list(DBC_FOLDER)]
+    databases = DBC_CACHE.get_databases(get_all_dbc_files({"unit_type": unit_type}, global_dbc_files))
+    with MDF(raw_path) as mf4:
+        decode_mf4(mf4, databases).save(output_path, compression=DECODED_COMPRESSION, overwrite=True)
+
+
+def save_decoded_mf4_parallel(raw_path: Path, meta: dict, global_dbc_files: list[Path], workers: int, timer: StageTimer = None) -> list[dict]:
+    """ Decode every (DBC file, bus) pair of a saved raw MF4 in its own worker process and stack the parts.
+        The parts are stacked in DBC file and bus order, the order one extract_bus_logging call writes the
+        channel groups in, so the decoded file has the same channel groups and names as a serial decode.
+        Bus 0 in a (DBC file, bus) pair matches the frames of every bus, so a log with frames on bus 0 is decoded in
+        one part per DBC file for all buses, the parts must not overlap. """
+    timer = timer or StageTimer()
+    all_dbc_files = get_all_dbc_files(meta, global_dbc_files)
+    with MDF(raw_path) as mf4:
+        start_time = mf4.header.start_time
+        buses = np.unique(mf4.get("CAN_DataFrame.BusChannel").samples).tolist() if "CAN_DataFrame" in mf4.channels_db else []
+    part_buses = [0] if 0 in buses else buses
+    parts = [(dbc_file, bus) for dbc_file, _ in all_dbc_files for bus in part_buses]
+    if len(parts) <= 1:
+        with MDF(raw_path) as mf4:
+            return save_decoded_mf4(mf4, meta, global_dbc_files, timer)
+
+    logger.debug(f"\tDecoding {len(all_dbc_files)} DBC files in {len(parts)} parts with {workers} processes")
+    with tempfile.TemporaryDirectory(dir=meta['unit_output_folder']) as parts_folder:
+        part_paths = [Path(parts_folder) / f"part{i}.mf4" for i in range(len(parts))]
+        with timer.stage("decode", frames=meta.get('len', 0)), ProcessPoolExecutor(max_workers=min(workers, len(parts))) as pool:
+            list(pool.map(_decode_part, repeat(raw_path), *zip(*parts), part_paths))
+        part_mf4s = [MDF(part_path) for part_path in part_paths]
+        try:
+            return save_decoded_outputs(stack_decoded_mf4(part_mf4s, start_time), meta, timer)
+        finally:
+            for part_mf4 in part_mf4s:
+                part_mf4.close()
+
+
+def _decode_part(raw_path: Path, dbc_file: Path, bus: int, part_path: Path) -> None:
+    with MDF(raw_path) as mf4:
+        decode_mf4(mf4, DBC_CACHE.get_databases([(dbc_file, bus)])).save(part_path, overwrite=True)
+
+
+def save_mf4_files(raw_mf4: MDF, meta: dict, global_dbc_files: list[Path], timer: StageTimer = None) -> list[dict]:
+    """ Save the raw MF4 and decode it, returns the signal spans of the decoded MF4, none when decoding on demand.
+        The stages are timed with timer when given. """
+    timer = timer or StageTimer()
+    raw_path = meta['unit_output_folder'] / f"raw_logs/raw-{meta['file_stem']}.mf4"
+    with timer.stage("raw_write", frames=meta.get('len', 0)):
+        # decoding reads the raw MF4 back from raw_path, a stale file of an earlier processing must not stay there
+        raw_mf4.save(raw_path, compression=RAW_COMPRESSION, overwrite=True)
+        raw_mf4.close()
+    timer.add("raw_write", bytes_out=raw_path.stat().st_size)
+    if DECODE_ON_DEMAND:
+        # the webserver decodes the log when it is first downloaded
+        return []
+    if DECODE_WORKERS > 1:
+        return save_decoded_mf4_parallel(raw_path, meta, global_dbc_files, DECODE_WORKERS, timer)
+    # decode from the saved file, asammdf reads and extracts it fragment by fragment
+    with MDF(raw_path) as mf4:
+        return save_decoded_mf4(mf4, meta, global_dbc_files, timer)
+
+
+def process_log_file(file_name: str, global_dbc_files: list[tuple[Path, int]], continuation_files: list[str] = None) -> None:
+    """ Process one input log, continuation_files is the rest of its chain as planned by process_new_files.
+        When not given the chain of this log alone is planned from the waiting input files. """
     logger.info("Starting processing for file: %s", file_name)
+    timer = StageTimer()
     log_path = INPUT_FILES / file_name
-
-    # Read the dataframe and metadata from the log file
-    df, meta, continues = read_log_to_df(log_path) 
-    df_hash = hashlib.sha256(pd.util.hash_pandas_object(df).values).digest()
-    
-    # check if vehicle type is the same as database, if not move old vehicle files to new folder
-    vehicle = get_vehicle_by_unit_number(unit_number=meta['unit_number'])
-    if meta['unit_type'] != vehicle.vehicle_type:
-        logger.warning(f"Vehicle type mismatch for unit {meta['unit_number']}: {vehicle.vehicle_type} != {meta['unit_type']}, Moving files to new vehicle folder")
-        move_vehicle_files(old_vehicle_type=vehicle.vehicle_type, 
-                            new_vehicle_type=meta['unit_type'], 
-                            unit_number=meta['unit_number'])
-        update_vehicle(unit_number=meta['unit_number'], vehicle_type=meta['unit_type'])
+    log_size = log_path.stat().st_size
+    streaming = STREAMING_FILE_SIZE > 0 and log_size >= STREAMING_FILE_SIZE
+
+    # Only the header and a hash of the raw bytes are needed to find a re-uploaded log, it is not parsed
+    with timer.stage("hash", bytes_in=log_size):
+        meta = read_log_meta(log_path)
+        log_hash = log_content_hash(log_path)
+
+    # The database is used in a few units of work: the lookups before parsing, creating the log together with
+    # archiving its input file, and storing the results followed by the stage timings. No transaction is open
+    # while the log is parsed or decoded.
+    with timer.stage("db_lookup"), db_session() as session:
+        # check if vehicle type is the same as database, if not move old vehicle files to new folder
+        vehicle = get_vehicle_by_unit_number(unit_number=meta['unit_number'], session=session)
+        if vehicle and meta['unit_type'] != vehicle.vehicle_type:
+            logger.warning(f"Vehicle type mismatch for unit {meta['unit_number']}: {vehicle.vehicle_type} != {meta['unit_type']}, Moving files to new vehicle folder")
+            move_vehicle_files(old_vehicle_type=vehicle.vehicle_type, 
+                                new_vehicle_type=meta['unit_type'], 
+                                unit_number=meta['unit_number'])
+            update_vehicle(unit_number=meta['unit_number'], vehicle_type=meta['unit_type'], session=session)
+        # Check if the log file has already been processed
+        log_db_entry = get_log_with_hash(log_hash, meta['unit_number'], session=session)
+        legacy_candidates = []
+        if log_db_entry is None and 'log_start_time' in meta:
+            legacy_candidates = get_logs_with_start_time(meta['unit_number'], meta['log_start_time'], session=session)
+    if legacy_candidates:
+        with timer.stage("hash"):
+            log_db_entry = find_legacy_duplicate(log_path, legacy_candidates, log_hash)
 
     # Create the folder structure for the file
     meta['unit_output_folder'] = OUTPUT_FILES / meta['unit_type'] / meta['unit_number']
     create_unit_folders(meta['unit_output_folder'])
     meta['file_name'] = file_name
-    meta['len'] = len(df)
 
-    # Check if the log file has already been processed
-    if does_log_exist(df_hash, meta['unit_number']):
+    if log_db_entry is not None:
         logger.warning("Log for %s already exists, skipping file %s", meta['unit_number'], file_name)
         # move the log file to archive with duplicate tag
-        log_db_entry = get_log_with_hash(df_hash, meta['unit_number'])
         archive_log(log_path, meta['unit_output_folder'] / "in_logs_processed" / f"{log_db_entry.file_stem}_duplicate.log")
         return {"status": "duplicate", "file": file_name}
-    
-    # Use provided uuid if present, otherwise None
-    provided_uuid = meta.get('uuid', None)
-    # check if log exists (if it was uploaded by web app it will exist, if not create it)
-    log = get_log_file(provided_uuid) if provided_uuid else None
-    if not log:
-        log = create_log_in_database(
-            meta['log_start_time'], 
-            meta['unit_number'], 
-            df_hash,
-            meta['unit_type'], 
-            file_name,
-            provided_uuid=provided_uuid
-        )
-
-    meta.update({"uuid": log.id, "log_num": log.log_number, "file_stem": log.file_stem})
 
-    archived_path = meta['unit_output_folder'] / "in_logs_processed" / f"{meta['file_stem']}.log"
-    archive_log(log_path, archived_path)
+    # Read the frames from the log file, large logs go straight into a raw MF4 chunk by chunk
+    with timer.stage("parse", bytes_in=log_size):
+        if streaming:
+            logger.info("Streaming large log file %s", file_name)
+            id_stats = CanIdStatsAccumulator()
+            raw_mf4, _, continues, summary = stream_log_to_mf4(log_path, id_stats=id_stats)
+        else:
+            timestamps, frames, _, continues = read_log_to_frames(log_path)
+            summary = {"len": len(frames), "log_len_seconds": timestamps[-1] if len(frames) else 0.0}
+    timer.add("parse", frames=summary['len'])
+    meta['len'] = summary['len']
+    # plan while the file is still waiting in the input folder, it is archived before the merge
+    if continues and continuation_files is None:
+        continuation_files = planned_continuations(file_name)
 
-    update_log_file_status(meta['uuid'], "LOG file Moved")
+    # Use provided uuid if present, otherwise None
+    provided_uuid = meta.get('uuid', None)
+    # the log is only committed once its input file is archived, a failed move leaves no log behind
+    with db_session() as session:
+        # check if log exists (if it was uploaded by web app it will exist, if not create it)
+        with timer.stage("db_lookup"):
+            log = get_log_file(provided_uuid, session=session) if provided_uuid else None
+            if log:
+                update_log_file_hash(log.id, log_hash, session=session)
+            else:
+                log = create_log_in_database(
+                    meta['log_start_time'], 
+                    meta['unit_number'], 
+                    log_hash,
+                    meta['unit_type'], 
+                    file_name,
+                    provided_uuid=provided_uuid,
+                    session=session
+                )
+
+        meta.update({"uuid": log.id, "log_num": log.log_number, "file_stem": log.file_stem})
+
+        archived_path = meta['unit_output_folder'] / "in_logs_processed" / f"{meta['file_stem']}.log"
+        with timer.stage("archive"):
+            archive_log(log_path, archived_path)
+
+        update_log_file_status(meta['uuid'], "LOG file Moved", session=session)
 
     # If there is no data in the log file, we can finalize it immediately
     if meta['len'] == 0 and not continues:
+        if streaming:
+            raw_mf4.close()
         meta['log_end_time'] = meta['log_start_time']
-        update_log_file_len(log.id, 0, 0)
-        update_log_end_time(log.id, meta['log_end_time'])
-        update_log_file_status(log.id, "Zero Data")
+        with db_session() as session:
+            update_log_file_len(log.id, 0, 0, session=session)
+            update_log_end_time(log.id, meta['log_end_time'], session=session)
+            update_log_file_status(log.id, "Zero Data", session=session)
+            replace_log_stage_timings(log.id, timer.results(0), session=session)
         return {"status": "zero_data", "file": file_name}
 
     # Finalize metadata: log length and end time
-    log_len_seconds = df.iloc[-1, 0]
+    log_len_seconds = summary['log_len_seconds']
     meta['log_len_seconds'] = log_len_seconds
     start_time = parser.parse(meta['log_start_time'])
     meta['log_end_time'] = start_time + timedelta(seconds=log_len_seconds)
 
     if continues:
-        df, meta = merge_continued_logs(df, meta, continues, file_name, global_dbc_files)
+        # the continuation files are archived by the merge, their sizes are taken before
+        continuation_size = sum((INPUT_FILES / f).stat().st_size for f in continuation_files if (INPUT_FILES / f).exists())
+        len_before = meta['len']
+        with timer.stage("parse", bytes_in=continuation_size):
+            if streaming:
+                raw_mf4, meta = merge_continued_logs_streaming(raw_mf4, meta, file_name, continuation_files, id_stats)
+            else:
+                timestamps, frames, meta = merge_continued_logs(timestamps, frames, meta, continues, file_name, global_dbc_files, continuation_files)
+        timer.add("parse", frames=meta['len'] - len_before)
+
+    with timer.stage("can_id_stats", frames=meta['len']):
+        # per CAN ID statistics so questions like "was this ID on the bus" never need the MF4, streamed logs
+        # collected them chunk by chunk while parsing
+        if streaming:
+            stats = id_stats.results(meta['log_len_seconds'], bus_baudrates(meta))
+        else:
+            stats = can_id_stats(*frame_fields(timestamps, frames), meta['log_len_seconds'], bus_baudrates(meta))
+    if not streaming:
+        # building the raw MF4 is part of writing it, save_mf4_files adds the save to the same stage
+        with timer.stage("raw_write"):
+            raw_mf4 = frames_to_mf4(timestamps, frames)
+    spans = save_mf4_files(raw_mf4, meta, global_dbc_files, timer)
+
+    # the results of the log are stored in one transaction, the log is only complete with all of them
+    with timer.stage("db_write"), db_session() as session:
+        update_log_end_time(log.id, meta['log_end_time'], session=session) # update database record for end time and file len
+        update_log_file_len(log.id, meta['log_len_seconds'], meta['len'], session=session)
+        replace_can_id_stats(log.id, stats, session=session)
+        # fleet-wide index of the decoded signals for searching logs without opening them
+        replace_log_signals(log.id, spans, session=session)
+        update_log_file_status(log.id, "Processing Complete", session=session)
+    logger.debug(f"\tStored statistics of {len(stats)} CAN IDs and {len(spans)} signals")
+    timings = timer.results(meta['len'])
+    replace_log_stage_timings(log.id, timings)
+    logger.debug("\tStage seconds: " + ", ".join(f"{row['stage']} {row['seconds']:.3f}" for row in timings))
+
+    return {"status": "processed", "uuid": log.id, "input_file_name": file_name, "log_len": meta['len'], "output_file_name": meta['file_stem'], "multi_input_files": continues}
+
+
+def process_chains(chains: list[list[str]], global_dbc_files: list[tuple[Path, int]]) -> list[dict]:
+    """ Process planned chains in order, the first file of a chain is converted and the rest is merged into it """
+    results = []
+    for chain in chains:
+        result = process_log_file(chain[0], global_dbc_files, chain[1:])
+        logger.info("Processed file %s: status:%s", result.get('input_file_name', ''), result.get('status', ''))
+        results.append(result)
+    return results
 
-    update_log_end_time(log.id, meta['log_end_time']) # update database record for end time and file len
-    update_log_file_len(log.id, meta['log_len_seconds'], len(df))
-    save_mf4_files(df, meta, global_dbc_files)
-    update_log_file_status(log.id, "Processing Complete")
 
-    return {"status": "processed", "uuid": log.id, "input_file_name": file_name, "log_len": len(df), "output_file_name": meta['file_stem'], "multi_input_files": continues}
+def init_worker(parse_workers: int) -> None:
+    """ Forked workers must open their own database connections instead of sharing the parent's pool, and parse large
+        logs on at most parse_workers processes so the pool does not oversubscribe the CPUs """
+    ENGINE.dispose(close=False)
+    helpers.PARALLEL_PARSE_WORKERS = min(helpers.PARALLEL_PARSE_WORKERS, parse_workers)
 
 
-def process_new_files() -> int:
+def process_new_files(workers: int = None) -> int:
     logger.debug("Looking for new CAN Log files to process")
     files_to_process = get_files_to_process(INPUT_FILES)
     logger.debug("Found files: %s", files_to_process)
 
     global_dbc_files = [(f, 0) for f in get_dbc_file_list(DBC_FOLDER)]
     processed_count = 0
+    workers = PROCESSING_WORKERS if workers is None else workers
+    # with one worker everything runs in this process, otherwise each unit is one task for the pool
+    parse_workers = max((os.cpu_count() or 1) // max(workers, 1), 1)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(parse_workers,)) if workers > 1 else None
 
-    while True:
-        files_to_process = get_files_to_process(INPUT_FILES)
-        if not files_to_process:
-            logger.debug("No more files to process")
-            break
-        result = process_log_file(files_to_process[0], global_dbc_files)
-        logger.info("Processed file %s: status:%s", result.get('input_file_name', ''), result.get('status', ''))
-        if result.get('status') == "processed":
-            processed_count += 1
+    try:
+        while True:
+            files_to_process = get_files_to_process(INPUT_FILES)
+            if not files_to_process:
+                logger.debug("No more files to process")
+                break
+            units = plan_chains(files_to_process)
+            logger.info("Planned %d files of %d units", len(files_to_process), len(units))
+            if pool is None:
+                chains = sorted((chain for unit_chains in units.values() for chain in unit_chains), key=lambda chain: chain[0])
+                results = process_chains(chains, global_dbc_files)
+            else:
+                tasks = [pool.submit(process_chains, chains, global_dbc_files) for chains in units.values()]
+                results = [result for task in as_completed(tasks) for result in task.result()]
+            processed_count += sum(result.get('status') == "processed" for result in results)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
     logger.info("*EXPORT COMPLETE*")
     return processed_count
@@ -215,10 +551,14 @@ def process_new_files() -> int:
 
 if __name__ == "__main__":
     setup_environment()
+    # created before the first scan so uploads that land while processing wake up the next wait right away
+    watcher = InputWatcher(INPUT_FILES, SLEEP_TIME_BETWEEN_PROCESSINGS, WATCH_DEBOUNCE_SECONDS, use_inotify=WATCH_INPUT_FOLDER)
     try:
         while True:
             logger.info("Processing new files")
             process_new_files()
-            time.sleep(SLEEP_TIME_BETWEEN_PROCESSINGS)
+            watcher.wait()
     except KeyboardInterrupt:
         logger.info("Shutting down gracefully.")
+    finally:
+        watcher.close()
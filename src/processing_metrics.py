@@ -0,0 +1,89 @@
+import time
+from contextlib import contextmanager
+
+# stages of process_log_file in processing order, "total" is the whole file from the first read to the last database write
+STAGES = ["hash", "db_lookup", "archive", "parse", "can_id_stats", "raw_write", "decode", "decoded_write", "decoded_outputs", "db_write"]
+TOTAL_STAGE = "total"
+# upper bounds of the histogram buckets of the stage latency in seconds and of the log throughput in frames/s
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+FRAMES_PER_SECOND_BUCKETS = [1e4, 2.5e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7]
+METRIC_PREFIX = "caninsight"
+
+
+class StageTimer:
+    """ Wall time, frames and bytes of the stages of processing one log, a stage run again adds to its totals """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str, **sizes):
+        """ Time the block as stage name, sizes are frames, bytes_in or bytes_out known before it runs """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, seconds=time.perf_counter() - start, **sizes)
+
+    def add(self, name: str, **values):
+        """ Add seconds, frames, bytes_in or bytes_out to a stage """
+        record = self.stages.setdefault(name, {"seconds": 0.0, "frames": None, "bytes_in": None, "bytes_out": None})
+        for key, value in values.items():
+            record[key] = (record[key] or 0) + value
+
+    def results(self, frames: int) -> list[dict]:
+        """ Rows of the log_stage_timing table for the stages so far and the total of frames frames, the total reads
+            the bytes of the parsed input files and writes the bytes of all stages """
+        total = {"seconds": time.perf_counter() - self.start, "frames": frames,
+                 "bytes_in": self.stages.get("parse", {}).get("bytes_in"), "bytes_out": None}
+        for record in self.stages.values():
+            if record["bytes_out"] is not None:
+                total["bytes_out"] = (total["bytes_out"] or 0) + record["bytes_out"]
+        rows = []
+        for name, record in [*self.stages.items(), (TOTAL_STAGE, total)]:
+            frames_per_second = record["frames"] / record["seconds"] if record["frames"] and record["seconds"] > 0 else None
+            rows.append({"stage": name, **record, "frames_per_second": frames_per_second})
+        return rows
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def _histogram(lines: list[str], name: str, buckets: list[float], counts: list[int], count: int, total: float, **labels):
+    """ Append the bucket, sum and count samples of a Prometheus histogram, counts are cumulative per bucket """
+    for bound, bucket_count in zip(buckets, counts):
+        lines.append(f"{name}_bucket{_labels(**labels, le=f'{bound:g}')} {bucket_count}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {count}")
+    lines.append(f"{name}_sum{_labels(**labels) if labels else ''} {total or 0:g}")
+    lines.append(f"{name}_count{_labels(**labels) if labels else ''} {count}")
+
+
+def prometheus_metrics(queue_depth: dict[str, int], log_status_counts: dict[str, int], stage_summaries: list[dict]) -> str:
+    """ Prometheus text exposition of the input queue, the logs per status and the stored stage timings.
+        stage_summaries are rows of get_stage_timing_summary, histograms hold one sample per processed log. """
+    p = METRIC_PREFIX
+    lines = [f"# HELP {p}_queue_files Log files waiting in an input folder", f"# TYPE {p}_queue_files gauge"]
+    lines += [f"{p}_queue_files{_labels(folder=folder)} {count}" for folder, count in queue_depth.items()]
+    lines += [f"# HELP {p}_logs Logs in the database per processing status", f"# TYPE {p}_logs gauge"]
+    lines += [f"{p}_logs{_labels(status=status)} {count}" for status, count in log_status_counts.items()]
+
+    total = next((s for s in stage_summaries if s["stage"] == TOTAL_STAGE), None)
+    if total:
+        lines += [f"# HELP {p}_processed_logs_total Logs processed with timings", f"# TYPE {p}_processed_logs_total counter",
+                  f"{p}_processed_logs_total {total['count']}",
+                  f"# HELP {p}_processed_frames_total CAN frames of the processed logs", f"# TYPE {p}_processed_frames_total counter",
+                  f"{p}_processed_frames_total {total['frames'] or 0}",
+                  f"# HELP {p}_processed_bytes_total Bytes of input logs read and of MF4 files written", f"# TYPE {p}_processed_bytes_total counter",
+                  f"{p}_processed_bytes_total{_labels(direction='in')} {total['bytes_in'] or 0}",
+                  f"{p}_processed_bytes_total{_labels(direction='out')} {total['bytes_out'] or 0}",
+                  f"# HELP {p}_log_frames_per_second Frames per second of whole logs", f"# TYPE {p}_log_frames_per_second histogram"]
+        _histogram(lines, f"{p}_log_frames_per_second", FRAMES_PER_SECOND_BUCKETS, total["frames_per_second_buckets"],
+                   total["frames_per_second_count"], total["frames_per_second_sum"])
+
+    lines += [f"# HELP {p}_stage_seconds Seconds per processing stage of a log", f"# TYPE {p}_stage_seconds histogram"]
+    for summary in stage_summaries:
+        _histogram(lines, f"{p}_stage_seconds", SECONDS_BUCKETS, summary["seconds_buckets"], summary["count"], summary["seconds"],
+                   stage=summary["stage"])
+    return "\n".join(lines) + "\n"
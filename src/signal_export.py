@@ -0,0 +1,109 @@
+import os
+from datetime import timezone
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from asammdf import MDF
+from dateutil import parser
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # only needed when SIGNAL_EXPORT_FORMAT is set
+    pa = None
+
+from log_converter_logger import logger
+
+EXPORT_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def signal_export_schema(mf4: MDF) -> "pa.Schema":
+    """ Columns of the exported signals: the UTC timestamp and one column per signal of the decoded MF4 named like
+        CAN1.Message.Signal, typed from the first record of every channel group so no group is read in full """
+    fields = {}
+    for index, group in enumerate(mf4.groups):
+        for signal in mf4.select([(None, index, channel) for channel in range(1, len(group.channels))], record_count=1):
+            fields.setdefault(signal_name(signal), _arrow_values(signal.samples).type)
+    return pa.schema([("timestamp", pa.timestamp("us", tz="UTC")), *fields.items()])
+
+
+def decoded_signal_batches(mf4: MDF, log_start_time: str, schema: "pa.Schema" = None) -> Iterator["pa.RecordBatch"]:
+    """ The physical signal values of a decoded MF4 as one record batch per channel group, read one group at a time.
+        Every row is one decoded message in time order within its group. Batches have all columns of schema
+        (signal_export_schema by default), the signals of other messages are null. """
+    schema = schema or signal_export_schema(mf4)
+    start = parser.parse(log_start_time)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    start_us = int(start.timestamp() * 1e6)
+
+    for index, group in enumerate(mf4.groups):
+        signals = mf4.select([(None, index, channel) for channel in range(1, len(group.channels))])
+        if not signals or len(signals[0].timestamps) == 0:
+            continue
+        rows = len(signals[0].timestamps)
+        columns = {"timestamp": pa.array((signals[0].timestamps * 1e6).round().astype(np.int64) + start_us, type=schema.field("timestamp").type)}
+        for signal in signals:
+            name = signal_name(signal)
+            columns[name] = _arrow_values(signal.samples).cast(schema.field(name).type)
+        yield pa.record_batch([columns.get(field.name, pa.nulls(rows, field.type)) for field in schema], schema=schema)
+
+
+def signal_name(signal) -> str:
+    """ The CAN<bus>.<message>.<signal> display name, signals read back from a file list it as the first display name """
+    names = [name for name, kind in signal.display_names.items() if kind in ("bus", "display")]
+    return next((name for name, kind in signal.display_names.items() if kind == "bus"), names[0] if names else signal.name)
+
+
+def _arrow_file_writer(path: Path, schema: "pa.Schema") -> "pa.ipc.RecordBatchFileWriter":
+    """ Arrow IPC file writer, lz4 compressed like feather files when pyarrow has lz4 """
+    options = pa.ipc.IpcWriteOptions(compression="lz4" if pa.Codec.is_available("lz4") else None)
+    return pa.ipc.new_file(str(path), schema, options=options)
+
+
+def _arrow_values(samples: np.ndarray) -> "pa.Array":
+    """ Arrow array of physical values, value to text conversions give strings """
+    if samples.dtype.kind in "biuf":
+        return pa.array(samples)
+    return pa.array([v.decode(errors="replace") if isinstance(v, bytes) else v for v in samples], type=pa.string())
+
+
+def export_decoded_signals(mf4: MDF, meta: dict, folder: Path, export_format: str) -> list[Path]:
+    """ Write the decoded signals of a log to folder partitioned by unit_type, unit_number and UTC date
+        (unit_type=<type>/unit_number=<number>/date=<YYYY-MM-DD>/<file_stem>.parquet), a log that crosses
+        midnight is split over two dates. The channel groups are written one at a time, each as its own parquet row
+        group or arrow record batch, so memory stays bounded by one group. Returns the written files. """
+    if pa is None:
+        raise RuntimeError("pyarrow is needed to export decoded signals")
+    schema = signal_export_schema(mf4)
+    unit_folder = folder / f"unit_type={meta['unit_type']}" / f"unit_number={meta['unit_number']}"
+
+    writers = {} # date -> (path, temporary path, writer)
+    rows = 0
+    try:
+        for batch in decoded_signal_batches(mf4, meta['log_start_time'], schema):
+            days = batch.column(0).to_numpy().astype("datetime64[D]")
+            bounds = np.concatenate([[0], np.flatnonzero(days[1:] != days[:-1]) + 1, [len(days)]])
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if days[start] not in writers:
+                    path = unit_folder / f"date={days[start]}" / f"{meta['file_stem']}{EXPORT_SUFFIXES[export_format]}"
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    # write to a temporary name so analytics jobs never read a partial file
+                    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                    writer = pq.ParquetWriter(str(tmp_path), schema) if export_format == "parquet" else _arrow_file_writer(tmp_path, schema)
+                    writers[days[start]] = (path, tmp_path, writer)
+                writers[days[start]][2].write_batch(batch.slice(start, end - start))
+            rows += batch.num_rows
+        for path, tmp_path, writer in writers.values():
+            writer.close()
+            os.replace(tmp_path, path)
+    finally:
+        for path, tmp_path, writer in writers.values():
+            if tmp_path.exists():
+                writer.close()
+                tmp_path.unlink()
+
+    paths = [path for _, (path, _, _) in sorted(writers.items())]
+    logger.debug(f"\tExported {rows} decoded messages with {len(schema) - 1} signals to {len(paths)} {export_format} files")
+    return paths
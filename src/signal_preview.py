@@ -0,0 +1,93 @@
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+from asammdf import MDF
+
+from log_converter_logger import logger
+from signal_export import signal_name
+
+PREVIEW_FOLDER = "previews"
+
+
+def preview_path(unit_output_folder: Path, file_stem: str) -> Path:
+    return unit_output_folder / PREVIEW_FOLDER / f"{file_stem}.npz"
+
+
+def bucket_signal(timestamps: np.ndarray, samples: np.ndarray, bucket_seconds: float) -> np.ndarray:
+    """ Min, max and mean of the samples in every bucket_seconds long time bucket that has samples, as rows of
+        (bucket start, min, max, mean). The timestamps are sorted, NaN samples are left out. """
+    valid = ~np.isnan(samples)
+    timestamps, samples = timestamps[valid], samples[valid]
+    if len(samples) == 0:
+        return np.empty((0, 4))
+    buckets = np.floor(timestamps / bucket_seconds)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    counts = np.diff(np.concatenate([starts, [len(samples)]]))
+    return np.column_stack([
+        buckets[starts] * bucket_seconds,
+        np.minimum.reduceat(samples, starts),
+        np.maximum.reduceat(samples, starts),
+        np.add.reduceat(samples, starts) / counts])
+
+
+def build_signal_preview(mf4: MDF, bucket_seconds: list[float]) -> dict[str, np.ndarray]:
+    """ The preview pyramid of every numeric signal of a decoded MF4, one (bucket start, min, max, mean) array per
+        bucket size and signal keyed <bucket seconds>/<signal name> with signals named like CAN1.Message.Signal.
+        Bucket starts are seconds from the log start. """
+    preview = {}
+    for index, group in enumerate(mf4.groups):
+        for signal in mf4.select([(None, index, channel) for channel in range(1, len(group.channels))]):
+            if signal.samples.dtype.kind not in "biuf":
+                # value to text conversions give strings, they have no min or max
+                continue
+            samples = signal.samples.astype(np.float64)
+            for seconds in bucket_seconds:
+                preview[f"{seconds:g}/{signal_name(signal)}"] = bucket_signal(signal.timestamps, samples, seconds)
+    return preview
+
+
+def save_signal_preview(mf4: MDF, path: Path, bucket_seconds: list[float]) -> None:
+    """ Build the preview pyramid of a decoded MF4 and write it to path as a compressed npz file """
+    preview = build_signal_preview(mf4, bucket_seconds)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary name so the webserver never reads a partial file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **preview)
+    os.replace(tmp_path, path)
+    logger.debug(f"\tSaved preview of {len(preview) // max(len(bucket_seconds), 1)} signals at {len(bucket_seconds)} bucket sizes")
+
+
+def preview_signals(path: Path) -> dict[str, list[float]]:
+    """ The signal names of a preview file with their bucket sizes in seconds, only the zip directory is read """
+    with zipfile.ZipFile(path) as preview:
+        names = [name[:-len(".npy")] for name in preview.namelist()]
+    signals = {}
+    for name in names:
+        seconds, signal = name.split("/", 1)
+        signals.setdefault(signal, []).append(float(seconds))
+    return {signal: sorted(levels) for signal, levels in sorted(signals.items())}
+
+
+def read_signal_preview(path: Path, signal: str, start: float = None, end: float = None, max_points: int = 1000) -> dict:
+    """ The buckets of signal between start and end seconds from the log start, from the finest bucket size that
+        gives at most max_points buckets in the range, or the coarsest. Coarser bucket sizes are never read.
+        Returns None if the preview has no such signal. """
+    levels = preview_signals(path).get(signal)
+    if levels is None:
+        return None
+    with np.load(path) as preview:
+        for seconds in levels:
+            buckets = preview[f"{seconds:g}/{signal}"]
+            in_range = np.ones(len(buckets), dtype=bool)
+            if start is not None:
+                in_range &= buckets[:, 0] + seconds > start
+            if end is not None:
+                in_range &= buckets[:, 0] <= end
+            if np.count_nonzero(in_range) <= max_points:
+                break
+    buckets = buckets[in_range]
+    return {"signal": signal, "bucket_seconds": seconds, "time": buckets[:, 0].tolist(),
+            "min": buckets[:, 1].tolist(), "max": buckets[:, 2].tolist(), "mean": buckets[:, 3].tolist()}
@@ -0,0 +1,156 @@
+import io
+import json
+import math
+import os
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from asammdf import MDF
+
+try:
+    import pyarrow as pa
+except ImportError: # only needed for the arrow query format
+    pa = None
+
+from log_converter_logger import logger
+from signal_export import signal_name
+
+TIME_INDEX_FOLDER = "time_index"
+# records between two entries of the time index
+TIME_INDEX_STEP = 1024
+# records read from the MF4 at once when streaming a query or building the time index, a multiple of TIME_INDEX_STEP
+QUERY_CHUNK_RECORDS = 65536
+QUERY_FORMATS = {"json": "application/json"}
+if pa is not None:
+    QUERY_FORMATS["arrow"] = "application/vnd.apache.arrow.stream"
+
+
+def time_index_path(unit_output_folder: Path, file_stem: str) -> Path:
+    return unit_output_folder / TIME_INDEX_FOLDER / f"{file_stem}.npz"
+
+
+def build_time_index(mf4: MDF) -> dict[str, np.ndarray]:
+    """ The time index of a decoded MF4: the channel group and channel of every signal named like CAN1.Message.Signal
+        and, keyed time/<group>, the timestamp of every TIME_INDEX_STEP-th record of each channel group """
+    index = {"names": [], "groups": [], "channels": []}
+    for group_index, group in enumerate(mf4.groups):
+        # the names are in the channel metadata, only the timestamps are read, QUERY_CHUNK_RECORDS at a time
+        for channel in range(1, len(group.channels)):
+            index["names"].append(signal_name(group.channels[channel]))
+            index["groups"].append(group_index)
+            index["channels"].append(channel)
+        records = group.channel_group.cycles_nr
+        index[f"time/{group_index}"] = np.concatenate(
+            [mf4.get_master(group_index, record_offset=offset, record_count=QUERY_CHUNK_RECORDS)[::TIME_INDEX_STEP]
+             for offset in range(0, records, QUERY_CHUNK_RECORDS)] or [np.zeros(0)])
+    return {key: np.asarray(value) for key, value in index.items()}
+
+
+def signal_spans(mf4: MDF) -> list[dict]:
+    """ The name (CAN1.Message.Signal), bare signal name, sample count and first and last timestamp of every signal
+        of a decoded MF4, for the fleet-wide signal index. Only the channel metadata and the first and last timestamp
+        of each channel group are read. A message decoded by more than one DBC file gives one span per name over
+        all of its channel groups. """
+    spans = {}
+    for group_index, group in enumerate(mf4.groups):
+        records = group.channel_group.cycles_nr
+        if records == 0:
+            continue
+        first_time = float(mf4.get_master(group_index, record_count=1)[0])
+        last_time = float(mf4.get_master(group_index, record_offset=records - 1, record_count=1)[0])
+        for channel in group.channels[1:]:
+            name = signal_name(channel)
+            span = spans.get(name)
+            if span is None:
+                spans[name] = {"name": name, "signal": channel.name, "sample_count": records, "first_time": first_time, "last_time": last_time}
+            else:
+                span["sample_count"] += records
+                span["first_time"] = min(span["first_time"], first_time)
+                span["last_time"] = max(span["last_time"], last_time)
+    return list(spans.values())
+
+
+def save_time_index(mf4: MDF, path: Path) -> dict[str, np.ndarray]:
+    """ Build the time index of a decoded MF4, write it to path and return it """
+    index = build_time_index(mf4)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary name so the webserver never reads a partial file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **index)
+    os.replace(tmp_path, path)
+    logger.debug(f"\tSaved time index of {len(index['names'])} signals")
+    return index
+
+
+def load_time_index(path: Path) -> dict[str, np.ndarray]:
+    with np.load(path) as index:
+        return dict(index)
+
+
+def query_signals(mf4: MDF, index: dict[str, np.ndarray], names: list[str], t0: float = None, t1: float = None) -> Iterator[tuple[str, np.ndarray, np.ndarray]]:
+    """ The samples of the named signals between t0 and t1 seconds from the log start as (name, timestamps, values)
+        chunks of at most QUERY_CHUNK_RECORDS records. The time index limits the records read to the blocks of the
+        window. Signals with value to text conversions give their raw values. Raises KeyError for an unknown name
+        before anything is read. """
+    positions = {name: i for i, name in enumerate(index["names"].tolist())}
+    locations = [(name, int(index["groups"][positions[name]]), int(index["channels"][positions[name]])) for name in names]
+    return _query_chunks(mf4, index, locations, t0, t1)
+
+
+def _query_chunks(mf4: MDF, index: dict[str, np.ndarray], locations: list[tuple[str, int, int]], t0: float, t1: float):
+    for name, group, channel in locations:
+        times = index[f"time/{group}"]
+        records = mf4.groups[group].channel_group.cycles_nr
+        # the window starts in the step before the first index entry after t0 and ends before the first entry after t1
+        first = max(int(np.searchsorted(times, t0, side='right')) - 1, 0) * TIME_INDEX_STEP if t0 is not None else 0
+        end = min(int(np.searchsorted(times, t1, side='right')) * TIME_INDEX_STEP, records) if t1 is not None else records
+        for offset in range(first, end, QUERY_CHUNK_RECORDS):
+            signal = mf4.get(group=group, index=channel, record_offset=offset, record_count=min(QUERY_CHUNK_RECORDS, end - offset))
+            if signal.samples.dtype.kind not in "biuf":
+                signal = mf4.get(group=group, index=channel, raw=True, record_offset=offset, record_count=min(QUERY_CHUNK_RECORDS, end - offset))
+            in_window = np.ones(len(signal.timestamps), dtype=bool)
+            if t0 is not None:
+                in_window &= signal.timestamps >= t0
+            if t1 is not None:
+                in_window &= signal.timestamps <= t1
+            if np.any(in_window):
+                yield name, signal.timestamps[in_window], signal.samples[in_window]
+
+
+def json_stream(chunks: Iterator[tuple[str, np.ndarray, np.ndarray]], log_start_time: str) -> Iterator[bytes]:
+    """ The chunks as one JSON object {"log_start_time": ..., "signals": {name: [[time, value], ...]}} written
+        chunk by chunk, NaN values are null """
+    yield json.dumps({"log_start_time": log_start_time})[:-1].encode() + b', "signals": {'
+    current = None
+    for name, timestamps, values in chunks:
+        values = values.astype(np.float64)
+        pairs = json.dumps([[t, None if math.isnan(v) else v] for t, v in zip(timestamps.tolist(), values.tolist())])[1:-1]
+        if name != current:
+            yield (b"], " if current is not None else b"") + json.dumps(name).encode() + b": [" + pairs.encode()
+            current = name
+        else:
+            yield b", " + pairs.encode()
+    yield b"]}}" if current is not None else b"}}"
+
+
+def arrow_stream(chunks: Iterator[tuple[str, np.ndarray, np.ndarray]]) -> Iterator[bytes]:
+    """ The chunks as an Arrow IPC stream of (signal, time, value) record batches, one batch per chunk """
+    schema = pa.schema([("signal", pa.string()), ("time", pa.float64()), ("value", pa.float64())])
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, schema) as writer:
+        yield _drain(buffer)
+        for name, timestamps, values in chunks:
+            writer.write_batch(pa.record_batch([pa.array([name] * len(timestamps), pa.string()), pa.array(timestamps, pa.float64()),
+                                                pa.array(values.astype(np.float64), pa.float64())], schema=schema))
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    """ The bytes written to buffer since the last drain """
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
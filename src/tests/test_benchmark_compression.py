@@ -0,0 +1,20 @@
+from unittest import TestCase
+from pathlib import Path
+
+from benchmark_compression import benchmark_log, format_results
+
+
+class BenchmarkCompressionTestCase(TestCase):
+    """ Test the MF4 compression benchmark. """
+
+    def test_benchmark_log(self):
+        results = benchmark_log(Path("tests/test_data/test_data_all_good_lines.log"), [Path("tests/test_data/dbc/test_1.dbc")],
+                                ["none", "transposed_deflate"])
+        self.assertListEqual([(r["output"], r["compression"]) for r in results],
+                             [("raw", "none"), ("raw", "transposed_deflate"), ("decoded", "none"), ("decoded", "transposed_deflate")])
+        for result in results:
+            self.assertGreater(result["size_bytes"], 0)
+            self.assertGreaterEqual(result["write_seconds"], 0)
+            self.assertGreaterEqual(result["read_seconds"], 0)
+        self.assertEqual(results[0]["size_ratio"], 1.0)
+        self.assertEqual(len(format_results(results).splitlines()), 5)
@@ -0,0 +1,56 @@
+import shutil
+from unittest import TestCase
+from pathlib import Path
+
+import numpy as np
+from asammdf.blocks.utils import load_can_database
+
+from helpers import read_log_to_frames, read_log_to_df, log_continues
+from benchmark_pipeline import MESSAGES, STAGES, parse_count, synthetic_dbc, write_synthetic_logs, benchmark_size, format_results
+
+
+class BenchmarkPipelineTestCase(TestCase):
+    """ Test the synthetic logs and the pipeline benchmark. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/benchmark_test")
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_parse_count(self):
+        self.assertListEqual([parse_count(v) for v in ["2000", "500k", "1M", "1.5m"]], [2000, 500000, 1000000, 1500000])
+
+    def test_synthetic_logs(self):
+        for log_format in ["csv", "dat"]:
+            paths = write_synthetic_logs(self.folder / log_format, 3001, log_format, files=3, malformed_every=100)
+            self.assertListEqual([log_continues(path) for path in paths], [True, True, False])
+            parts = [read_log_to_frames(path) for path in paths]
+            # malformed lines are dropped, every generated frame is read
+            self.assertEqual(sum(len(frames) for _, frames, _, _ in parts), 3001)
+            self.assertEqual(parts[0][2]["unit_number"], "BENCHMARK")
+            self.assertEqual(parts[0][2]["log_type"], "DAT0.1" if log_format == "dat" else "CSV0.1")
+            timestamps, frames, _, _ = parts[0]
+            self.assertEqual(timestamps[0], 0)
+            self.assertTrue(np.all(np.diff(timestamps) >= 0))
+            ids = {(m[1], m[2]) for m in MESSAGES}
+            self.assertTrue({(int(i), int(e)) for i, e in zip(frames["CAN_DataFrame.ID"], frames["CAN_DataFrame.IDE"])} <= ids)
+            df, _, _ = read_log_to_df(paths[0])
+            self.assertEqual(len(df), len(frames))
+
+    def test_synthetic_dbc(self):
+        dbc = self.folder / "synthetic.dbc"
+        dbc.write_text(synthetic_dbc())
+        self.assertEqual(len(load_can_database(dbc).frames), len(MESSAGES))
+
+    def test_benchmark_size(self):
+        results = benchmark_size(2000, "dat", self.folder, files=2, malformed_every=500)
+        self.assertListEqual([r["stage"] for r in results], STAGES)
+        for result in results:
+            self.assertGreater(result["seconds"], 0)
+            self.assertGreater(result["peak_bytes"], 0)
+        table = format_results(results, results[:2]).splitlines()
+        self.assertEqual(len(table), len(STAGES) + 1)
+        self.assertTrue(table[1].endswith("1.00   1.00"))
+        self.assertTrue(table[3].endswith("-      -"))
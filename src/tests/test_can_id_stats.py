@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+import numpy as np
+
+from helpers import build_frames
+from can_id_stats import CanIdStatsAccumulator, can_id_stats, bus_baudrates, frame_fields
+
+
+class CanIdStatsTestCase(TestCase):
+    """ Test the per CAN ID statistics of a log. """
+
+    def setUp(self):
+        # 0x100 every 10 ms on bus 1, 0x18FEF100 every 100 ms on bus 2, one 0x100 frame with DLC 4 on bus 2
+        fast = np.arange(100) * 0.01
+        slow = np.arange(10) * 0.1 + 0.005
+        self.timestamps = np.concatenate([fast, slow, [0.5]])
+        bus = np.concatenate([np.ones(100), np.full(10, 2), [2]])
+        can_id = np.concatenate([np.full(100, 0x100), np.full(10, 0x18FEF100), [0x100]])
+        ext = np.concatenate([np.zeros(100), np.ones(10), [0]])
+        dlc = np.concatenate([np.full(100, 8), np.full(10, 8), [4]])
+        order = np.argsort(self.timestamps, kind='stable')
+        self.timestamps = self.timestamps[order]
+        self.frames = build_frames(bus[order], can_id[order], ext[order], dlc[order], np.zeros((len(order), 8), dtype=np.uint8))
+        self.meta = {"unit_type": "test", "can_1": {"bus_number": 1, "baudrate": 500}, "can_2": {"bus_number": 2, "baudrate": 250}}
+
+    def test_bus_baudrates(self):
+        self.assertDictEqual(bus_baudrates(self.meta), {1: 500000.0, 2: 250000.0})
+        self.assertDictEqual(bus_baudrates({"unit_type": "test"}), {})
+
+    def test_can_id_stats(self):
+        stats = can_id_stats(*frame_fields(self.timestamps, self.frames), 1.0, bus_baudrates(self.meta))
+        self.assertListEqual([(s["bus"], s["can_id"], s["is_extended"], s["frame_count"]) for s in stats],
+                             [(1, 0x100, False, 100), (2, 0x100, False, 1), (2, 0x18FEF100, True, 10)])
+        fast, single, slow = stats
+        self.assertAlmostEqual(fast["first_time"], 0)
+        self.assertAlmostEqual(fast["last_time"], 0.99)
+        self.assertAlmostEqual(fast["period_mean"], 0.01)
+        self.assertAlmostEqual(fast["period_jitter"], 0, places=9)
+        self.assertDictEqual(fast["dlc_counts"], {"8": 100})
+        # 100 standard frames of 111 bits in 1 s at 500 kbit/s
+        self.assertAlmostEqual(fast["bus_load"], 100 * 111 / 500000)
+        self.assertIsNone(single["period_mean"])
+        self.assertIsNone(single["period_jitter"])
+        self.assertDictEqual(single["dlc_counts"], {"4": 1})
+        self.assertAlmostEqual(slow["period_mean"], 0.1)
+        self.assertAlmostEqual(slow["first_time"], 0.005)
+        self.assertAlmostEqual(slow["bus_load"], 10 * 131 / 250000)
+
+    def test_jitter_and_unknown_baudrate(self):
+        timestamps = np.array([0.0, 0.1, 0.3, 0.4])
+        frames = build_frames(np.ones(4), np.full(4, 0x200), 0, 8, np.zeros((4, 8), dtype=np.uint8))
+        stats = can_id_stats(*frame_fields(timestamps, frames), 0.4, {})
+        self.assertAlmostEqual(stats[0]["period_mean"], 0.4 / 3)
+        self.assertAlmostEqual(stats[0]["period_jitter"], np.std([0.1, 0.2, 0.1]))
+        self.assertIsNone(stats[0]["bus_load"])
+
+    def test_chunks(self):
+        """ Statistics added chunk by chunk equal those of the whole log, periods span the chunk boundaries """
+        whole = can_id_stats(*frame_fields(self.timestamps, self.frames), 1.0, bus_baudrates(self.meta))
+        stats = CanIdStatsAccumulator()
+        for start in range(0, len(self.frames), 7):
+            stats.add(*frame_fields(self.timestamps[start:start + 7], self.frames[start:start + 7]))
+        stats.add(*frame_fields(np.empty(0), self.frames[:0]))
+        chunked = stats.results(1.0, bus_baudrates(self.meta))
+        self.assertEqual(len(chunked), 3)
+        for a, b in zip(whole, chunked):
+            self.assertEqual(a.keys(), b.keys())
+            for key in a:
+                if isinstance(a[key], float):
+                    self.assertAlmostEqual(a[key], b[key])
+                else:
+                    self.assertEqual(a[key], b[key])
+        self.assertListEqual(can_id_stats(*frame_fields(np.empty(0), self.frames[:0]), 0, {}), [])
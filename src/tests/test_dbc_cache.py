@@ -0,0 +1,59 @@
+import os
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+from pathlib import Path
+
+from dbc_cache import DbcCache
+
+
+class DbcCacheTestCase(TestCase):
+    """ Test caching parsed DBC files. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/dbc_cache_test")
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.dbc = self.folder / "test.dbc"
+        shutil.copy(Path("tests/test_data/dbc/test_1.dbc"), self.dbc)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_cache_hit(self):
+        cache = DbcCache()
+        database = cache.get(self.dbc)
+        self.assertGreater(len(database.frames), 0)
+        with patch("dbc_cache.load_can_database") as load_can_database:
+            self.assertIs(cache.get(self.dbc), database)
+            # touching the file without changing it keeps the parsed database
+            os.utime(self.dbc, ns=(0, 0))
+            self.assertIs(cache.get(self.dbc), database)
+        load_can_database.assert_not_called()
+
+    def test_edit_invalidates_only_that_file(self):
+        other = self.folder / "other.dbc"
+        shutil.copy(self.dbc, other)
+        cache = DbcCache()
+        database, other_database = cache.get(self.dbc), cache.get(other)
+
+        with open(self.dbc, 'a') as f:
+            f.write("\nCM_ \"edited\";\n")
+        self.assertIsNot(cache.get(self.dbc), database)
+        self.assertIs(cache.get(other), other_database)
+
+    def test_compiled_form(self):
+        compiled_folder = self.folder / "compiled"
+        database = DbcCache(compiled_folder).get(self.dbc)
+        self.assertEqual(len(list(compiled_folder.glob("*.pickle"))), 1)
+
+        # a new cache (cold start) loads the compiled database instead of parsing the DBC
+        with patch("dbc_cache.load_can_database") as load_can_database:
+            cold_database = DbcCache(compiled_folder).get(self.dbc)
+        load_can_database.assert_not_called()
+        self.assertEqual([frame.arbitration_id.id for frame in cold_database.frames], [frame.arbitration_id.id for frame in database.frames])
+
+    def test_get_databases(self):
+        cache = DbcCache()
+        databases = cache.get_databases([(self.dbc, 0), (self.dbc, 2)])
+        self.assertEqual([bus for _, bus in databases], [0, 2])
+        self.assertIs(databases[0][0], databases[1][0])
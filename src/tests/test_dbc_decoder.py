@@ -0,0 +1,136 @@
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+from pathlib import Path
+
+import numpy as np
+from asammdf import MDF
+from asammdf.blocks.utils import load_can_database
+
+from dbc_decoder import decode_can_frames, can_database_supported
+from helpers import read_log_to_frames, frames_to_mf4, build_frames
+
+# little and big endian, signed, unaligned, float and multiplexed signals
+TEST_DBC = '''VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Mixed: 8 ECU
+ SG_ Flag : 0|1@1+ (1,0) [0|1] "" Vector__XXX
+ SG_ Counter : 1|4@1+ (1,0) [0|15] "" Vector__XXX
+ SG_ Temp : 5|11@1- (0.1,-40) [-100|100] "degC" Vector__XXX
+ SG_ Speed : 16|16@1+ (0.01,0) [0|655.35] "km/h" Vector__XXX
+ SG_ Torque : 39|16@0- (0.5,0) [-1000|1000] "Nm" Vector__XXX
+ SG_ Odd : 55|13@0+ (1,0) [0|8191] "" Vector__XXX
+ SG_ Byte : 56|8@1- (1,0) [-128|127] "" Vector__XXX
+ SG_ Skew : 44|8@1- (1,0) [-128|127] "" Vector__XXX
+
+BO_ 2566834709 Float: 8 ECU
+ SG_ Value : 0|32@1- (1,0) [0|0] "" Vector__XXX
+ SG_ Wide : 32|32@1+ (1,0) [0|0] "" Vector__XXX
+
+BO_ 512 Muxed: 8 ECU
+ SG_ Mode M : 0|8@1+ (1,0) [0|255] "" Vector__XXX
+ SG_ Always : 8|8@1+ (1,0) [0|255] "" Vector__XXX
+ SG_ A m0 : 16|16@1+ (1,0) [0|65535] "" Vector__XXX
+ SG_ B m1 : 16|12@0- (1,0) [0|0] "" Vector__XXX
+ SG_ C m1 : 40|24@1+ (1,0) [0|0] "" Vector__XXX
+
+SIG_VALTYPE_ 2566834709 Value : 1;
+'''
+
+
+class DbcDecoderTestCase(TestCase):
+    """ Test the compiled DBC decoder against asammdf's extract_bus_logging. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/dbc_decoder_test")
+        self.folder.mkdir(parents=True, exist_ok=True)
+        dbc = self.folder / "test.dbc"
+        dbc.write_text(TEST_DBC)
+        self.databases = [(load_can_database(dbc), 0)]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def random_frames(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(7)
+        ids = np.array([(256, 0), (0x18FECA15, 1), (512, 0), (300, 0)])
+        choice = rng.integers(0, len(ids), count)
+        data = rng.integers(0, 256, (count, 8), dtype=np.uint8)
+        data[:, 0] = np.where(choice == 2, rng.integers(0, 3, count), data[:, 0]) # multiplexor values 0, 1 and unknown 2
+        frames = build_frames(rng.integers(1, 3, count), ids[choice, 0], ids[choice, 1], 8, data)
+        return np.cumsum(rng.random(count)), frames
+
+    def assert_same_decoding(self, raw: MDF):
+        expected = raw.extract_bus_logging({"CAN": self.databases})
+        actual = decode_can_frames(raw, self.databases)
+        self.assertEqual(len(actual.groups), len(expected.groups))
+        for expected_group, actual_group in zip(expected.groups, actual.groups):
+            self.assertEqual(actual_group.channel_group.acq_name, expected_group.channel_group.acq_name)
+            self.assertEqual([ch.name for ch in actual_group.channels], [ch.name for ch in expected_group.channels])
+        for group_index, group in enumerate(expected.groups):
+            for channel_index, channel in enumerate(group.channels[1:], 1):
+                for raw_values in (True, False):
+                    want = expected.get(group=group_index, index=channel_index, raw=raw_values)
+                    got = actual.get(group=group_index, index=channel_index, raw=raw_values)
+                    np.testing.assert_array_equal(got.timestamps, want.timestamps, err_msg=channel.name)
+                    np.testing.assert_array_equal(got.samples, want.samples, err_msg=channel.name)
+                    self.assertEqual(got.samples.dtype, want.samples.dtype, channel.name)
+                    self.assertEqual(got.unit, want.unit)
+                    self.assertEqual(got.display_names, want.display_names)
+
+    def test_parity_with_extract_bus_logging(self):
+        self.assert_same_decoding(frames_to_mf4(*self.random_frames(5000)))
+
+    def test_parity_from_saved_raw_file(self):
+        timestamps, frames, _, _ = read_log_to_frames(Path("tests/test_data/test_data_all_good_lines.log"))
+        self.databases = [(load_can_database(Path("tests/test_data/dbc/test_1.dbc")), 0)]
+        raw_path = self.folder / "raw.mf4"
+        frames_to_mf4(timestamps, frames).save(raw_path)
+        with MDF(raw_path) as raw:
+            self.assert_same_decoding(raw)
+            self.assertIn("CAN1.BMS1.ChargeRelay", decode_can_frames(raw, self.databases).channels_db)
+
+    def test_bus_filter(self):
+        raw = frames_to_mf4(*self.random_frames(500))
+        self.databases = [(self.databases[0][0], 2)]
+        decoded = decode_can_frames(raw, self.databases)
+        self.assertTrue(all(group.channel_group.acq_name.startswith("CAN2 ") for group in decoded.groups))
+        self.assert_same_decoding(raw)
+
+    def test_message_in_two_databases(self):
+        """ every (database, bus) pair adds its own channel groups, also for messages another database decodes """
+        raw = frames_to_mf4(*self.random_frames(500))
+        database = self.databases[0][0]
+        for buses in ((0, 0), (1, 0), (0, 1)):
+            self.databases = [(database, buses[0]), (load_can_database(self.folder / "test.dbc"), buses[1])]
+            self.assert_same_decoding(raw)
+        self.assertEqual(len(decode_can_frames(raw, [(database, 0)] * 2).groups), 2 * len(decode_can_frames(raw, [(database, 0)]).groups))
+
+    def test_fragments(self):
+        """ large logs are decoded fragment by fragment like extract_bus_logging reads them, messages first seen in a
+            later fragment add their channel groups in the same order """
+        timestamps, frames = self.random_frames(3000)
+        # the multiplexed message only from the second half on
+        late = frames["CAN_DataFrame.ID"] == 512
+        late[1500:] = False
+        timestamps, frames = timestamps[~late], frames[~late]
+        raw_path = self.folder / "raw.mf4"
+        frames_to_mf4(timestamps, frames).save(raw_path)
+        with MDF(raw_path) as raw:
+            record_size = raw.groups[0].channel_group.samples_byte_nr + raw.groups[0].channel_group.invalidation_bytes_nr
+            raw.configure(read_fragment_size=400 * record_size)
+            with patch("dbc_decoder.READ_FRAGMENT_BYTES", 400 * record_size), patch.object(raw, "get", wraps=raw.get) as get:
+                self.assert_same_decoding(raw)
+                self.assertTrue(all(call.kwargs["record_count"] <= 400 for call in get.call_args_list if call.args == ("CAN_DataFrame",)))
+
+    def test_j1939_not_supported(self):
+        self.assertTrue(can_database_supported(self.databases[0][0]))
+        database = self.databases[0][0]
+        database.attributes["ProtocolType"] = "J1939"
+        self.assertFalse(can_database_supported(database))
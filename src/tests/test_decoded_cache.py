@@ -0,0 +1,105 @@
+import os
+import shutil
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from pathlib import Path
+
+from decoded_cache import DecodedCache
+
+
+class DecodedCacheTestCase(TestCase):
+    """ Test the on demand decoded file cache. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/decoded_cache_test")
+        self.decoded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def decode(self, key: str, size: int = 100, delay: float = 0.0):
+        def write(path: Path):
+            self.decoded.append(key)
+            time.sleep(delay)
+            path.write_bytes(key.encode().ljust(size, b"\0"))
+        return write
+
+    def read(self, cache: DecodedCache, key: str, size: int = 100) -> bytes:
+        with cache.open(key, self.decode(key, size)) as f:
+            return f.read()
+
+    def test_decodes_once(self):
+        cache = DecodedCache(self.folder, 1000)
+        self.assertTrue(self.read(cache, "a").startswith(b"a"))
+        self.assertTrue(self.read(cache, "a").startswith(b"a"))
+        self.assertListEqual(self.decoded, ["a"])
+        self.assertListEqual(sorted(p.name for p in self.folder.glob("*.mf4")), ["a.mf4"])
+
+    def test_concurrent_requests_decode_once(self):
+        cache = DecodedCache(self.folder, 1000)
+        results = []
+        def download():
+            with cache.open("a", self.decode("a", delay=0.2)) as f:
+                results.append(f.read())
+        threads = [threading.Thread(target=download) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(self.decoded, ["a"])
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(results), 4)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DecodedCache(self.folder, 250)
+        self.read(cache, "a")
+        self.read(cache, "b")
+        cache.index_path("b").write_bytes(b"index")
+        # make b older than a, a was read again
+        os.utime(cache.path("b"), (1, 1))
+        self.read(cache, "a")
+        self.read(cache, "c")
+        self.assertListEqual(sorted(p.name for p in self.folder.glob("*.mf4")), ["a.mf4", "c.mf4"])
+        # the time index goes with its decoded file
+        self.assertFalse(cache.index_path("b").exists())
+        # evicted files are decoded again
+        self.read(cache, "b")
+        self.assertListEqual(self.decoded, ["a", "b", "c", "b"])
+
+    def test_file_larger_than_cache_is_kept_until_next_decode(self):
+        cache = DecodedCache(self.folder, 50)
+        self.assertEqual(len(self.read(cache, "a")), 100)
+        self.assertTrue(cache.path("a").exists())
+        self.read(cache, "b")
+        self.assertFalse(cache.path("a").exists())
+
+    def test_failed_decode_leaves_nothing(self):
+        cache = DecodedCache(self.folder, 1000)
+        def fail(path: Path):
+            path.write_bytes(b"partial")
+            raise ValueError("bad DBC")
+        self.assertRaises(ValueError, cache.open, "a", fail)
+        self.assertListEqual(list(self.folder.glob("a*")), [])
+
+    def test_evicted_during_hit(self):
+        """ A file evicted while a hit opens it is decoded again without leaving a file open """
+        cache = DecodedCache(self.folder, 1000)
+        self.read(cache, "a")
+        files = []
+        def tracked_open(*args, **kwargs):
+            files.append(open(*args, **kwargs))
+            return files[-1]
+        utime, evicted = os.utime, []
+        def evicting_utime(path, *args):
+            # the first touch finds the file evicted
+            if not evicted:
+                evicted.append(path)
+                Path(path).unlink()
+            return utime(path, *args)
+        with patch("decoded_cache.open", tracked_open, create=True), patch("decoded_cache.os.utime", evicting_utime):
+            with cache.open("a", self.decode("a")) as f:
+                self.assertTrue(f.read().startswith(b"a"))
+        self.assertListEqual(self.decoded, ["a", "a"])
+        self.assertTrue(all(f.closed for f in files))
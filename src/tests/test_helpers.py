@@ -1,11 +1,14 @@
+import tempfile
 from unittest import TestCase
 from pathlib import Path, PosixPath
 from datetime import datetime
 
+import pandas as pd
 from pandas import Series
 import numpy as np
+from unittest.mock import patch
 
-from helpers import dat_line_to_data, df_to_mf4, read_log_to_df, is_val_float, is_val_hex, get_dbc_file_list
+from helpers import log_continues, dat_line_to_data, df_to_mf4, read_log_to_df, is_val_float, is_val_hex, hex_to_int, get_dbc_file_list, decode_hex_strings, parse_dat_lines, read_log_chunks, read_log_to_frames, frames_to_df, read_csv_data, decode_hex_column, CSV_READ_DTYPES, FRAME_DTYPES, split_byte_ranges, mf4_compression
 
 
 class LogHelperTestCase(TestCase):
@@ -21,6 +24,73 @@ class LogHelperTestCase(TestCase):
         df, meta, continues = read_log_to_df("tests/test_data/test_data_continues.log")
         self.assertTrue(continues)
 
+    def test_read_log_chunks(self):
+        """ chunked reading returns the same frames as reading the whole file """
+        for file in ["tests/test_data/test_data_bad_lines.log", "tests/test_data/test_data_continues.log",
+                     "tests/test_data/test_data_dat.log", "tests/test_data/test_data_dat_continues.log"]:
+            timestamps, frames, meta, continues = read_log_to_frames(file)
+            chunk_meta, chunks = read_log_chunks(file, 64)
+            chunks = list(chunks)
+            self.assertGreater(len(chunks), 1)
+            self.assertDictEqual(chunk_meta, meta)
+            self.assertEqual(chunks[-1][2], continues)
+            np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), timestamps)
+            np.testing.assert_array_equal(np.concatenate([chunk[1] for chunk in chunks]), frames)
+
+    def test_read_log_parallel(self):
+        """ parsing byte ranges on several processes returns exactly the frames of the serial path """
+        for file in ["tests/test_data/test_data_bad_lines.log", "tests/test_data/test_data_continues.log",
+                     "tests/test_data/test_data_dat.log", "tests/test_data/test_data_dat_continues.log"]:
+            df, meta, continues = read_log_to_df(file)
+            timestamps, frames, meta, continues = read_log_to_frames(file)
+            with patch("helpers.PARALLEL_PARSE_FILE_SIZE", 1), patch("helpers.PARALLEL_PARSE_WORKERS", 3):
+                parallel_df, parallel_meta, parallel_continues = read_log_to_df(file)
+                parallel_timestamps, parallel_frames, _, _ = read_log_to_frames(file)
+            self.assertEqual(parallel_continues, continues)
+            pd.testing.assert_frame_equal(parallel_df, df)
+            np.testing.assert_array_equal(parallel_timestamps, timestamps)
+            np.testing.assert_array_equal(parallel_frames, frames)
+
+            # streamed logs parse their chunks in the workers
+            with patch("helpers.PARALLEL_PARSE_FILE_SIZE", 1), patch("helpers.PARALLEL_PARSE_WORKERS", 3):
+                chunk_meta, chunks = read_log_chunks(file, 64)
+                chunks = list(chunks)
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(chunks[-1][2], continues)
+            np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), timestamps)
+            np.testing.assert_array_equal(np.concatenate([chunk[1] for chunk in chunks]), frames)
+
+    def test_read_log_with_blanks(self):
+        """ blanks around the lines and CRLF line ends are stripped like the line by line DAT reader did """
+        with open("tests/test_data/test_data_dat.log", 'rb') as f:
+            meta_line, header, *lines = f.read().splitlines()
+        clean = b"\n".join([meta_line, header, *lines, b"---- EOF NEXT FILE TO FOLLOW ----", lines[0]]) + b"\n"
+        blanks = [b" ", b"\t", b" \t ", b""]
+        padded = b"\r\n".join([meta_line, header, *[blanks[i % 4] + line + blanks[(i + 1) % 4] for i, line in enumerate(lines)],
+                               b"---- EOF NEXT FILE TO FOLLOW ---- ", lines[0]]) + b"\r\n"
+        with tempfile.TemporaryDirectory() as folder:
+            clean_file, padded_file = Path(folder) / "clean.log", Path(folder) / "padded.log"
+            clean_file.write_bytes(clean)
+            padded_file.write_bytes(padded)
+            timestamps, frames, _, continues = read_log_to_frames(clean_file)
+            padded_timestamps, padded_frames, _, padded_continues = read_log_to_frames(padded_file)
+            self.assertTrue(continues)
+            self.assertTrue(padded_continues)
+            self.assertTrue(log_continues(padded_file))
+            self.assertGreater(len(frames), 1)
+            np.testing.assert_array_equal(padded_timestamps, timestamps)
+            np.testing.assert_array_equal(padded_frames, frames)
+            _, chunks = read_log_chunks(padded_file, 64)
+            chunks = list(chunks)
+            self.assertTrue(chunks[-1][2])
+            np.testing.assert_array_equal(np.concatenate([chunk[1] for chunk in chunks]), frames)
+
+    def test_split_byte_ranges(self):
+        buf = np.frombuffer(b"aaaa\nbb\ncccccc\nd", dtype=np.uint8)
+        self.assertListEqual(split_byte_ranges(buf, 3), [(0, 5), (5, 15), (15, 16)])
+        self.assertListEqual(split_byte_ranges(buf, 1), [(0, 16)])
+        self.assertListEqual(split_byte_ranges(buf, 20), [(0, 5), (5, 8), (8, 15), (15, 16)])
+
     def test_log_multiple_continues(self):
         pass # todo: test multiple continues, this is not implemented yet
 
@@ -189,6 +259,56 @@ class LogHelperTestCase(TestCase):
         self.assertRaises(Exception, dat_line_to_data, "ac-1-123#1234") # test not number in timestamp
         self.assertRaises(Exception, dat_line_to_data, "123-A-100#00") # test no number in can bus number
 
+    def test_parse_dat_lines(self):
+        good_lines = ["1234-1-100#12345678", "778933.456-3-FFF#1234567890AABBCC", "778933.456-2-FFEC23#AC", "123.0-2-FFEC23#", "5.5-1-3A#ABC"]
+        bad_lines = ["ac", "ac-1-123#1234", "123-A-100#00", "1.0-1-XYZ#00", "1.0-1-100#00GG"]
+        buf = "\r\n".join(good_lines[:2] + bad_lines + good_lines[2:]).encode() + b"\n"
+        timestamps, frames, valid = parse_dat_lines(np.frombuffer(buf, dtype=np.uint8))
+        self.assertListEqual(valid.tolist(), [True] * 2 + [False] * len(bad_lines) + [True] * 3)
+        df = frames_to_df(timestamps, frames)
+
+        self.assertEqual(len(df), len(good_lines))
+        self.assertListEqual(list(df.columns), ["timestamp", "CAN_BUS", "CAN_EXT", "CAN_ID", "CAN_LEN"] + [f"Data{i}" for i in range(8)])
+        for (_, row), line in zip(df.iterrows(), good_lines[:4]):
+            expected = dat_line_to_data(line)
+            self.assertEqual(row["timestamp"], expected["timestamp"])
+            for column in ["CAN_BUS", "CAN_EXT", "CAN_LEN"]:
+                self.assertEqual(row[column], expected[column], f"{column} in {line}")
+            self.assertEqual(row["CAN_ID"], int(expected["CAN_ID"], 16))
+            for i in range(8):
+                self.assertEqual(row[f"Data{i}"], int(expected[f"Data{i}"], 16), f"Data{i} in {line}")
+
+        # odd number of data characters, the last byte is a single nibble
+        self.assertListEqual(df.iloc[4][[f"Data{i}" for i in range(8)]].tolist(), [0xAB, 0x0C, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(df.iloc[4]["CAN_LEN"], 2)
+
+        self.assertEqual(len(parse_dat_lines(np.frombuffer(b"", dtype=np.uint8))[1]), 0)
+
+    def test_read_log_to_df_matches_pandas(self):
+        """ the memory mapped CSV parser returns the same frames as read_csv + read_csv_data """
+        for file in ["tests/test_data/test_data_all_good_lines.log", "tests/test_data/test_data_bad_lines.log",
+                     "tests/test_data/test_data_bad_timestamp.log", "tests/test_data/test_data_continues.log"]:
+            df, meta, continues = read_log_to_df(file)
+            with open(file, 'rb') as f:
+                f.readline()
+                expected_df, expected_continues = read_csv_data(pd.read_csv(f, dtype=CSV_READ_DTYPES, on_bad_lines='skip'))
+            self.assertEqual(continues, expected_continues, file)
+            pd.testing.assert_frame_equal(df, expected_df, check_index_type=False)
+
+    def test_frame_dtypes(self):
+        """ CSV and DAT readers return the frame table in the compact FRAME_DTYPES layout """
+        for file in ["tests/test_data/test_data_all_good_lines.log", "tests/test_data/test_data_bad_lines.log",
+                     "tests/test_data/test_data_dat.log", "tests/test_data/test_data_with_csv_logtype.log"]:
+            df, meta, continues = read_log_to_df(file)
+            self.assertDictEqual(df.dtypes.to_dict(), {column: np.dtype(dtype) for column, dtype in FRAME_DTYPES.items()}, file)
+
+        csv = pd.DataFrame({"timestamp": ["1.0", "2.0", "3.0"], "CAN_BUS": ["1", "256", "1"], "CAN_EXT": ["0", "0", "1"],
+                            "CAN_ID": ["100", "100", "20000000"], "CAN_LEN": ["1", "1", "1"],
+                            **{f"Data{i}": ["FF", "00", "00"] for i in range(8)}})
+        df, continues = read_csv_data(csv)
+        self.assertEqual(len(df), 1) # bus 256 and a 30 bit ID do not fit a CAN frame
+        self.assertDictEqual(df.dtypes.to_dict(), {column: np.dtype(dtype) for column, dtype in FRAME_DTYPES.items()})
+
     def test_is_val_hex(self):
         self.assertTrue(is_val_hex("AC"))
         self.assertTrue(is_val_hex("ac"))
@@ -207,6 +327,37 @@ class LogHelperTestCase(TestCase):
         self.assertFalse(is_val_hex("99  8"))
         self.assertFalse(is_val_hex("ACT"))
 
+    def test_decode_hex_strings(self):
+        values = ["AC", "ac", "12", "00", "0", "1234567890F", "DEADBEEF", "0 ", " 18FFDD46", "",
+                  "Hey now brown cow", "YOU", "99  8", "ACT", "ÄB"]
+        decoded, valid = decode_hex_strings(np.array(values, dtype=object))
+        for value, result, is_valid in zip(values, decoded, valid):
+            self.assertEqual(is_valid, is_val_hex(value), value)
+            if is_valid:
+                self.assertEqual(int(result), hex_to_int(value), value)
+
+        # signs, 0x prefixes and digit separators are decoded like int(x, 16), CAN IDs and data bytes are never negative
+        for values in (["+1", "-1", "1_", "0x"], ["+1F", "0x1F", "0X1f", "1_0", " 0x1_F ", "-1F", "0x-1"]):
+            decoded, valid = decode_hex_strings(np.array(values, dtype=object))
+            for value, result, is_valid in zip(values, decoded, valid):
+                self.assertEqual(is_valid, is_val_hex(value) and hex_to_int(value) >= 0, value)
+                if is_valid:
+                    self.assertEqual(int(result), hex_to_int(value), value)
+
+        # dataframe columns of one or mixed widths decode like the plain strings
+        for values in (["AC", "0F", "11"], ["AC", "F", "", "0x1F", "ZZ", "123"]):
+            column = pd.Series(values, dtype="str")
+            decoded, valid = decode_hex_column(column)
+            expected, expected_valid = decode_hex_strings(np.array(values, dtype=object))
+            self.assertListEqual(valid.tolist(), expected_valid.tolist())
+            self.assertListEqual(decoded[valid].tolist(), expected[expected_valid].tolist())
+
+        # 2D input keeps its shape, one value per cell
+        decoded, valid = decode_hex_strings(np.array([["11", "81"], ["FF", "XX"]], dtype=object))
+        self.assertEqual(decoded.shape, (2, 2))
+        self.assertListEqual(valid.tolist(), [[True, True], [True, False]])
+        self.assertListEqual(decoded[0].tolist(), [0x11, 0x81])
+
     def test_is_val_float(self):
         self.assertTrue(is_val_float("123"))
         self.assertTrue(is_val_float(" 123"))
@@ -245,6 +396,13 @@ class LogHelperTestCase(TestCase):
             self.assertEqual(a,b)
         self.assertListEqual(first_item[6:], [0,0,0])
 
+    def test_mf4_compression(self):
+        self.assertEqual(mf4_compression("none"), 0)
+        self.assertEqual(mf4_compression("deflate"), 1)
+        self.assertEqual(mf4_compression("transposed_deflate"), 2)
+        self.assertRaises(ValueError, mf4_compression, "zip")
+        self.assertRaises(ValueError, mf4_compression, "not_avilable")
+
     def tearDown(self):
         """ Remove all testing airports from the db. """
         pass
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+import shutil
+import threading
+import time
+from unittest import TestCase
+from pathlib import Path
+
+from input_watcher import InputWatcher
+
+
+class InputWatcherTestCase(TestCase):
+    """ Test waiting for new input files. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/watch")
+        (self.folder / "uploading").mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def upload(self, file_name: str, delay: float = 0.0):
+        """ write the file to the uploading folder and rename it into the watched folder like the webserver does """
+        time.sleep(delay)
+        (self.folder / "uploading" / file_name).write_text("{}\n")
+        os.rename(self.folder / "uploading" / file_name, self.folder / file_name)
+
+    def test_wakes_up_on_upload(self):
+        watcher = InputWatcher(self.folder, poll_interval=10, debounce=0.2)
+        self.assertIsNotNone(watcher.fd)
+        threading.Thread(target=self.upload, args=("a.log", 0.1)).start()
+        start = time.monotonic()
+        self.assertTrue(watcher.wait())
+        self.assertLess(time.monotonic() - start, 5)
+        watcher.close()
+
+    def test_debounces_burst(self):
+        watcher = InputWatcher(self.folder, poll_interval=10, debounce=0.5)
+        for i in range(5):
+            self.upload(f"{i}.log")
+        self.assertTrue(watcher.wait())
+        # the whole burst was drained by the first wait
+        start = time.monotonic()
+        watcher.poll_interval = 0.3
+        self.assertFalse(watcher.wait())
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        watcher.close()
+
+    def test_ignores_other_files(self):
+        watcher = InputWatcher(self.folder, poll_interval=0.3, debounce=0.1)
+        self.upload("notes.txt")
+        self.assertFalse(watcher.wait())
+        watcher.close()
+
+    def test_polling_fallback(self):
+        watcher = InputWatcher(self.folder, poll_interval=0.2, debounce=0.1, use_inotify=False)
+        self.assertIsNone(watcher.fd)
+        self.upload("a.log")
+        start = time.monotonic()
+        self.assertFalse(watcher.wait())
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        watcher.close()
@@ -1,24 +1,30 @@
 from curses import meta
 import os
 import shutil
+import time
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from pathlib import Path
-from sqlalchemy import inspect
+from sqlalchemy import inspect, event
 
 from dateutil import parser
 
 from asammdf import MDF
+from asammdf.blocks import v4_constants as v4c
 
 import pandas as pd
+import numpy as np
 
 from database.crud import *
-from database import ENGINE
+from database import ENGINE, db_session
 
 from config import DATA_FOLDER
 
-from helpers import read_log_to_df, get_dbc_file_list, df_to_mf4
-from log_converter import get_files_to_process, create_unit_folders, archive_log, merge_continued_logs, setup_environment, save_mf4_files, process_log_file, process_new_files
+from helpers import read_log_to_df, get_dbc_file_list, df_to_mf4, frames_to_mf4, legacy_log_hash, log_content_hash
+from signal_preview import preview_signals, read_signal_preview
+from decoded_cache import DecodedCache
+from signal_query import load_time_index, query_signals
+from log_converter import get_files_to_process, create_unit_folders, archive_log, merge_continued_logs, setup_environment, save_mf4_files, process_log_file, process_new_files, plan_chains, planned_continuations, decode_raw_mf4
 
 
 class LogConverterTestCase(TestCase):
@@ -163,6 +169,25 @@ class LogConverterTestCase(TestCase):
         raw_mf4.close()
         processed_mf4.close()
 
+    def test_merge_long_chain(self):
+        """ A chain of several continuation files is merged with the right offsets and bookkeeping """
+        file_names = [f"chain_{i:02d}.log" for i in range(4)]
+        for file_name in file_names[:-1]:
+            shutil.copy(Path("tests/test_data/test_data_continues.log"), self.subfolders[0] / file_name)
+        shutil.copy(Path("tests/test_data/test_data_continues1.log"), self.subfolders[0] / file_names[-1])
+
+        result = process_log_file(file_names[0], self.global_dbc_files)
+        self.assertEqual(result['log_len'], 12)
+        log_db_entry = get_log_file(result['uuid'])
+        self.assertEqual(log_db_entry.samples, 12)
+        self.assertAlmostEqual(log_db_entry.length_sec, 5.2)
+        for i in range(1, 4):
+            self.assertTrue((self.unit_output_folder / "in_logs_processed" / f"{result['output_file_name']}_cont{i:02d}.log").exists())
+
+        with MDF(self.unit_output_folder / "raw_logs" / f"raw-{result['output_file_name']}.mf4") as raw_mf4:
+            timestamps = raw_mf4.to_dataframe(time_from_zero=False).index.to_numpy()
+        np.testing.assert_allclose(timestamps, [0.01, 0.076, 1.0, 1.01, 1.076, 2.0, 2.01, 2.076, 3.0, 5.0, 5.1, 5.2])
+
     def test_merge_continued_logs_fails_unit_number(self):
         """ Test the merging of continued logs. """
         
@@ -266,6 +291,72 @@ class LogConverterTestCase(TestCase):
         raw_mf4.close()
         processed_mf4.close()
 
+    def test_merge_continued_logs_streaming(self):
+        """ Streaming mode produces the same results as the in memory path """
+        with patch("log_converter.STREAMING_FILE_SIZE", 1), patch("log_converter.STREAMING_CHUNK_BYTES", 64):
+            self.test_merge_continued_logs_csv()
+            self.tearDown()
+            self.setUp()
+            self.test_merge_continued_logs_dat()
+
+    def test_streaming_hash_matches_in_memory(self):
+        """ A log processed in memory is detected as duplicate when it is uploaded again and streamed """
+        file_name = "test_data_all_good_lines.log"
+        shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+        process_status = process_log_file(file_name, self.global_dbc_files)
+        self.assertEqual(process_status['status'], "processed")
+
+        shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+        with patch("log_converter.STREAMING_FILE_SIZE", 1), patch("log_converter.STREAMING_CHUNK_BYTES", 64):
+            process_status = process_log_file(file_name, self.global_dbc_files)
+        self.assertEqual(process_status['status'], "duplicate")
+
+    def test_duplicate_is_not_parsed(self):
+        """ A re-uploaded log is found by its content hash before it is parsed """
+        file_name = "test_data_dat.log"
+        shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+        self.assertEqual(process_log_file(file_name, self.global_dbc_files)['status'], "processed")
+
+        shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+        with patch("log_converter.read_log_to_frames") as read_log_to_frames, patch("log_converter.stream_log_to_mf4") as stream_log_to_mf4:
+            self.assertEqual(process_log_file(file_name, self.global_dbc_files)['status'], "duplicate")
+        read_log_to_frames.assert_not_called()
+        stream_log_to_mf4.assert_not_called()
+
+    def test_legacy_hash_duplicate(self):
+        """ A re-upload of a log stored with the hash of its parsed frames is a duplicate and gets the content hash stored """
+        # hashes the earlier read_log_to_df + hash_pandas_object stored for these logs
+        legacy_hashes = {"test_data_all_good_lines.log": "2f51872c2f365a08e17728d02cc466461516f26d42716792b14e37371aec400f",
+                         "test_data_continues.log": "23698708aa9a46ae099c0c880806bc4aea73bd33fd14e9fdf79f387e5db7b6c1",
+                         "test_data_dat.log": "061898c0fcb8cffdc79fcea76144858498bbd7f6bd3e390f4d6c33f9b979b835"}
+        for file_name, legacy_hash in legacy_hashes.items():
+            self.setUp()
+            shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+            path = self.subfolders[0] / file_name
+            self.assertEqual(legacy_log_hash(path).hex(), legacy_hash)
+            _, meta, _ = read_log_to_df(path)
+            with db_session() as session:
+                log = create_log_in_database(meta['log_start_time'], meta['unit_number'], bytes.fromhex(legacy_hash), meta['unit_type'], file_name, session=session)
+
+            # the log is parsed for the legacy hash while no transaction is open
+            transactions = []
+            def checked_legacy_log_hash(file):
+                self.assertListEqual(transactions, [])
+                return legacy_log_hash(file)
+            listeners = {"begin": lambda connection: transactions.append(connection),
+                         "commit": lambda connection: transactions.remove(connection),
+                         "rollback": lambda connection: transactions.remove(connection)}
+            for name, listener in listeners.items():
+                event.listen(ENGINE, name, listener)
+            try:
+                with patch("log_converter.legacy_log_hash", checked_legacy_log_hash):
+                    self.assertEqual(process_log_file(file_name, self.global_dbc_files)['status'], "duplicate")
+            finally:
+                for name, listener in listeners.items():
+                    event.remove(ENGINE, name, listener)
+            self.assertEqual(get_log_file(log.id).hash, log_content_hash(Path("tests/test_data") / file_name))
+            self.tearDown()
+
     def test_process_same_file_twice(self):
         """ Process one file twice, the second time it should do nothing and delete the input file."""
 
@@ -322,6 +413,44 @@ class LogConverterTestCase(TestCase):
         # assert that raw logs exist
         self.assertTrue((self.unit_output_folder / "raw_logs" / f"raw-{db_logs[0].file_stem}.mf4").exists())
 
+    def test_process_new_files_workers(self):
+        """ The worker pool gives the same database entries and archive as the serial path """
+        file_names = ["test_data_continues.log", "test_data_continues1.log", "test_data_continues1_different_unit_num.log", "test_data_with_csv_logtype.log"]
+
+        def run(workers):
+            for file_name in file_names:
+                shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+            n_processed = process_new_files(workers)
+            self.assertListEqual(get_files_to_process(self.subfolders[0]), [])
+            logs = {(log.unit_number, log.log_number, log.samples, log.length_sec, log.processing_status)
+                    for unit in ["test", "12345", "E00123"] for log in get_all_logs_for_unit(unit)}
+            archived = sorted(str(p.relative_to(self.subfolders[2])) for p in self.subfolders[2].rglob("*.log"))
+            return n_processed, logs, archived
+
+        serial = run(1)
+        self.tearDown()
+        self.setUp()
+        pooled = run(2)
+        self.assertEqual(serial[0], 3)
+        self.assertEqual(pooled, serial)
+
+    def test_plan_chains(self):
+        """ The pre-scan chains continued logs of the same unit, also when files of other units are in between """
+        file_names = ["test_data_continues.log", "test_data_continues1.log", "test_data_continues1_different_unit_num.log",
+                      "test_data_dat_continues.log", "test_data_dat_continues1.log", "test_data_with_csv_logtype.log"]
+        for file_name in file_names:
+            shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+        self.assertDictEqual(plan_chains(file_names), {"test": [file_names[0:2], file_names[3:5]], "12345": [[file_names[2]]], "E00123": [[file_names[5]]]})
+
+        interleaved = ["test_data_continues.log", "test_data_continues1_different_unit_num.log", "test_data_continues1.log"]
+        self.assertDictEqual(plan_chains(interleaved), {"test": [[interleaved[0], interleaved[2]]], "12345": [[interleaved[1]]]})
+
+        # a log processed on its own plans only its own chain, with the same result
+        for files in (file_names, interleaved):
+            for chains in plan_chains(files).values():
+                for chain in chains:
+                    self.assertListEqual(planned_continuations(chain[0], files), chain[1:])
+
     def test_save_mf4_files(self):
         """ Test saving data to MF4 format with mocks. """
         # get some data
@@ -332,7 +461,7 @@ class LogConverterTestCase(TestCase):
 
         # save the dataframe to MF4
         test_global_dbc_flles = [(f, 0) for f in get_dbc_file_list(DATA_FOLDER / "dbc")]
-        save_mf4_files(df, meta, test_global_dbc_flles)
+        save_mf4_files(df_to_mf4(df), meta, test_global_dbc_flles)
 
         # check that all MF4s saved to the correct folder
         raw_output_file = self.unit_output_folder / f"raw_logs/raw-{meta['file_stem']}.mf4"
@@ -379,6 +508,153 @@ class LogConverterTestCase(TestCase):
         raw_mf4.close()
         processed_mf4.close()
 
+    def test_save_mf4_files_parallel_decode(self):
+        """ Decoding per DBC file and bus in worker processes gives the same decoded MF4 as one decode. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        # frames on bus 0 match the DBC files of any bus, they must not be decoded twice
+        bus_zero = df.assign(CAN_BUS=np.where(df['CAN_BUS'] == 2, 0, df['CAN_BUS']).astype(df['CAN_BUS'].dtype))
+        processed_output_file = self.unit_output_folder / "test_00001.mf4"
+        for frames in (df, bus_zero):
+            decoded = []
+            for workers in (1, 2):
+                meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+                with patch("log_converter.DECODE_WORKERS", workers):
+                    save_mf4_files(df_to_mf4(frames), meta, self.global_dbc_files)
+                decoded.append(MDF(processed_output_file.rename(self.unit_output_folder / f"decoded_{workers}.mf4")))
+
+            serial, parallel = decoded
+            self.assertEqual(list(parallel.channels_db), list(serial.channels_db))
+            self.assertEqual([g.channel_group.acq_name for g in parallel.groups], [g.channel_group.acq_name for g in serial.groups])
+            pd.testing.assert_frame_equal(parallel.to_dataframe(), serial.to_dataframe())
+            # the temporary parts are removed
+            self.assertEqual(sorted(p.name for p in self.unit_output_folder.glob("*.mf4")), ["decoded_1.mf4", "decoded_2.mf4"])
+            serial.close()
+            parallel.close()
+
+    def test_save_mf4_files_replaces_files(self):
+        """ Processing a log again replaces its raw and decoded MF4 and decodes the new raw frames. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+        save_mf4_files(df_to_mf4(df.iloc[:2]), meta, self.global_dbc_files)
+        save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+        self.assertListEqual(sorted(p.name for p in self.unit_output_folder.rglob("*.mf4")), ["raw-test_00001.mf4", "test_00001.mf4"])
+        with MDF(self.unit_output_folder / "raw_logs/raw-test_00001.mf4") as raw_mf4:
+            self.assertEqual(len(raw_mf4.get("CAN_DataFrame.ID").samples), len(df))
+        with MDF(self.unit_output_folder / "test_00001.mf4") as processed_mf4:
+            self.assertEqual(len(processed_mf4.to_dataframe()), 3)
+
+    def test_save_mf4_files_compressed(self):
+        """ Compressed raw and decoded MF4s are written in DZ blocks and hold the same data as uncompressed ones. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+        raw_output_file = self.unit_output_folder / "raw_logs/raw-test_00001.mf4"
+        processed_output_file = self.unit_output_folder / "test_00001.mf4"
+
+        def block_types(path):
+            with MDF(path) as mf4:
+                return {block.block_type for group in mf4.groups for block in group.get_data_blocks()}
+
+        save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+        self.assertSetEqual(block_types(raw_output_file), {v4c.DT_BLOCK})
+        self.assertSetEqual(block_types(processed_output_file), {v4c.DT_BLOCK})
+        with MDF(raw_output_file) as raw_mf4, MDF(processed_output_file) as processed_mf4:
+            expected = raw_mf4.to_dataframe(), processed_mf4.to_dataframe()
+            relay = processed_mf4.get("CAN1.BMS1.ChargeRelay")
+
+        with patch("log_converter.RAW_COMPRESSION", v4c.CompressionAlgorithm.TRANSPOSED_DEFLATE), \
+                patch("log_converter.DECODED_COMPRESSION", v4c.CompressionAlgorithm.DEFLATE):
+            save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+        # the compressed files replace the uncompressed ones
+        self.assertListEqual(sorted(p.name for p in self.unit_output_folder.rglob("*.mf4")), ["raw-test_00001.mf4", "test_00001.mf4"])
+        self.assertSetEqual(block_types(raw_output_file), {v4c.DZ_BLOCK_TRANSPOSED})
+        self.assertSetEqual(block_types(processed_output_file), {v4c.DZ_BLOCK_DEFLATE})
+        with MDF(raw_output_file) as raw_mf4, MDF(processed_output_file) as processed_mf4:
+            pd.testing.assert_frame_equal(raw_mf4.to_dataframe(), expected[0])
+            pd.testing.assert_frame_equal(processed_mf4.to_dataframe(), expected[1])
+            frames = raw_mf4.get("CAN_DataFrame").samples
+            np.testing.assert_array_equal(frames["CAN_DataFrame.ID"], df["CAN_ID"])
+            np.testing.assert_array_equal(frames["CAN_DataFrame.DataBytes"], df[[f"Data{i}" for i in range(8)]].to_numpy())
+            compressed_relay = processed_mf4.get("CAN1.BMS1.ChargeRelay")
+            self.assertEqual(len(compressed_relay), 3)
+            np.testing.assert_array_equal(compressed_relay.samples, relay.samples)
+            np.testing.assert_array_equal(compressed_relay.timestamps, relay.timestamps)
+
+    def test_save_mf4_files_decode_on_demand(self):
+        """ Only the raw MF4 is written when decoding on demand, decoding it later gives the usual decoded MF4. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+        raw_output_file = self.unit_output_folder / "raw_logs/raw-test_00001.mf4"
+        processed_output_file = self.unit_output_folder / "test_00001.mf4"
+        save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+        with MDF(processed_output_file) as processed_mf4:
+            expected = processed_mf4.to_dataframe()
+        processed_output_file.unlink()
+
+        with patch("log_converter.DECODE_ON_DEMAND", True):
+            save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+        self.assertTrue(raw_output_file.exists())
+        self.assertFalse(processed_output_file.exists())
+
+        with patch("log_converter.DBC_FOLDER", DATA_FOLDER / "dbc"):
+            decode_raw_mf4(raw_output_file, processed_output_file, meta['unit_type'])
+        with MDF(processed_output_file) as processed_mf4:
+            pd.testing.assert_frame_equal(processed_mf4.to_dataframe(), expected)
+
+        # decoded through the cache like the webserver does, only the cached file is left behind
+        cache = DecodedCache(DATA_FOLDER / "decoded_cache", 10 ** 9)
+        with patch("log_converter.DBC_FOLDER", DATA_FOLDER / "dbc"):
+            cache.open("log", lambda path: decode_raw_mf4(raw_output_file, path, meta['unit_type'])).close()
+        with MDF(cache.path("log")) as cached_mf4:
+            pd.testing.assert_frame_equal(cached_mf4.to_dataframe(), expected)
+        self.assertListEqual(sorted(p.name for p in cache.folder.iterdir()), [".evict.lock", ".log.lock", "log.mf4"])
+        shutil.rmtree(cache.folder)
+
+    def test_save_mf4_files_signal_export(self):
+        """ The decoded signals are exported next to the decoded MF4. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+        export_folder = DATA_FOLDER / "signals"
+        for workers in (1, 2):
+            with patch("log_converter.SIGNAL_EXPORT_FORMAT", "parquet"), patch("log_converter.SIGNAL_EXPORT_FOLDER", export_folder), \
+                    patch("log_converter.DECODE_WORKERS", workers):
+                save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+            table = pd.read_parquet(export_folder / "unit_type=test/unit_number=test/date=2021-01-10/test_00001.parquet")
+            self.assertListEqual(list(table.columns), ["timestamp", "CAN1.BMS1.ChargeRelay", "CAN1.BMS1.DischargeRelay"])
+            self.assertEqual(len(table), 3)
+            # the first BMS1 frame is 1 s into the log
+            self.assertEqual(str(table["timestamp"].iloc[0]), "2021-01-10 12:01:02+00:00")
+        shutil.rmtree(export_folder)
+
+    def test_save_mf4_files_signal_preview(self):
+        """ The signal previews are written next to the decoded MF4. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+        preview_file = self.unit_output_folder / "previews/test_00001.npz"
+        for workers in (1, 2):
+            with patch("log_converter.DECODE_WORKERS", workers):
+                save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+            self.assertListEqual(list(preview_signals(preview_file)), ["CAN1.BMS1.ChargeRelay", "CAN1.BMS1.DischargeRelay"])
+            preview = read_signal_preview(preview_file, "CAN1.BMS1.ChargeRelay")
+            self.assertEqual(preview["bucket_seconds"], 1)
+            self.assertEqual(len(preview["time"]), 3)
+            preview_file.unlink()
+
+        with patch("log_converter.PREVIEW_BUCKET_SECONDS", []):
+            save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+        self.assertFalse(preview_file.exists())
+
+    def test_save_mf4_files_time_index(self):
+        """ The time index is written next to the decoded MF4 and locates its signals. """
+        df, meta, continues = read_log_to_df(Path("tests/test_data/test_data_all_good_lines.log"))
+        meta.update({"unit_output_folder": self.unit_output_folder, "log_num": 1, "file_stem": "test_00001"})
+        for workers in (1, 2):
+            with patch("log_converter.DECODE_WORKERS", workers):
+                save_mf4_files(df_to_mf4(df), meta, self.global_dbc_files)
+            index = load_time_index(self.unit_output_folder / "time_index/test_00001.npz")
+            with MDF(self.unit_output_folder / "test_00001.mf4") as processed_mf4:
+                chunks = list(query_signals(processed_mf4, index, ["CAN1.BMS1.DischargeRelay"], 1.5, 3))
+            self.assertListEqual([timestamps.tolist() for _, timestamps, _ in chunks], [[2.0, 3.0]])
+
     def test_process_log_file_good(self):
         """ Test processing a log file. """
 
@@ -421,6 +697,130 @@ class LogConverterTestCase(TestCase):
         self.assertEqual(log.samples, 6)
         self.assertEqual(log.log_start_time, parser.parse("2021-01-10T12:01:01.0000Z").replace(tzinfo=None))
 
+    def test_process_log_file_can_id_stats(self):
+        """ Processing stores the statistics of every CAN ID, streamed logs get the same statistics. """
+        file_name = "test_data_all_good_lines.log"
+        for streaming_size in (0, 1):
+            shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+            with patch("log_converter.STREAMING_FILE_SIZE", streaming_size), patch("log_converter.STREAMING_CHUNK_BYTES", 64):
+                result = process_log_file(file_name, self.global_dbc_files)
+            stats = get_can_id_stats_for_log(result["uuid"])
+            self.assertListEqual([(s.bus, s.can_id, s.is_extended, s.frame_count) for s in stats],
+                                 [(1, 0x3A, False, 3), (1, 0x391, False, 1), (1, 0x18FFDD46, True, 1), (2, 0xCF62602, True, 1)])
+            self.assertEqual(stats[0].first_time, 1)
+            self.assertEqual(stats[0].last_time, 3)
+            self.assertEqual(stats[0].period_mean, 1)
+            self.assertDictEqual(stats[0].dlc_counts, {"5": 1, "8": 2})
+            # 2 frames of 111 bits and one of 87 bits over 5 s at 500 kbit/s
+            self.assertAlmostEqual(stats[0].bus_load, (2 * 111 + 87) / (5 * 500000))
+            self.tearDown()
+            self.setUp()
+
+    def test_process_log_file_search_index(self):
+        """ Processed logs are found by signal and CAN ID from the database indexes. """
+        for file_name in ["test_data_all_good_lines.log", "test_data_dat.log"]:
+            shutil.copy(Path("tests/test_data") / file_name, self.subfolders[0] / file_name)
+            process_log_file(file_name, self.global_dbc_files)
+
+        rows = search_logs(signal="ChargeRelay")
+        self.assertListEqual([log.original_file_name for log, _, _, _ in rows], ["test_data_all_good_lines.log"])
+        log, unit_type, first_time, last_time = rows[0]
+        self.assertEqual(unit_type, "test")
+        self.assertEqual((first_time, last_time), (1, 3))
+        self.assertEqual(len(search_logs(signal="CAN1.BMS1.ChargeRelay", unit_number="test")), 1)
+        self.assertListEqual(search_logs(signal="ChargeRelay", unit_type="other"), [])
+        # the log covers 12:01:01 to 12:01:06
+        self.assertEqual(len(search_logs(signal="ChargeRelay", start=datetime(2021, 1, 10, 12, 1, 5), end=datetime(2021, 1, 11))), 1)
+        self.assertListEqual(search_logs(signal="ChargeRelay", start=datetime(2021, 1, 10, 12, 2)), [])
+
+        rows = search_logs(can_id=0x18FFDD46)
+        self.assertIn("test_data_all_good_lines.log", [log.original_file_name for log, _, _, _ in rows])
+        self.assertEqual(rows[0][2:], (0, 0))
+        self.assertListEqual(search_logs(can_id=0x7FF), [])
+        self.assertEqual(len(search_logs()), 2)
+
+    def test_process_log_file_same_message_in_two_dbc_files(self):
+        """ Signals decoded by two DBC files are indexed once over all of their samples. """
+        shutil.copy(DATA_FOLDER / "dbc/test_1.dbc", DATA_FOLDER / "dbc/test_2.dbc")
+        global_dbc_files = [(f, 0) for f in get_dbc_file_list(DATA_FOLDER / "dbc")]
+        shutil.copy(Path("tests/test_data/test_data_all_good_lines.log"), self.subfolders[0] / "test_data_all_good_lines.log")
+        result = process_log_file("test_data_all_good_lines.log", global_dbc_files)
+        self.assertEqual(get_log_file(result["uuid"]).processing_status, "Processing Complete")
+        rows = search_logs(signal="CAN1.BMS1.ChargeRelay")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][2:], (1, 3))
+
+    def test_process_log_file_stage_timings(self):
+        """ Processing stores the time and sizes of every stage, continuation files count as parsed input. """
+        shutil.copy(Path("tests/test_data/test_data_continues.log"), self.subfolders[0] / "test_data_continues.log")
+        shutil.copy(Path("tests/test_data/test_data_continues1.log"), self.subfolders[0] / "test_data_continues1.log")
+        input_size = sum((self.subfolders[0] / f).stat().st_size for f in ["test_data_continues.log", "test_data_continues1.log"])
+        # building the raw MF4 is timed as part of writing it
+        def slow_frames_to_mf4(*args):
+            time.sleep(0.2)
+            return frames_to_mf4(*args)
+        with patch("log_converter.frames_to_mf4", slow_frames_to_mf4):
+            result = process_log_file("test_data_continues.log", self.global_dbc_files)
+        timings = {t.stage: t for t in get_log_stage_timings(result["uuid"])}
+        self.assertGreaterEqual(timings["raw_write"].seconds, 0.2)
+        self.assertLess(timings["can_id_stats"].seconds, 0.2)
+        self.assertTrue({"hash", "db_lookup", "archive", "parse", "can_id_stats", "raw_write", "decode", "decoded_write",
+                         "decoded_outputs", "db_write", "total"} <= timings.keys())
+        self.assertTrue(all(t.seconds >= 0 for t in timings.values()))
+        self.assertEqual(timings["parse"].bytes_in, input_size)
+        self.assertEqual(timings["parse"].frames, result["log_len"])
+        self.assertEqual(timings["total"].frames, result["log_len"])
+        self.assertEqual(timings["total"].bytes_in, input_size)
+        raw_size = (self.unit_output_folder / "raw_logs" / f"raw-{result['output_file_name']}.mf4").stat().st_size
+        decoded_size = (self.unit_output_folder / f"{result['output_file_name']}.mf4").stat().st_size
+        self.assertEqual(timings["raw_write"].bytes_out, raw_size)
+        self.assertEqual(timings["total"].bytes_out, raw_size + decoded_size)
+        self.assertAlmostEqual(timings["total"].frames_per_second, result["log_len"] / timings["total"].seconds)
+
+        summary = {row["stage"]: row for row in get_stage_timing_summary([1e-9, 1e6], [1, 1e12])}
+        self.assertEqual(summary["total"]["count"], 1)
+        self.assertEqual(summary["total"]["frames"], result["log_len"])
+        self.assertListEqual(summary["total"]["seconds_buckets"], [0, 1])
+        self.assertListEqual(summary["total"]["frames_per_second_buckets"], [0, 1])
+        self.assertDictEqual(count_logs_by_status(), {"Processing Complete": 1})
+
+    def test_process_log_file_transactions(self):
+        """ A processed log is stored in a few units of work instead of one transaction per CRUD call. """
+        commits = []
+        def count_commit(connection):
+            commits.append(connection)
+        event.listen(ENGINE, "commit", count_commit)
+        try:
+            shutil.copy(Path("tests/test_data/test_data_all_good_lines.log"), self.subfolders[0] / "test_data_all_good_lines.log")
+            result = process_log_file("test_data_all_good_lines.log", self.global_dbc_files)
+        finally:
+            event.remove(ENGINE, "commit", count_commit)
+        self.assertLessEqual(len(commits), 4)
+        log = get_log_file(result["uuid"])
+        self.assertEqual(log.processing_status, "Processing Complete")
+        self.assertEqual(log.samples, 6)
+        self.assertEqual(len(get_can_id_stats_for_log(log.id)), 4)
+
+    def test_db_session(self):
+        """ CRUD calls in a unit of work see each other's changes and are rolled back together. """
+        start_time = parser.parse("2021-01-10T12:01:01")
+        with self.assertRaises(RuntimeError), db_session() as session:
+            first = create_log_in_database(start_time, "uow", b"1", "test", session=session)
+            second = create_log_in_database(start_time, "uow", b"2", "test", session=session)
+            self.assertEqual((first.log_number, second.log_number), (1, 2))
+            update_log_file_status(first.id, "LOG file Moved", session=session)
+            self.assertEqual(get_log_file(first.id, session=session).processing_status, "LOG file Moved")
+            raise RuntimeError
+        self.assertIsNone(get_vehicle_by_unit_number("uow"))
+        self.assertListEqual(get_all_logs_for_unit("uow"), [])
+
+        with db_session() as session:
+            log = create_log_in_database(start_time, "uow", b"1", "test", session=session)
+        # readable after the unit of work is committed and closed
+        self.assertEqual(log.file_stem, "uow_00001")
+        self.assertTrue(does_log_exist(b"1", "uow"))
+        self.assertEqual(get_vehicle_by_unit_number("uow").vehicle_type, "test")
+
     def tearDown(self):
         """ Remove all testing data from the db. """
         with ENGINE.begin() as connection:
@@ -0,0 +1,48 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from processing_metrics import StageTimer, prometheus_metrics
+
+
+class ProcessingMetricsTestCase(TestCase):
+    """ Test the stage timer and the Prometheus metrics. """
+
+    def test_stage_timer(self):
+        with patch("processing_metrics.time.perf_counter", side_effect=[0.0, 1.0, 3.0, 4.0, 4.5, 10.0]):
+            timer = StageTimer()
+            with timer.stage("parse", bytes_in=100):
+                pass
+            timer.add("parse", frames=50)
+            with timer.stage("parse", bytes_in=20):
+                pass
+            timer.add("raw_write", bytes_out=30)
+            rows = timer.results(100)
+        self.assertListEqual(rows, [
+            {"stage": "parse", "seconds": 2.5, "frames": 50, "bytes_in": 120, "bytes_out": None, "frames_per_second": 20.0},
+            {"stage": "raw_write", "seconds": 0.0, "frames": None, "bytes_in": None, "bytes_out": 30, "frames_per_second": None},
+            {"stage": "total", "seconds": 10.0, "frames": 100, "bytes_in": 120, "bytes_out": 30, "frames_per_second": 10.0}])
+
+    def test_prometheus_metrics(self):
+        summaries = [
+            {"stage": "parse", "count": 2, "seconds": 1.5, "frames": 300, "bytes_in": 900, "bytes_out": None,
+             "frames_per_second_count": 2, "frames_per_second_sum": 400.0, "seconds_buckets": [1] + [2] * 15, "frames_per_second_buckets": [2] * 10},
+            {"stage": "total", "count": 2, "seconds": 3.0, "frames": 300, "bytes_in": 900, "bytes_out": 500,
+             "frames_per_second_count": 2, "frames_per_second_sum": 200.0, "seconds_buckets": [0] * 7 + [2] * 9, "frames_per_second_buckets": [2] * 10}]
+        text = prometheus_metrics({"in_logs": 3, "in_logs/uploading": 1}, {"Processing Complete": 2}, summaries)
+        lines = text.splitlines()
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn('caninsight_queue_files{folder="in_logs"} 3', lines)
+        self.assertIn('caninsight_queue_files{folder="in_logs/uploading"} 1', lines)
+        self.assertIn('caninsight_logs{status="Processing Complete"} 2', lines)
+        self.assertIn("caninsight_processed_logs_total 2", lines)
+        self.assertIn("caninsight_processed_frames_total 300", lines)
+        self.assertIn('caninsight_processed_bytes_total{direction="out"} 500', lines)
+        self.assertIn('caninsight_log_frames_per_second_bucket{le="10000"} 2', lines)
+        self.assertIn("caninsight_log_frames_per_second_sum 200", lines)
+        self.assertIn('caninsight_stage_seconds_bucket{stage="parse",le="0.005"} 1', lines)
+        self.assertIn('caninsight_stage_seconds_bucket{stage="parse",le="+Inf"} 2', lines)
+        self.assertIn('caninsight_stage_seconds_sum{stage="total"} 3', lines)
+        self.assertIn('caninsight_stage_seconds_count{stage="total"} 2', lines)
+        self.assertEqual(sum(line.startswith("# TYPE") for line in lines), 7)
+        # an empty database has only the queue and the stage histogram header
+        self.assertNotIn("caninsight_processed_logs_total", prometheus_metrics({"in_logs": 0}, {}, []))
@@ -0,0 +1,90 @@
+import shutil
+from unittest import TestCase
+from pathlib import Path
+
+import numpy as np
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from asammdf.blocks.utils import load_can_database
+
+from helpers import frames_to_mf4, build_frames
+from signal_export import export_decoded_signals, decoded_signal_batches, signal_export_schema
+
+TEST_DBC = '''VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (0.25,0) [0|16383] "rpm" Vector__XXX
+ SG_ Temp : 16|8@1- (1,-40) [-168|87] "degC" Vector__XXX
+
+BO_ 512 Gear: 8 ECU
+ SG_ Gear : 0|4@1+ (1,0) [0|15] "" Vector__XXX
+'''
+
+
+class SignalExportTestCase(TestCase):
+    """ Test exporting decoded signals to partitioned Parquet and Arrow files. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/signal_export_test")
+        self.folder.mkdir(parents=True, exist_ok=True)
+        dbc = self.folder / "test.dbc"
+        dbc.write_text(TEST_DBC)
+        self.databases = [(load_can_database(dbc), 0)]
+        # 100 messages 10 minutes apart, alternating between the two IDs on two buses
+        count = 100
+        data = np.zeros((count, 8), dtype=np.uint8)
+        data[:, 0] = np.arange(count)
+        data[:, 2] = 50
+        frames = build_frames(np.arange(count) % 4 // 2 + 1, np.where(np.arange(count) % 2, 512, 256), 0, 8, data)
+        self.timestamps = np.arange(count) * 600.0
+        self.decoded = frames_to_mf4(self.timestamps, frames).extract_bus_logging({"CAN": self.databases})
+        self.meta = {"unit_type": "truck", "unit_number": "42", "file_stem": "42_00001", "log_start_time": "2021-01-10T12:00:00.000Z"}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_decoded_signal_batches(self):
+        schema = signal_export_schema(self.decoded)
+        self.assertListEqual(sorted(schema.names), sorted(["timestamp", "CAN1.Engine.Speed", "CAN1.Engine.Temp", "CAN1.Gear.Gear",
+                                                           "CAN2.Engine.Speed", "CAN2.Engine.Temp", "CAN2.Gear.Gear"]))
+        # one batch per message and bus, all with the columns of every signal
+        batches = list(decoded_signal_batches(self.decoded, self.meta['log_start_time']))
+        self.assertEqual(len(batches), 4)
+        self.assertTrue(all(batch.schema == schema and batch.num_rows == 25 for batch in batches))
+        engine = next(batch for batch in batches if batch.column("CAN1.Engine.Speed").null_count == 0)
+        times = engine.column("timestamp").to_numpy()
+        self.assertEqual(str(times[0]), "2021-01-10T12:00:00.000000")
+        self.assertTrue(np.all(np.diff(times) == np.timedelta64(2400, "s")))
+        np.testing.assert_array_equal(engine.column("CAN1.Engine.Speed").to_numpy(), np.arange(0, 100, 4) * 0.25)
+        self.assertEqual(engine.column("CAN1.Engine.Temp")[0].as_py(), 10)
+        # signals of other messages are null
+        self.assertEqual(engine.column("CAN1.Gear.Gear").null_count, 25)
+        gear = next(batch for batch in batches if batch.column("CAN2.Gear.Gear").null_count == 0)
+        self.assertEqual(gear.column("CAN2.Gear.Gear")[0].as_py(), 3)
+
+    def test_export_parquet_partitions(self):
+        paths = export_decoded_signals(self.decoded, self.meta, self.folder / "signals", "parquet")
+        # 1000 minutes from noon cross midnight
+        self.assertListEqual([p.relative_to(self.folder / "signals").as_posix() for p in paths], [
+            "unit_type=truck/unit_number=42/date=2021-01-10/42_00001.parquet",
+            "unit_type=truck/unit_number=42/date=2021-01-11/42_00001.parquet"])
+        dataset = ds.dataset(self.folder / "signals", format="parquet", partitioning="hive")
+        self.assertEqual(dataset.count_rows(), 100)
+        next_day = dataset.to_table(columns=["timestamp", "CAN2.Engine.Speed"], filter=(ds.field("date") == "2021-01-11"))
+        self.assertEqual(next_day.num_rows, 28)
+        self.assertListEqual(next_day.column_names, ["timestamp", "CAN2.Engine.Speed"])
+        # every message and bus is its own row group
+        self.assertListEqual([pq.ParquetFile(p).num_row_groups for p in paths], [4, 4])
+
+    def test_export_arrow(self):
+        paths = export_decoded_signals(self.decoded, self.meta, self.folder / "signals", "arrow")
+        self.assertTrue(all(p.suffix == ".arrow" for p in paths))
+        self.assertEqual(sum(feather.read_table(p).num_rows for p in paths), 100)
+        self.assertListEqual(list(self.folder.glob("signals/**/*.tmp")), [])
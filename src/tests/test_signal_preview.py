@@ -0,0 +1,72 @@
+import shutil
+from unittest import TestCase
+from pathlib import Path
+
+import numpy as np
+from asammdf.blocks.utils import load_can_database
+
+from helpers import frames_to_mf4, build_frames
+from signal_preview import bucket_signal, build_signal_preview, save_signal_preview, preview_signals, read_signal_preview
+
+TEST_DBC = '''VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (1,0) [0|65535] "rpm" Vector__XXX
+ SG_ Mode : 16|2@1+ (1,0) [0|3] "" Vector__XXX
+
+VAL_ 256 Mode 0 "Off" 1 "Idle" 2 "Run" 3 "Boost" ;
+'''
+
+
+class SignalPreviewTestCase(TestCase):
+    """ Test the min/max/mean signal preview pyramids. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/signal_preview_test")
+        self.folder.mkdir(parents=True, exist_ok=True)
+        dbc = self.folder / "test.dbc"
+        dbc.write_text(TEST_DBC)
+        # 1000 messages 0.1 s apart, the speed counts up
+        count = 1000
+        data = np.zeros((count, 8), dtype=np.uint8)
+        data[:, 0:2] = np.arange(count, dtype="<u2").view(np.uint8).reshape(count, 2)
+        frames = build_frames(np.ones(count), np.full(count, 256), 0, 8, data)
+        self.decoded = frames_to_mf4(np.arange(count) * 0.1, frames).extract_bus_logging({"CAN": [(load_can_database(dbc), 0)]})
+        self.path = self.folder / "previews" / "test_00001.npz"
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_bucket_signal(self):
+        buckets = bucket_signal(np.array([0.0, 0.5, 1.2, 3.9, 4.0]), np.array([1.0, 3.0, np.nan, 7.0, 2.0]), 2.0)
+        np.testing.assert_array_equal(buckets, [[0, 1, 3, 2], [2, 7, 7, 7], [4, 2, 2, 2]])
+        self.assertEqual(bucket_signal(np.array([1.0]), np.array([np.nan]), 1.0).shape, (0, 4))
+
+    def test_build_signal_preview(self):
+        preview = build_signal_preview(self.decoded, [1, 10, 60])
+        # text signals have no preview
+        self.assertListEqual(sorted(preview), ["1/CAN1.Engine.Speed", "10/CAN1.Engine.Speed", "60/CAN1.Engine.Speed"])
+        self.assertEqual(len(preview["1/CAN1.Engine.Speed"]), 100)
+        np.testing.assert_array_equal(preview["10/CAN1.Engine.Speed"][3], [30, 300, 399, 349.5])
+        np.testing.assert_array_equal(preview["60/CAN1.Engine.Speed"][:, 0], [0, 60])
+
+    def test_read_signal_preview(self):
+        save_signal_preview(self.decoded, self.path, [1, 10, 60])
+        self.assertDictEqual(preview_signals(self.path), {"CAN1.Engine.Speed": [1.0, 10.0, 60.0]})
+        # the finest bucket size that fits in max_points
+        self.assertEqual(read_signal_preview(self.path, "CAN1.Engine.Speed", max_points=100)["bucket_seconds"], 1)
+        self.assertEqual(read_signal_preview(self.path, "CAN1.Engine.Speed", max_points=50)["bucket_seconds"], 10)
+        self.assertEqual(read_signal_preview(self.path, "CAN1.Engine.Speed", max_points=1)["bucket_seconds"], 60)
+        zoomed = read_signal_preview(self.path, "CAN1.Engine.Speed", start=20.5, end=25, max_points=50)
+        self.assertEqual(zoomed["bucket_seconds"], 1)
+        self.assertListEqual(zoomed["time"], [20, 21, 22, 23, 24, 25])
+        self.assertListEqual(zoomed["min"][:2], [200, 210])
+        self.assertListEqual(zoomed["max"][:2], [209, 219])
+        self.assertIsNone(read_signal_preview(self.path, "CAN1.Engine.Missing"))
+        self.assertListEqual(list(self.path.parent.glob("*.tmp")), [])
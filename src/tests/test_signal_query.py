@@ -0,0 +1,120 @@
+import json
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+from asammdf import MDF
+from asammdf.blocks.utils import load_can_database
+
+from helpers import frames_to_mf4, build_frames
+from signal_query import TIME_INDEX_STEP, save_time_index, load_time_index, build_time_index, signal_spans, query_signals, json_stream, arrow_stream
+
+TEST_DBC = '''VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (1,0) [0|65535] "rpm" Vector__XXX
+ SG_ Mode : 16|2@1+ (1,0) [0|3] "" Vector__XXX
+
+BO_ 512 Gear: 8 ECU
+ SG_ Gear : 0|4@1+ (1,0) [0|15] "" Vector__XXX
+
+VAL_ 256 Mode 0 "Off" 1 "Idle" 2 "Run" 3 "Boost" ;
+'''
+
+
+class SignalQueryTestCase(TestCase):
+    """ Test time range signal queries with the per-log time index. """
+
+    def setUp(self):
+        self.folder = Path("tests/tmp/signal_query_test")
+        self.folder.mkdir(parents=True, exist_ok=True)
+        dbc = self.folder / "test.dbc"
+        dbc.write_text(TEST_DBC)
+        # 100000 messages 10 ms apart alternating between the two IDs, the speed counts up
+        count = 100000
+        data = np.zeros((count, 8), dtype=np.uint8)
+        data[:, 0:2] = (np.arange(count) % 65536).astype("<u2").view(np.uint8).reshape(count, 2)
+        data[:, 2] = np.arange(count) % 4
+        frames = build_frames(np.ones(count), np.where(np.arange(count) % 2, 512, 256), 0, 8, data)
+        decoded = frames_to_mf4(np.arange(count) * 0.01, frames).extract_bus_logging({"CAN": [(load_can_database(dbc), 0)]})
+        self.decoded_path = self.folder / "test_00001.mf4"
+        self.index_path = self.folder / "time_index/test_00001.npz"
+        decoded.save(self.decoded_path)
+        save_time_index(decoded, self.index_path)
+        decoded.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_time_index(self):
+        index = load_time_index(self.index_path)
+        self.assertListEqual(index["names"].tolist(), ["CAN1.Engine.Speed", "CAN1.Engine.Mode", "CAN1.Gear.Gear"])
+        self.assertEqual(len(index["time/0"]), -(-50000 // TIME_INDEX_STEP))
+        np.testing.assert_allclose(index["time/0"][:2], [0, TIME_INDEX_STEP * 0.02])
+        # built from the channel metadata and the timestamps read in chunks, the signal samples are not read
+        with MDF(self.decoded_path) as mf4, patch.object(mf4, "select", side_effect=AssertionError), \
+                patch("signal_query.QUERY_CHUNK_RECORDS", 4 * TIME_INDEX_STEP):
+            built = build_time_index(mf4)
+        for key in index:
+            np.testing.assert_array_equal(index[key], built[key])
+
+    def test_signal_spans(self):
+        # the Gear message decoded by two DBC files gives one span over both channel groups
+        database = load_can_database(self.folder / "test.dbc")
+        with MDF(self.decoded_path) as mf4, patch.object(mf4, "select", side_effect=AssertionError):
+            spans = signal_spans(mf4)
+        self.assertListEqual(spans, [
+            {"name": "CAN1.Engine.Speed", "signal": "Speed", "sample_count": 50000, "first_time": 0.0, "last_time": 999.98},
+            {"name": "CAN1.Engine.Mode", "signal": "Mode", "sample_count": 50000, "first_time": 0.0, "last_time": 999.98},
+            {"name": "CAN1.Gear.Gear", "signal": "Gear", "sample_count": 50000, "first_time": 0.01, "last_time": 999.99}])
+        frames = build_frames(np.ones(2), np.full(2, 512), 0, 8, np.zeros((2, 8), dtype=np.uint8))
+        decoded = frames_to_mf4(np.array([1.0, 2.0]), frames).extract_bus_logging({"CAN": [(database, 0), (database, 0)]})
+        self.assertListEqual(signal_spans(decoded), [{"name": "CAN1.Gear.Gear", "signal": "Gear", "sample_count": 4, "first_time": 1.0, "last_time": 2.0}])
+
+    def test_query_reads_only_the_window(self):
+        with MDF(self.decoded_path) as mf4:
+            reads = []
+            get = mf4.get
+            def counting_get(*args, **kwargs):
+                reads.append(kwargs.get("record_count"))
+                return get(*args, **kwargs)
+            with patch.object(mf4, "get", counting_get):
+                chunks = list(query_signals(mf4, load_time_index(self.index_path), ["CAN1.Engine.Speed", "CAN1.Engine.Mode"], 100, 110))
+            # a 10 s window of 500 Engine messages reads at most two index steps more
+            self.assertTrue(all(count <= 500 + 2 * TIME_INDEX_STEP for count in reads))
+            self.assertListEqual([name for name, _, _ in chunks], ["CAN1.Engine.Speed", "CAN1.Engine.Mode"])
+            name, timestamps, values = chunks[0]
+            np.testing.assert_allclose(timestamps, np.arange(10000, 11001, 2) * 0.01)
+            np.testing.assert_array_equal(values, np.arange(10000, 11001, 2))
+            # text values are given raw
+            np.testing.assert_array_equal(chunks[1][2], np.arange(10000, 11001, 2) % 4)
+
+    def test_query_whole_log_in_chunks(self):
+        with MDF(self.decoded_path) as mf4, patch("signal_query.QUERY_CHUNK_RECORDS", 4096):
+            chunks = list(query_signals(mf4, load_time_index(self.index_path), ["CAN1.Gear.Gear"]))
+        self.assertEqual(len(chunks), -(-50000 // 4096))
+        np.testing.assert_array_equal(np.concatenate([values for _, _, values in chunks]), np.arange(1, 100000, 2) % 16)
+
+    def test_unknown_signal(self):
+        with MDF(self.decoded_path) as mf4:
+            self.assertRaises(KeyError, query_signals, mf4, load_time_index(self.index_path), ["CAN1.Engine.Missing"])
+
+    def test_streams(self):
+        chunks = [("CAN1.A.B", np.array([0.0, 1.0]), np.array([1.0, np.nan])), ("CAN1.A.B", np.array([2.0]), np.array([3])),
+                  ("CAN1.A.C", np.array([0.0]), np.array([5]))]
+        self.assertDictEqual(json.loads(b"".join(json_stream(iter(chunks), "2021-01-10T12:00:00"))), {
+            "log_start_time": "2021-01-10T12:00:00",
+            "signals": {"CAN1.A.B": [[0.0, 1.0], [1.0, None], [2.0, 3.0]], "CAN1.A.C": [[0.0, 5.0]]}})
+        self.assertDictEqual(json.loads(b"".join(json_stream(iter([]), "2021-01-10T12:00:00"))), {"log_start_time": "2021-01-10T12:00:00", "signals": {}})
+        table = pa.ipc.open_stream(b"".join(arrow_stream(iter(chunks)))).read_all()
+        self.assertListEqual(table.column("signal").to_pylist(), ["CAN1.A.B", "CAN1.A.B", "CAN1.A.B", "CAN1.A.C"])
+        self.assertListEqual(table.column("time").to_pylist(), [0.0, 1.0, 2.0, 0.0])
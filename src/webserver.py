@@ -1,20 +1,29 @@
 from fileinput import filename
 from pydoc import render_doc
-from database.crud import get_vehicle_by_unit_number, new_log_file, new_vehicle, get_vehicles, get_comments_for_log, get_logs_for_unit, get_log_file, new_log_comment, delete_log_comment, hide_show_log_file, update_log_file_headline, update_log_file_status, update_vehicle
-from flask import Flask, request, render_template, send_from_directory, redirect, url_for
+from database.crud import get_vehicle_by_unit_number, new_log_file, new_vehicle, get_vehicles, get_comments_for_log, get_logs_for_unit, get_log_file, new_log_comment, delete_log_comment, hide_show_log_file, update_log_file_headline, update_log_file_status, update_vehicle, get_can_id_stats_for_log, search_logs, get_stage_timing_summary, count_logs_by_status
+from flask import Flask, request, render_template, send_from_directory, send_file, redirect, url_for, jsonify, abort, Response
 from webserver_logger import handler
 import os
+from datetime import timedelta
+from dateutil import parser
 
-from config import DATA_FOLDER
+from config import DATA_FOLDER, DECODE_ON_DEMAND, DECODED_CACHE_FOLDER, DECODED_CACHE_MAX_BYTES
 from database.upgrade import init_and_upgrade_db
 
 from file_helpers import check_files_exist
+from decoded_cache import DecodedCache
+from log_converter import decode_raw_mf4
+from signal_preview import preview_path, preview_signals, read_signal_preview
+from processing_metrics import SECONDS_BUCKETS, FRAMES_PER_SECOND_BUCKETS, prometheus_metrics
+from signal_query import QUERY_FORMATS, time_index_path, load_time_index, build_time_index, save_time_index, query_signals, json_stream, arrow_stream
+from asammdf import MDF
 
 app = Flask(__name__)
 app.logger.addHandler(handler)
 init_and_upgrade_db()
 
 output_files = DATA_FOLDER / "out/"
+decoded_cache = DecodedCache(DECODED_CACHE_FOLDER, DECODED_CACHE_MAX_BYTES)
 
 @app.route('/')
 def index():
@@ -124,14 +133,96 @@ def get_log(uuid):
     comments = get_comments_for_log(log.id)
 
 
-    return render_template("log_file.html", vehicle=vehicle, log=log, comments=comments, files_exist=check_files_exist(output_files, vehicle, log))
+    files_exist = check_files_exist(output_files, vehicle, log)
+    if DECODE_ON_DEMAND and files_exist["raw_logs"]:
+        # decoded when downloaded
+        files_exist["regular_log"] = True
+    has_preview = preview_path(output_files/vehicle.vehicle_type/log.unit_number, log.file_stem).is_file()
+    return render_template("log_file.html", vehicle=vehicle, log=log, comments=comments, files_exist=files_exist, has_preview=has_preview,
+                           can_id_stats=get_can_id_stats_for_log(log.id))
 
 
 @app.route("/logs/<uuid>/download/")
 def download_log(uuid):
     log = get_log_file(uuid)
     vehicle = get_vehicle_by_unit_number(log.unit_number)
-    return send_from_directory(directory=output_files/vehicle.vehicle_type/log.unit_number, path=log.file_stem + ".mf4", as_attachment=True, download_name=log.file_stem + ".mf4")
+    unit_folder = output_files/vehicle.vehicle_type/log.unit_number
+    raw_path = unit_folder/"raw_logs"/("raw-" + log.file_stem + ".mf4")
+    if (unit_folder/(log.file_stem + ".mf4")).is_file() or not raw_path.is_file():
+        return send_from_directory(directory=unit_folder, path=log.file_stem + ".mf4", as_attachment=True, download_name=log.file_stem + ".mf4")
+    # decoded on demand, concurrent downloads of the same log wait for a single decode
+    decoded = decoded_cache.open(str(log.id), lambda path: decode_raw_mf4(raw_path, path, vehicle.vehicle_type))
+    return send_file(decoded, as_attachment=True, download_name=log.file_stem + ".mf4")
+
+@app.route("/logs/<uuid>/preview/")
+def log_preview_signals(uuid):
+    """ The signals of the log's preview with their bucket sizes in seconds """
+    log = get_log_file(uuid)
+    vehicle = get_vehicle_by_unit_number(log.unit_number)
+    path = preview_path(output_files/vehicle.vehicle_type/log.unit_number, log.file_stem)
+    if not path.is_file():
+        abort(404)
+    return jsonify(preview_signals(path))
+
+@app.route("/logs/<uuid>/preview/<path:signal>")
+def log_preview_signal(uuid, signal):
+    """ Min, max and mean of a signal between the start and end seconds of the log, read only from the preview """
+    log = get_log_file(uuid)
+    vehicle = get_vehicle_by_unit_number(log.unit_number)
+    path = preview_path(output_files/vehicle.vehicle_type/log.unit_number, log.file_stem)
+    if not path.is_file():
+        abort(404)
+    preview = read_signal_preview(path, signal, request.args.get("start", type=float), request.args.get("end", type=float),
+                                  request.args.get("points", 1000, type=int))
+    if preview is None:
+        abort(404)
+    return jsonify(preview)
+
+@app.route("/logs/<uuid>/signals")
+def query_log_signals(uuid):
+    """ Stream the samples of the comma separated signal names between t0 and t1 seconds from the log start as JSON
+        or, with format=arrow, as an Arrow IPC stream. Only the MF4 blocks of the window are read. """
+    log = get_log_file(uuid)
+    vehicle = get_vehicle_by_unit_number(log.unit_number)
+    unit_folder = output_files/vehicle.vehicle_type/log.unit_number
+    names = [name for name in request.args.get("names", "").split(",") if name]
+    query_format = request.args.get("format", "json")
+    if not names or query_format not in QUERY_FORMATS:
+        abort(400)
+
+    decoded_path = unit_folder/(log.file_stem + ".mf4")
+    raw_path = unit_folder/"raw_logs"/("raw-" + log.file_stem + ".mf4")
+    if decoded_path.is_file():
+        decoded = open(decoded_path, 'rb')
+    elif DECODE_ON_DEMAND and raw_path.is_file():
+        decoded = decoded_cache.open(str(log.id), lambda path: decode_raw_mf4(raw_path, path, vehicle.vehicle_type))
+    else:
+        abort(404)
+    mf4 = MDF(decoded)
+    if decoded_path.is_file():
+        index_path = time_index_path(unit_folder, log.file_stem)
+        index = load_time_index(index_path) if index_path.is_file() else build_time_index(mf4)
+    else:
+        # logs decoded on demand keep their time index next to the cached file, built by the first query
+        index_path = decoded_cache.index_path(str(log.id))
+        try:
+            index = load_time_index(index_path)
+        except FileNotFoundError:
+            index = save_time_index(mf4, index_path)
+    try:
+        chunks = query_signals(mf4, index, names, request.args.get("t0", type=float), request.args.get("t1", type=float))
+    except KeyError:
+        mf4.close()
+        decoded.close()
+        abort(404)
+
+    def stream():
+        try:
+            yield from arrow_stream(chunks) if query_format == "arrow" else json_stream(chunks, log.log_start_time.isoformat())
+        finally:
+            mf4.close()
+            decoded.close()
+    return Response(stream(), mimetype=QUERY_FORMATS[query_format])
 
 @app.route("/logs/<uuid>/download_raw/")
 def download_raw_log(uuid):
@@ -145,6 +236,40 @@ def download_input_log(uuid):
     vehicle = get_vehicle_by_unit_number(log.unit_number)
     return send_from_directory(directory=output_files/vehicle.vehicle_type/log.unit_number/"in_logs_processed", path=log.file_stem + ".log", as_attachment=True, download_name=log.file_stem + ".log")
 
+@app.route("/search")
+def search():
+    """ Logs containing a signal or CAN ID, filtered by unit and time range, from the database indexes. For example
+        /search?unit_number=123456&signal=EngineSpeed&start=2025-03-01&end=2025-04-01 or can_id=0x18FEF100 """
+    try:
+        can_id = int(request.args["can_id"], 0) if request.args.get("can_id") else None
+        start = parser.isoparse(request.args["start"]) if request.args.get("start") else None
+        end = parser.isoparse(request.args["end"]) if request.args.get("end") else None
+    except ValueError:
+        abort(400)
+    rows = search_logs(unit_number=request.args.get("unit_number") or None, unit_type=request.args.get("unit_type") or None,
+                       signal=request.args.get("signal") or None, can_id=can_id, start=start, end=end,
+                       limit=request.args.get("limit", 1000, type=int))
+    results = []
+    for log, vehicle_type, first_time, last_time in rows:
+        result = {"id": log.id, "unit_number": log.unit_number, "unit_type": vehicle_type, "log_number": log.log_number,
+                  "file_stem": log.file_stem, "log_start_time": log.log_start_time.isoformat() if log.log_start_time else None,
+                  "log_end_time": log.log_end_time.isoformat() if log.log_end_time else None,
+                  "url": url_for("get_log", uuid=log.id)}
+        if first_time is not None and log.log_start_time:
+            # the span of the signal or CAN ID in the log
+            result["first_time"] = (log.log_start_time + timedelta(seconds=first_time)).isoformat()
+            result["last_time"] = (log.log_start_time + timedelta(seconds=last_time)).isoformat()
+        results.append(result)
+    return jsonify(results)
+
+@app.route("/metrics")
+def metrics():
+    """ Prometheus metrics of the input queue and of the stage timings the processor stores for every log """
+    queue_depth = {folder: sum(f.lower().endswith('.log') for f in os.listdir(DATA_FOLDER / folder)) if (DATA_FOLDER / folder).is_dir() else 0
+                   for folder in ["in_logs", "in_logs/uploading"]}
+    summaries = get_stage_timing_summary(SECONDS_BUCKETS, FRAMES_PER_SECOND_BUCKETS)
+    return Response(prometheus_metrics(queue_depth, count_logs_by_status(), summaries), mimetype="text/plain; version=0.0.4")
+
 @app.route("/v")
 def api_version():
     app.logger.debug("Version route was hit")